@@ -14,4 +14,9 @@ def create_app():
 
     from app.routes import api
     app.register_blueprint(api, url_prefix='/api')
+
+    # Warm the rent dataset in the background instead of on the request path
+    from app.controllers.realt_controller import is_rent_configured, rent_refresher
+    if is_rent_configured():
+        rent_refresher.start()
     return app
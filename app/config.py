@@ -0,0 +1,50 @@
+import os
+
+DATA_FOLDER = os.getenv("DATA_FOLDER", "data")
+
+# Seconds during which a cached snapshot is trusted without re-checking the file on disk
+SNAPSHOT_STAT_INTERVAL = float(os.getenv("SNAPSHOT_STAT_INTERVAL", "1"))
+
+# Publish watchlist and rent snapshots once into memory-mapped files shared by all gunicorn workers
+SHARED_SNAPSHOTS = os.getenv("SHARED_SNAPSHOTS", "0") == "1"
+SHARED_SNAPSHOT_FOLDER = os.getenv("SHARED_SNAPSHOT_FOLDER", os.path.join(DATA_FOLDER, "shared"))
+
+# On-disk format of the watchlist snapshots: "json" (pretty-printed) or "columnar" (memory-mapped binary)
+SNAPSHOT_FORMAT = os.getenv("SNAPSHOT_FORMAT", "json").lower()
+
+# Days during which every snapshot version is kept; older versions are thinned to one per month
+SNAPSHOT_RETENTION_DAYS = int(os.getenv("SNAPSHOT_RETENTION_DAYS", "90"))
+
+# Timeout (seconds) for every call to an upstream sheet or API
+UPSTREAM_TIMEOUT = float(os.getenv("UPSTREAM_TIMEOUT", "30"))
+
+# Seconds between two freshness checks of the background rent refresher
+RENT_REFRESH_INTERVAL = float(os.getenv("RENT_REFRESH_INTERVAL", "3600"))
+
+# Seconds a request waits for another worker's refresh before serving stale data
+REFRESH_WAIT_TIMEOUT = float(os.getenv("REFRESH_WAIT_TIMEOUT", "20"))
+
+# Watchlists refreshed from Google Sheets by POST /api/load_companies
+ENABLED_WATCHLISTS = [name.strip().upper() for name in os.getenv("ENABLED_WATCHLISTS", "CTO").split(",") if name.strip()]
+
+# Concurrent sheet downloads / parses during an ingestion
+INGESTION_MAX_WORKERS = int(os.getenv("INGESTION_MAX_WORKERS", "4"))
+
+# Processes running the refresh jobs queued by POST /api/load_companies (per gunicorn worker)
+JOBS_MAX_WORKERS = int(os.getenv("JOBS_MAX_WORKERS", "1"))
+# Seconds a finished job stays visible at GET /api/jobs/<id>
+JOBS_RETENTION_SECONDS = float(os.getenv("JOBS_RETENTION_SECONDS", str(24 * 3600)))
+
+# Alpha Vantage API (legacy ingestion path, COMPANIES_SOURCE=alphavantage)
+COMPANIES_SOURCE = os.getenv("COMPANIES_SOURCE", "sheets")
+ALPHA_VANTAGE_URL = os.getenv("ALPHA_VANTAGE_URL", "https://www.alphavantage.co/query")
+ALPHA_VANTAGE_API_KEY = os.getenv("ALPHA_VANTAGE_API_KEY", "")
+# Token bucket sized to the API key's quota: sustained calls per minute and burst size
+ALPHA_VANTAGE_CALLS_PER_MINUTE = float(os.getenv("ALPHA_VANTAGE_CALLS_PER_MINUTE", "5"))
+ALPHA_VANTAGE_BURST = int(os.getenv("ALPHA_VANTAGE_BURST", "1"))
+ALPHA_VANTAGE_MAX_WORKERS = int(os.getenv("ALPHA_VANTAGE_MAX_WORKERS", "4"))
+ALPHA_VANTAGE_RETRIES = int(os.getenv("ALPHA_VANTAGE_RETRIES", "3"))
+# On-disk cache of Alpha Vantage payloads (gzip, LRU-evicted above this size)
+ALPHA_VANTAGE_CACHE_MAX_BYTES = int(os.getenv("ALPHA_VANTAGE_CACHE_MAX_BYTES", str(50 * 1024 * 1024)))
+# Alpha Vantage calls allowed per day for the API key
+ALPHA_VANTAGE_DAILY_QUOTA = int(os.getenv("ALPHA_VANTAGE_DAILY_QUOTA", "25"))
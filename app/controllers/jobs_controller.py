@@ -0,0 +1,10 @@
+from flask import jsonify
+from app.domain.jobs_domain import FINISHED, read_job
+
+def get_job_data(job_id: str):
+    job = read_job(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    # Clients poll until the job is finished
+    headers = {} if job["status"] in FINISHED else {"Retry-After": "2"}
+    return jsonify(job), 200, headers
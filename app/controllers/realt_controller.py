@@ -1,163 +1,138 @@
-from io import StringIO
 import os
-import requests
 import json
+import time
 import pandas as pd
-from datetime import date, datetime
+from typing import Optional
 from flask import jsonify
-
-RENT_DATA_FOLDER = "data/realt/rent"
+from app.config import DATA_FOLDER, RENT_REFRESH_INTERVAL, SHARED_SNAPSHOTS
+from app.domain.ingestion_domain import IngestionResult, SheetBuilds, SheetSource, SheetSources, run_ingestion
+from app.domain.refresh_lock_domain import single_flight
+from app.domain.refresher_domain import BackgroundRefresher
+from app.domain.shared_snapshot_domain import attach_shared_snapshot
+from app.domain.snapshot_domain import compute_etag, encode_json
+from app.domain.snapshot_store_domain import get_snapshot_store
+from app.misc.files import get_file_key
+from app.misc.responses import encoded_json_response
+
+RENT_DATA_FOLDER = os.path.join(DATA_FOLDER, "realt", "rent")
 RENT_URL = os.getenv("GOOGLE_SHEET_CSV_REALT_RENT_URL", "")
+# Name of the rent sheet (and of its build) in an ingestion
+RENT_SHEET = "rent"
+
+# Every distinct rent sheet content, in date order (see snapshot_store_domain)
+rent_store = get_snapshot_store("rent", RENT_DATA_FOLDER, ("-rent.json",))
 
 def is_realt_rent_data_recent(max_age_days: int = 4) -> bool:
-    today = date.today()
     try:
-        files = [f for f in os.listdir(RENT_DATA_FOLDER) if f.endswith("rent.json")]
-        dates = []
-        for file in files:
-            try:
-                date_str = file.replace("-rent.json", "")
-                file_date = datetime.strptime(date_str, "%Y-%m-%d").date()
-                dates.append(file_date)
-            except ValueError:
-                continue
-        if not dates:
-            return False
-        most_recent = max(dates)
-        return (today - most_recent).days <= max_age_days
+        return rent_store.is_recent(max_age_days)
     except Exception as e:
         print(f"[Rent Check] Error: {e}")
         return False
 
-def load_and_get_realt_rent_data():
-    today_str = date.today().isoformat()
-    filepath = os.path.join(RENT_DATA_FOLDER, f"{today_str}-rent.json")
+def read_rent_data(filepath: str) -> list[dict]:
+    with open(filepath, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def build_rent_response(rent_data: list[dict]) -> dict:
+    # Calculate total rent
+    total_rent = round(sum(item["rent"] for item in rent_data), 2)
+
+    # Split into labels and data
+    return {
+        "dates": [item["date"] for item in rent_data],
+        "rents": [item["rent"] for item in rent_data],
+        "total_rent": total_rent
+    }
+
+def build_shared_rent_payload(filepath: str) -> tuple[dict, bytes]:
+    body = encode_json(build_rent_response(read_rent_data(filepath)))
+    return {"etag": compute_etag(body)}, body
+
+def get_latest_rent_file() -> Optional[str]:
+    return rent_store.latest_path()
+
+def is_rent_configured() -> bool:
+    return bool(RENT_URL)
+
+def is_rent_refresh_due() -> bool:
+    return is_rent_configured() and not is_realt_rent_data_recent()
+
+def build_rent_data(df: pd.DataFrame) -> list[dict]:
+    df = df.dropna(subset=["Date", "Rent"])
+    df["Date"] = pd.to_datetime(df["Date"], format="%d/%m/%Y")
+    df["Rent"] = (
+        df["Rent"]
+        .astype(str)
+        .str.replace("$", "", regex=False)
+        .str.replace(",", ".", regex=False)
+        .astype(float)
+    )
+
+    return [
+        {"date": d.strftime("%Y-%m-%d"), "rent": r}
+        for d, r in zip(df["Date"], df["Rent"])
+    ]
+
+def get_rent_ingestion() -> tuple[SheetSources, SheetBuilds]:
+    """Rent sheet and its build, for run_ingestion (alone or alongside the watchlist sheets)."""
+    # Without a previous snapshot there is nothing to carry forward: always rebuild
+    force = get_latest_rent_file() is None
+    return {RENT_SHEET: SheetSource(RENT_URL, {}, RENT_DATA_FOLDER, force)}, {RENT_SHEET: ((RENT_SHEET,), build_rent_data)}
+
+def save_rent_ingestion(ingestion: IngestionResult) -> str:
+    """Saves the rent build of an ingestion, the caller commits the ingestion afterwards."""
+    if RENT_SHEET in ingestion.unchanged:
+        # Same content as the latest version: only record that it is still current
+        version = rent_store.carry_forward()
+        print(f"✅ Rent data unchanged since {version.date}")
+        return rent_store.get_path(version)
+
+    rent_data = ingestion.results[RENT_SHEET]
+    version = rent_store.save(json.dumps(rent_data, indent=2, ensure_ascii=False).encode("utf-8"), ".json")
+    filepath = rent_store.get_path(version)
+    print(f"✅ Rent data saved to {filepath}")
+    return filepath
+
+def refresh_rent_data() -> str:
+    print("Fetching new rent data...")
+    ingestion = run_ingestion(*get_rent_ingestion())
+    filepath = save_rent_ingestion(ingestion)
+    ingestion.commit()
+    return filepath
+
+def refresh_rent_data_single_flight() -> None:
+    # Every worker runs a refresher, the lock makes sure only one of them hits the sheet
+    single_flight("rent", is_realt_rent_data_recent, refresh_rent_data, 0)
+
+rent_refresher = BackgroundRefresher("Rent", refresh_rent_data_single_flight, is_realt_rent_data_recent, RENT_REFRESH_INTERVAL)
 
+def load_and_get_realt_rent_data():
+    # Always serve the last good snapshot, the refresher revalidates it in the background
+    if is_rent_configured():
+        rent_refresher.start()
     try:
-        # Load if data not recent
-        if not is_realt_rent_data_recent():
-            print("Fetching new rent data...")
-
-            full_url = f"{RENT_URL}"
-            df = pd.read_csv(full_url, on_bad_lines='skip')
-
-            df = df.dropna(subset=["Date", "Rent"])
-            df["Date"] = pd.to_datetime(df["Date"], format="%d/%m/%Y")
-            df["Rent"] = (
-                df["Rent"]
-                .astype(str)
-                .str.replace("$", "", regex=False)
-                .str.replace(",", ".", regex=False)
-                .astype(float)
-            )
-
-            rent_data = [
-                {"date": d.strftime("%Y-%m-%d"), "rent": r}
-                for d, r in zip(df["Date"], df["Rent"])
-            ]
+        version = rent_store.latest()
+        if version is None:
+            if not is_rent_configured():
+                return jsonify({"error": "Rent data not configured"}), 404
+            rent_refresher.trigger()
+            return jsonify({"error": "Rent data not available yet"}), 503, {"Retry-After": "30"}
 
-            os.makedirs(RENT_DATA_FOLDER, exist_ok=True)
-            with open(filepath, "w", encoding="utf-8") as f:
-                json.dump(rent_data, f, indent=2, ensure_ascii=False)
+        if is_rent_refresh_due():
+            rent_refresher.trigger()
 
-            print(f"✅ Rent data saved to {filepath}")
+        filepath = rent_store.get_path(version)
+        # Time since the sheet was last confirmed to hold this content
+        age = str(max(0, int(time.time() - version.checked_at)))
 
-        else:
-            print("✅ Using cached rent data")
+        if SHARED_SNAPSHOTS:
+            shared = attach_shared_snapshot("rent", get_file_key(filepath), lambda: build_shared_rent_payload(filepath))
+            response = encoded_json_response(shared.payload, shared.header["etag"])
+            response.headers["Age"] = age
+            return response
 
-        # Load latest rent file
-        files = [f for f in os.listdir(RENT_DATA_FOLDER) if f.endswith("rent.json")]
-        latest_file = max(files, key=lambda f: f.split("-")[0])
-        filepath = os.path.join(RENT_DATA_FOLDER, latest_file)
-
-        with open(filepath, "r", encoding="utf-8") as f:
-            rent_data = json.load(f)
-
-        # Calculate total rent
-        total_rent = round(sum(item["rent"] for item in rent_data), 2)
-
-        # Split into labels and data
-        response = {
-            "dates": [item["date"] for item in rent_data],
-            "rents": [item["rent"] for item in rent_data],
-            "total_rent": total_rent
-        }
-
-        return jsonify(response), 200
+        return jsonify(build_rent_response(read_rent_data(filepath))), 200, {"Age": age}
 
     except Exception as e:
         print(f"[Rent Load/Get] Error: {e}")
         return jsonify({"error": "Failed to process rent data"}), 500
-
-
-# def is_realt_rent_data_recent(max_age_days: int = 4) -> bool:
-#     today = date.today()
-
-#     try:
-#         files = [f for f in os.listdir(RENT_DATA_FOLDER) if f.endswith("rent.json")]
-#         dates = []
-#         for file in files:
-#             try:
-#                 date_str = file.replace("-rent.json", "")
-#                 file_date = datetime.strptime(date_str, "%Y-%m-%d").date()
-#                 dates.append(file_date)
-#             except ValueError:
-#                 continue
-#         if not dates:
-#             return False
-#         most_recent = max(dates)
-#         return (today - most_recent).days <= max_age_days
-#     except Exception as e:
-#         print(f"[Rent Check] Error: {e}")
-#         return False
-
-# def load_realt_rent_data():
-#     if is_realt_rent_data_recent():
-#         print("✅ Rent data already saved.")
-#         return jsonify({"status": "already_fresh"}), 200
-
-#     try:
-#         response = requests.get(RENT_URL + "219855821" + END_OF_URL)
-#         response.raise_for_status()
-
-#         df = pd.read_csv(pd.compat.StringIO(response.text))
-#         df = df.dropna(subset=["Date", "Rent"])
-#         df["Date"] = pd.to_datetime(df["Date"], format="%d/%m/%Y")
-#         df["Rent"] = df["Rent"].astype(str).str.replace("$", "").str.replace(",", ".").astype(float)
-
-#         rent_data = [
-#             {"date": d.strftime("%Y-%m-%d"), "rent": r}
-#             for d, r in zip(df["Date"], df["Rent"])
-#         ]
-
-#         today_str = date.today().isoformat()
-#         os.makedirs(RENT_DATA_FOLDER, exist_ok=True)
-#         filepath = os.path.join(RENT_DATA_FOLDER, f"{today_str}-rent.json")
-
-#         with open(filepath, "w", encoding="utf-8") as f:
-#             json.dump(rent_data, f, indent=2, ensure_ascii=False)
-
-#         print(f"✅ Rent data saved to {filepath}")
-#         return jsonify({"status": "saved"}), 200
-
-#     except Exception as e:
-#         print(f"[Rent Load] Error: {e}")
-#         return jsonify({"error": "Failed to load rent data"}), 500
-
-# def get_realt_rent_data():
-#     try:
-#         files = [f for f in os.listdir(RENT_DATA_FOLDER) if f.endswith("rent.json")]
-#         if not files:
-#             return jsonify({"error": "No rent data available"}), 404
-
-#         latest_file = max(files, key=lambda f: f.split("-")[0])
-#         filepath = os.path.join(RENT_DATA_FOLDER, latest_file)
-
-#         with open(filepath, "r", encoding="utf-8") as f:
-#             rent_data = json.load(f)
-
-#         return jsonify(rent_data), 200
-
-#     except Exception as e:
-#         print(f"[Rent Get] Error: {e}")
-#         return jsonify({"error": "Failed to load rent data"}), 500
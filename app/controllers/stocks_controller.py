@@ -1,12 +1,28 @@
-from dataclasses import asdict
-import json
 import os
-from app.domain.stocks_domain import buil_companies_data_from_dataframe, get_companies_data_from_file, is_companies_data_recent
+from app.config import COMPANIES_SOURCE, ENABLED_WATCHLISTS, REFRESH_WAIT_TIMEOUT
+from app.controllers.realt_controller import RENT_SHEET, get_rent_ingestion, is_rent_refresh_due, save_rent_ingestion
+from app.domain.alphavantage_domain import fetch_watchlists_data
+from app.domain.analytics_domain import add_price_analytics
+from app.domain.planner_domain import record_company_request
+from app.domain.fetch_domain import read_raw_copy
+from app.domain.ingestion_domain import IngestionResult, SheetSource, get_raw_content, run_ingestion
+from app.domain.correlation_domain import parse_correlation_query
+from app.domain.downsampling_domain import parse_downsampling
+from app.domain.jobs_domain import job_stage, submit_job
+from app.domain.refresh_lock_domain import file_lock, single_flight
+from app.domain.snapshot_domain import compute_etag, encode_json, get_companies_snapshot, get_companies_snapshot_as_of, get_projection
+from app.domain.history_domain import get_price_histories, get_price_histories_incremental
+from app.domain.watchlist_index_domain import WatchlistQuery, parse_watchlist_query
+from app.domain.stocks_domain import HistoryLoader, WatchlistBuild, buil_companies_data_from_dataframe, carry_forward_companies_file, get_companies_folder, get_companies_store, get_history_state, get_latest_companies_file, is_companies_data_recent, save_companies_data, save_companies_snapshot, save_history_marks
+from app.misc.watchlist_keys import WATCHLIST_CTO, WATCHLIST_PEA
+from app.misc.responses import encoded_json_response
 from app.models.companies import Company
 import pandas as pd
 import numpy as np
-import os
+from dataclasses import asdict
 from datetime import date
+from functools import partial
+from typing import Mapping, Optional
 from flask import jsonify
 
 GOOGLE_SHEET_CSV_PEA_URL = os.getenv("GOOGLE_SHEET_CSV_PEA_URL", "")
@@ -14,120 +30,280 @@ GOOGLE_SHEET_CSV_HISTORY_PEA_URL = os.getenv("GOOGLE_SHEET_CSV_HISTORY_PEA_URL",
 GOOGLE_SHEET_CSV_CTO_URL = os.getenv("GOOGLE_SHEET_CSV_CTO_URL", "")
 GOOGLE_SHEET_CSV_HISTORY_CTO_URL = os.getenv("GOOGLE_SHEET_CSV_HISTORY_CTO_URL", "")
 
-def get_company_data(ticker: str):
-    all_companies_data = get_companies_data()
-    for company in all_companies_data['pea']:
-        if company.ticker == ticker:
-            return asdict(company)
-    for company in all_companies_data['cto']:
-        if company.ticker == ticker:
-            return asdict(company)
-    return {"error": "Ticker not found"}, 404
+WATCHLIST_KEYS = {
+    'PEA': WATCHLIST_PEA,
+    'CTO': WATCHLIST_CTO,
+}
+
+WATCHLIST_SHEETS = {
+    'PEA': (GOOGLE_SHEET_CSV_PEA_URL, GOOGLE_SHEET_CSV_HISTORY_PEA_URL),
+    'CTO': (GOOGLE_SHEET_CSV_CTO_URL, GOOGLE_SHEET_CSV_HISTORY_CTO_URL),
+}
+
+WATCHLISTS = ('PEA', 'CTO')
 
+# Tickers accepted by one /api/companies call
+MAX_BATCH_TICKERS = 500
 
-# def safe_fetch(url: str, ticker: str) -> dict:
-#     try:
-#         r = requests.get(url, timeout=10)
-#         if r.status_code != 200:
-#             print(f"[{ticker}] Request failed: {r.status_code}")
-#             return {}
-#         return r.json()
-#     except requests.exceptions.RequestException as e:
-#         print(f"[{ticker}] Exception during request: {e}")
-#         return {}
-#     except Exception as e:
-#         print(f"[{ticker}] Unexpected error: {e}")
-#         return {}
+def find_company_encoded(snapshots: list, ticker: str, projection: Optional[tuple],
+                         window: Optional[tuple] = None,
+                         downsampling: Optional[tuple[int, str]] = None) -> Optional[tuple[bytes, str]]:
+    # PEA first, like the watchlists are searched everywhere else
+    for snapshot in snapshots:
+        if window is not None or downsampling is not None:
+            encoded = snapshot.get_history_view(ticker, projection, window, downsampling)
+        elif projection is not None:
+            encoded = snapshot.get_projected(ticker, projection)
+        else:
+            encoded = snapshot.get_encoded(ticker)
+        if encoded:
+            return encoded
+    return None
 
+def parse_date_window(start: Optional[str], end: Optional[str]) -> Optional[tuple]:
+    """(from, to) day ordinals for ?from=&to= (YYYY-MM-DD, both inclusive), None when neither is given."""
+    if not start and not end:
+        return None
+    try:
+        window = tuple(date.fromisoformat(value).toordinal() if value else None for value in (start, end))
+    except ValueError:
+        raise ValueError("from and to must be YYYY-MM-DD dates") from None
+    if None not in window and window[0] > window[1]:
+        raise ValueError("from must not be after to")
+    return window
 
-# def fetch_companies_data(list_tickers: list[str]) -> list[Company]:
-#     companies_data = []
+def get_company_data(ticker: str, fields: Optional[str] = None, exclude: Optional[str] = None,
+                     points: Optional[str] = None, algo: Optional[str] = None,
+                     start: Optional[str] = None, end: Optional[str] = None):
+    try:
+        projection = get_projection(fields, exclude)
+        window = parse_date_window(start, end)
+        downsampling = parse_downsampling(points, algo) if points else None
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    snapshots = [get_companies_snapshot(companies_type) for companies_type in WATCHLISTS]
+    encoded = find_company_encoded(snapshots, ticker, projection, window, downsampling)
+    if encoded is None:
+        return {"error": "Ticker not found"}, 404
+    record_company_request(ticker)
+    return encoded_json_response(*encoded)
 
-#     for ticker in list_tickers:
-#         print(f"Fetching {ticker}...")
-#         # local mock data
-#         # company = build_company_data(OVERVIEW, GLOBAL_QUOTE, TIME_SERIES_MONTHLY_ADJUSTED['Monthly Adjusted Time Series'])
+def get_company_history_data(ticker: str, points: Optional[str] = None, algo: Optional[str] = None,
+                             start: Optional[str] = None, end: Optional[str] = None):
+    """{"price_dates": [...], "price_history": [...], "ticker": ...}, optionally a date range and/or downsampled for charts."""
+    return get_company_data(ticker, "price_dates,price_history", None, points, algo, start, end)
 
-#         overview = safe_fetch(f'https://www.alphavantage.co/query?function=OVERVIEW&symbol={ticker}&apikey={API_KEY}', ticker)
-#         time.sleep(12)
+def get_companies_batch_data(tickers: list[str], fields: Optional[str] = None, exclude: Optional[str] = None):
+    """{"companies": [...], "missing": [...]} for many tickers, resolved against the snapshot indexes in one pass."""
+    tickers = list(dict.fromkeys(ticker.strip() for ticker in tickers if ticker and ticker.strip()))
+    if not tickers:
+        return {"error": "tickers is required"}, 400
+    if len(tickers) > MAX_BATCH_TICKERS:
+        return {"error": f"At most {MAX_BATCH_TICKERS} tickers per request"}, 400
+    try:
+        projection = get_projection(fields, exclude)
+    except ValueError as e:
+        return {"error": str(e)}, 400
 
-#         global_quote = safe_fetch(f'https://www.alphavantage.co/query?function=GLOBAL_QUOTE&symbol={ticker}&apikey={API_KEY}', ticker)
-#         time.sleep(12)
+    snapshots = [get_companies_snapshot(companies_type) for companies_type in WATCHLISTS]
+    records, etags, missing = [], [], []
+    for ticker in tickers:
+        encoded = find_company_encoded(snapshots, ticker, projection)
+        if encoded is None:
+            missing.append(ticker)
+            continue
+        record_company_request(ticker)
+        records.append(encoded[0])
+        etags.append(encoded[1])
+    body = b'{"companies":[' + b",".join(records) + b'],"missing":' + encode_json(missing) + b'}'
+    return encoded_json_response(body, compute_etag("".join(etags + missing).encode()))
 
-#         time_series_data = safe_fetch(f'https://www.alphavantage.co/query?function=TIME_SERIES_MONTHLY_ADJUSTED&symbol={ticker}&apikey={API_KEY}', ticker)
-#         time.sleep(12)
+def parse_companies_batch_body(body) -> tuple[list[str], Optional[str], Optional[str]]:
+    """(tickers, fields, exclude) of a POST /companies body, each given as a list of strings or a
+    comma-separated string. Raises ValueError on any other shape."""
+    if not isinstance(body, dict):
+        raise ValueError("The body must be a JSON object")
+    values = []
+    for name in ("tickers", "fields", "exclude"):
+        value = body.get(name)
+        if isinstance(value, list) and all(isinstance(item, str) for item in value):
+            value = ','.join(value)
+        elif value is not None and not isinstance(value, str):
+            raise ValueError(f"{name} must be a list of strings or a comma-separated string")
+        values.append(value)
+    tickers, fields, exclude = values
+    return (tickers or '').split(','), fields, exclude
 
-#         try:
-#             monthly_series = time_series_data.get('Monthly Adjusted Time Series', {})
-#             if not overview or not global_quote or not monthly_series:
-#                 print(f"[{ticker}] Incomplete data — skipping.")
-#                 continue
+def post_companies_batch_data(body):
+    # Same as GET, for ticker lists too long for a query string
+    try:
+        tickers, fields, exclude = parse_companies_batch_body(body)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    return get_companies_batch_data(tickers, fields, exclude)
 
-#             company = build_company_data(overview, global_quote, monthly_series)
-#             if company:
-#                 companies_data.append(company)
+def get_watchlist_data(watchlist_name: str, as_of: Optional[str] = None,
+                       fields: Optional[str] = None, exclude: Optional[str] = None,
+                       params: Optional[Mapping[str, str]] = None):
+    companies_type = watchlist_name.upper()
+    if companies_type not in WATCHLISTS:
+        return {"error": "Watchlist not found"}, 404
+    try:
+        projection = get_projection(fields, exclude)
+        query = parse_watchlist_query(params or {})
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    if as_of:
+        try:
+            day = date.fromisoformat(as_of)
+        except ValueError:
+            return {"error": "as_of must be a YYYY-MM-DD date"}, 400
+        snapshot = get_companies_snapshot_as_of(companies_type, day)
+        if snapshot is None:
+            return {"error": f"No {companies_type} snapshot on {as_of}"}, 404
+    else:
+        snapshot = get_companies_snapshot(companies_type)
+    if query is not None:
+        return get_watchlist_page(snapshot, query, projection)
+    if projection is not None:
+        return encoded_json_response(*snapshot.get_projected_body(projection))
+    return encoded_json_response(snapshot.body, snapshot.etag)
 
-#         except Exception as e:
-#             print(f"[{ticker}] Error building company: {e}")
+def get_watchlist_correlation_data(watchlist_name: str, window: Optional[str] = None,
+                                   frequency: Optional[str] = None, kind: Optional[str] = None):
+    """Pairwise correlation (or covariance) of the watchlist's returns, computed once per snapshot version."""
+    companies_type = watchlist_name.upper()
+    if companies_type not in WATCHLISTS:
+        return {"error": "Watchlist not found"}, 404
+    try:
+        days, frequency, kind = parse_correlation_query(window, frequency, kind)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    return encoded_json_response(*get_companies_snapshot(companies_type).get_correlation_body(days, frequency, kind))
 
-#     return companies_data
+def get_watchlist_page(snapshot, query: WatchlistQuery, projection: Optional[tuple]):
+    """{"companies": [...], "next_cursor": ..., "total": n} for one sorted / filtered page of a watchlist."""
+    index = snapshot.sort_index
+    if query.version is not None and query.version != index.version:
+        return {"error": "The watchlist changed since this cursor was issued, start again without it"}, 400
+    tickers, total = index.select(query)
+    records = [snapshot.get_encoded(ticker) if projection is None else snapshot.get_projected(ticker, projection)
+               for ticker in tickers]
+    body = (b'{"companies":[' + b",".join(record for record, _ in records) + b'],"next_cursor":'
+            + encode_json(index.next_cursor(query, total)) + b',"total":' + encode_json(total) + b'}')
+    return encoded_json_response(body, compute_etag(body))
 
+def get_companies_encoded() -> tuple[bytes, str]:
+    pea = get_companies_snapshot('PEA')
+    cto = get_companies_snapshot('CTO')
+    body = b'{"cto":' + cto.body + b',"pea":' + pea.body + b'}'
+    return body, compute_etag(f"{cto.etag}{pea.etag}".encode())
+
+
+def are_companies_data_recent() -> bool:
+    return all(is_companies_data_recent(companies_type, 0) for companies_type in ENABLED_WATCHLISTS)
 
 def load_companies_data():
-    # is_pea_loaded = is_companies_data_recent('PEA', 0)
-    is_cto_loaded = is_companies_data_recent('CTO', 0)
-    # if is_pea_loaded and is_cto_loaded:
-    if is_cto_loaded:
-        print("Data already loaded for CTO.")
-        companies_data_cto = get_companies_data_from_file('CTO')
-        return get_companies_data(), 200
-    # companies_data_pea = download_and_parse_sheet(GOOGLE_SHEET_CSV_PEA_URL, GOOGLE_SHEET_CSV_HISTORY_PEA_URL)
-    companies_data_pea = {}
-    companies_data_cto = download_and_parse_sheet(GOOGLE_SHEET_CSV_CTO_URL, GOOGLE_SHEET_CSV_HISTORY_CTO_URL)
-    # save_to_json(companies_data_pea, watchlist_name="PEA")
-    save_to_json(companies_data_cto, watchlist_name="CTO")
-    
-    # if is_pea_loaded and is_cto_loaded:
-    #     print("Data already saved for PEA and CTO.")
-    #     return {}, 200
-    # if not is_pea_loaded:
-    #     print("PEA data not saved, fetching...")
-    #     company_pea = WATCHLIST_PEA
-    #     companies_data_pea = fetch_companies_data(company_pea)
-    #     save_companies_data(companies_data_pea, 'data/PEA')
-    # if not is_cto_loaded:
-    #     print("CTO data not saved, fetching...")
-    #     company_cto = WATCHLIST_CTO
-    #     companies_data_cto = fetch_companies_data(company_cto)
-    #     save_companies_data(companies_data_cto, 'data/CTO')
-    return jsonify({ 'pea': companies_data_pea, 'cto': companies_data_cto}), 200
+    if are_companies_data_recent():
+        print(f"Data already loaded for {', '.join(ENABLED_WATCHLISTS)}.")
+        return encoded_json_response(*get_companies_encoded())
+    # The refresh runs in a job process, the request only queues it (or joins the one in progress)
+    job = submit_job('companies', run_companies_refresh)
+    return jsonify(job), 202, {"Location": f"/api/jobs/{job['id']}"}
+
+def run_companies_refresh() -> dict:
+    # Only one process downloads, the others wait for it (or keep serving the stale snapshot)
+    outcome = single_flight('companies', are_companies_data_recent, refresh_companies_data, REFRESH_WAIT_TIMEOUT)
+    return {"outcome": outcome, "snapshots": get_snapshot_versions()}
+
+def get_snapshot_versions() -> dict:
+    versions = {}
+    for companies_type in ENABLED_WATCHLISTS:
+        version = get_companies_store(companies_type).latest()
+        versions[companies_type] = asdict(version) if version else None
+    return versions
+
+def refresh_companies_data() -> None:
+    if COMPANIES_SOURCE == 'alphavantage':
+        # One plan across all watchlists, within the remaining daily quota
+        with job_stage("fetch"):
+            companies_data = fetch_watchlists_data({
+                companies_type: WATCHLIST_KEYS[companies_type] for companies_type in ENABLED_WATCHLISTS
+            })
+        with job_stage("save"):
+            for companies_type, companies in companies_data.items():
+                save_companies_data(add_price_analytics(companies), get_companies_folder(companies_type))
+        return
+
+    # All enabled watchlists are downloaded concurrently, unchanged sheets are not parsed again.
+    # The rent sheet rides along when it is due, unless a rent refresher is fetching it already
+    with file_lock("rent", 0) as rent_locked:
+        with_rent = rent_locked and is_rent_refresh_due()
+        with job_stage("ingest"):
+            ingestion = download_and_parse_watchlists({
+                companies_type: WATCHLIST_SHEETS[companies_type] for companies_type in ENABLED_WATCHLISTS
+            }, with_rent)
+        with job_stage("save"):
+            if with_rent:
+                save_rent_ingestion(ingestion)
+            for companies_type, build in ingestion.results.items():
+                if companies_type != RENT_SHEET:
+                    path = save_to_json(build.companies, watchlist_name=companies_type)
+                    save_history_marks(companies_type, path, build.history_marks)
+            for companies_type in ingestion.unchanged:
+                if companies_type != RENT_SHEET:
+                    carry_forward_companies_file(companies_type)
+            ingestion.commit()
 
 def get_companies_data() -> list[Company]:
     return { 
-        'pea': get_companies_data_from_file('PEA'),
-        'cto': get_companies_data_from_file('CTO')
+        'pea': get_companies_snapshot('PEA').companies,
+        'cto': get_companies_snapshot('CTO').companies
     }
     
 def get_companies_data_pea() -> list[Company]:
     print("get_companies_data_pea")
-    return get_companies_data_from_file('PEA')
+    return get_companies_snapshot('PEA').companies
 
 def get_companies_data_cto() -> list[Company]:
     print("get_companies_data_cto")
-    return get_companies_data_from_file('CTO')
+    return get_companies_snapshot('CTO').companies
+
+def download_and_parse_sheet(url_data: str, url_history: str) -> list[Company]:
+    sheets = {
+        'data': SheetSource(url_data),
+        'history': SheetSource(url_history, {'header': 0}),
+    }
+    return run_ingestion(sheets, {'sheet': (('data', 'history'), parse_sheet)}).results['sheet']
 
-# def download_and_parse_sheet(url_data: str, url_history: str) -> list[dict]:
-#     df = pd.read_csv(url_data, on_bad_lines='skip')
-#     df.columns = df.columns.str.strip().str.replace('\ufeff', '')  # clean headers
-#     df_history = pd.read_csv(url_history, on_bad_lines='skip', header=0)
-#     companies = buil_companies_data_from_dataframe(df, df_history)
-#     return companies
+def download_and_parse_watchlists(watchlists: dict[str, tuple[str, str]], with_rent: bool = False) -> IngestionResult:
+    # 1. Lecture (toutes les feuilles en parallèle, requêtes conditionnelles)
+    sheets, builds = get_rent_ingestion() if with_rent else ({}, {})
+    for name, (url_data, url_history) in watchlists.items():
+        folder = get_companies_folder(name)
+        # Without a previous snapshot there is nothing to carry forward: always rebuild
+        force = get_latest_companies_file(name) is None
+        sheets[f"{name}-data"] = SheetSource(url_data, {}, folder, force)
+        sheets[f"{name}-history"] = SheetSource(url_history, {'header': 0}, folder, force)
+        builds[name] = ((f"{name}-data", f"{name}-history"), partial(parse_watchlist_sheet, name))
+    return run_ingestion(sheets, builds)
 
-def download_and_parse_sheet(url_data: str, url_history: str) -> list[dict]:
-    # 1. Lecture
-    df = pd.read_csv(url_data, on_bad_lines='skip')
-    df_history = pd.read_csv(url_history, on_bad_lines='skip', header=0)
+def parse_watchlist_sheet(watchlist_name: str, df: pd.DataFrame, df_history: pd.DataFrame) -> WatchlistBuild:
+    # Only the history rows added since the last snapshot are parsed, edits are found by comparing
+    # the raw CSV with the copy the last snapshot was built from
+    previous, marks = get_history_state(watchlist_name)
+    previous_content = read_raw_copy(get_companies_folder(watchlist_name), f"{watchlist_name}-history") if marks.tickers else None
+    build = WatchlistBuild()
 
+    def get_histories(df_history: pd.DataFrame, tickers: list[str]):
+        histories, build.history_marks = get_price_histories_incremental(df_history, tickers, previous, marks,
+                                                                         get_raw_content(df_history), previous_content)
+        return histories
+
+    build.companies = parse_sheet(df, df_history, get_histories)
+    return build
+
+def parse_sheet(df: pd.DataFrame, df_history: pd.DataFrame, get_histories: HistoryLoader = get_price_histories) -> list[Company]:
     # 2. Nettoyage des headers
     df.columns = df.columns.str.strip().str.replace('\ufeff', '')
     
@@ -143,32 +319,13 @@ def download_and_parse_sheet(url_data: str, url_history: str) -> list[dict]:
     df = df.replace({np.nan: None})
 
     # 5. Construction
-    companies = buil_companies_data_from_dataframe(df, df_history)
-    
-    # 6. Sauvegarde du cache (optionnel ici, mais c'est là qu'il faut être vigilant)
-    # avec ensure_ascii=False pour garder les caractères propres
-    # with open('cache.json', 'w', encoding='utf-8') as f:
-    #     json.dump(companies, f, ensure_ascii=False)
+    companies = buil_companies_data_from_dataframe(df, df_history, get_histories)
+
+    # 5b. Analytics (returns, volatility, drawdown, moving averages), once per build for all tickers
+    add_price_analytics(companies)
 
     return companies
 
-def save_to_json(companies, watchlist_name="PEA"):
-    today = date.today().isoformat()
-    folder = f"data/{watchlist_name}"
-    os.makedirs(folder, exist_ok=True)
-    filename = f"{today}-{watchlist_name}.json"
-    path = os.path.join(folder, filename)
-
-    # ✅ Save new data
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(companies, f, indent=2, ensure_ascii=False)
-    print(f"✅ Data saved to {path}")
-
-    # 🧹 Delete old files
-    for fname in os.listdir(folder):
-        if fname.endswith(".json") and fname != filename:
-            try:
-                os.remove(os.path.join(folder, fname))
-                print(f"🗑️ Deleted old file: {fname}")
-            except Exception as e:
-                print(f"⚠️ Failed to delete {fname}: {e}")
\ No newline at end of file
+def save_to_json(companies: list[Company], watchlist_name="PEA") -> str:
+    # ✅ Save new data as today's version (older versions stay in the store)
+    return save_companies_snapshot(companies, watchlist_name)
@@ -0,0 +1,183 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import requests
+
+from app.config import (ALPHA_VANTAGE_API_KEY, ALPHA_VANTAGE_BURST, ALPHA_VANTAGE_CALLS_PER_MINUTE,
+                        ALPHA_VANTAGE_MAX_WORKERS, ALPHA_VANTAGE_RETRIES, ALPHA_VANTAGE_URL, UPSTREAM_TIMEOUT)
+from app.domain.fetch_domain import get_session
+from app.domain.planner_domain import RefreshPlan, plan_refresh, record_api_call
+from app.domain.response_cache_domain import get_cached_payload, store_payload
+from app.domain.stocks_domain import build_company_data
+from app.models.companies import Company
+
+OVERVIEW = "OVERVIEW"
+GLOBAL_QUOTE = "GLOBAL_QUOTE"
+TIME_SERIES_MONTHLY_ADJUSTED = "TIME_SERIES_MONTHLY_ADJUSTED"
+COMPANY_FUNCTIONS = (OVERVIEW, GLOBAL_QUOTE, TIME_SERIES_MONTHLY_ADJUSTED)
+
+RETRY_BASE_DELAY = 2.0
+
+
+class TransientError(Exception):
+    pass
+
+
+class QuotaExhausted(Exception):
+    """Alpha Vantage answered with a quota message: no more calls until the next refresh cycle."""
+    pass
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `capacity` calls at once, refilled at `rate` calls per second."""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self.tokens = float(self.capacity)
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Blocks until a token is available, returns the time spent waiting."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+rate_limiter = TokenBucket(ALPHA_VANTAGE_CALLS_PER_MINUTE / 60, ALPHA_VANTAGE_BURST)
+# Set on the first quota reply of a cycle, so the remaining calls fall back to the cache
+quota_exhausted = threading.Event()
+
+
+def request_alpha_vantage(function: str, symbol: str) -> dict:
+    if quota_exhausted.is_set():
+        raise QuotaExhausted("quota exhausted earlier in this cycle")
+    rate_limiter.acquire()
+    # Another worker may have hit the quota while this one was waiting for a token
+    if quota_exhausted.is_set():
+        raise QuotaExhausted("quota exhausted earlier in this cycle")
+    record_api_call()
+    params = {"function": function, "symbol": symbol, "apikey": ALPHA_VANTAGE_API_KEY}
+    try:
+        response = get_session().get(ALPHA_VANTAGE_URL, params=params, timeout=UPSTREAM_TIMEOUT)
+    except requests.exceptions.RequestException as e:
+        raise TransientError(str(e)) from e
+    if response.status_code == 429 or response.status_code >= 500:
+        raise TransientError(f"HTTP {response.status_code}")
+    response.raise_for_status()
+
+    payload = response.json()
+    # Quota messages come back as 200 with a "Note" / "Information" body; retrying only spends
+    # more of a quota that is already gone
+    if "Note" in payload or "Information" in payload:
+        quota_exhausted.set()
+        raise QuotaExhausted(payload.get("Note") or payload.get("Information"))
+    if "Error Message" in payload:
+        raise ValueError(payload["Error Message"])
+    return payload
+
+
+def fetch_with_retries(function: str, ticker: str) -> dict:
+    """Alpha Vantage payload, retried with exponential backoff on transient errors; {} on failure."""
+    for attempt in range(ALPHA_VANTAGE_RETRIES + 1):
+        try:
+            return request_alpha_vantage(function, ticker)
+        except QuotaExhausted as e:
+            print(f"[{ticker}] {function} not fetched, quota exhausted: {e}")
+            return {}
+        except TransientError as e:
+            if attempt == ALPHA_VANTAGE_RETRIES:
+                print(f"[{ticker}] {function} failed after {attempt + 1} attempts: {e}")
+                return {}
+            delay = RETRY_BASE_DELAY * 2 ** attempt * (1 + random.random() / 2)
+            print(f"[{ticker}] {function} transient error ({e}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+        except Exception as e:
+            print(f"[{ticker}] {function} error: {e}")
+            return {}
+    return {}
+
+
+def safe_fetch(function: str, ticker: str) -> dict:
+    """Payload from the on-disk cache while within its TTL, otherwise from the API (stale copy if the API fails)."""
+    cached = get_cached_payload(function, ticker)
+    if cached is not None:
+        return cached
+    payload = fetch_with_retries(function, ticker)
+    if payload:
+        store_payload(function, ticker, payload)
+        return payload
+    stale = get_cached_payload(function, ticker, allow_stale=True)
+    if stale is not None:
+        print(f"[{ticker}] {function} using stale cached payload")
+        return stale
+    return {}
+
+
+def fetch_planned_payloads(plan: RefreshPlan) -> Dict[str, Dict[str, dict]]:
+    """Fetches the planned (ticker, function) pairs concurrently, paced by the shared token bucket."""
+    with ThreadPoolExecutor(max_workers=ALPHA_VANTAGE_MAX_WORKERS, thread_name_prefix="alphavantage") as pool:
+        futures: Dict[Tuple[str, str], object] = {
+            (ticker, function): pool.submit(safe_fetch, function, ticker)
+            for ticker, functions in plan.planned.items()
+            for function in functions
+        }
+        payloads: Dict[str, Dict[str, dict]] = {}
+        for (ticker, function), future in futures.items():
+            payloads.setdefault(ticker, {})[function] = future.result()
+    return payloads
+
+
+def build_company_from_payloads(ticker: str, payloads: Dict[str, dict]) -> Optional[Company]:
+    overview = payloads.get(OVERVIEW, {})
+    global_quote = payloads.get(GLOBAL_QUOTE, {})
+    monthly_series = payloads.get(TIME_SERIES_MONTHLY_ADJUSTED, {}).get('Monthly Adjusted Time Series', {})
+    if not overview or not global_quote or not monthly_series:
+        print(f"[{ticker}] Incomplete data — skipping.")
+        return None
+    return build_company_data(overview, global_quote, monthly_series)
+
+
+def fetch_watchlists_data(watchlists: Dict[str, List[str]]) -> Dict[str, List[Company]]:
+    """Refreshes what the daily quota allows, planned once across all watchlists.
+
+    Tickers that were skipped or deferred are built from their cached (possibly stale) payloads.
+    """
+    started = time.monotonic()
+    quota_exhausted.clear()
+    all_tickers = [ticker for tickers in watchlists.values() for ticker in tickers]
+    plan = plan_refresh(all_tickers, COMPANY_FUNCTIONS)
+    fetched = fetch_planned_payloads(plan)
+
+    companies_data = {}
+    for name, tickers in watchlists.items():
+        companies_data[name] = []
+        for ticker in tickers:
+            payloads = {
+                function: fetched.get(ticker, {}).get(function) or get_cached_payload(function, ticker, allow_stale=True) or {}
+                for function in COMPANY_FUNCTIONS
+            }
+            company = build_company_from_payloads(ticker, payloads)
+            if company:
+                companies_data[name].append(company)
+    built = sum(len(companies) for companies in companies_data.values())
+    print(f"[Alpha Vantage] {built}/{len(all_tickers)} companies, {plan.calls} calls planned in {time.monotonic() - started:.1f}s"
+          + (" (quota exhausted, rest served from the cache)" if quota_exhausted.is_set() else ""))
+    return companies_data
+
+
+def fetch_companies_data(list_tickers: List[str]) -> List[Company]:
+    return fetch_watchlists_data({"companies": list_tickers})["companies"]
@@ -0,0 +1,139 @@
+from datetime import date
+from typing import Dict, List
+
+import numpy as np
+
+from app.models.companies import Company
+
+TRADING_DAYS_PER_YEAR = 252
+DAYS_PER_YEAR = 365.25
+# Median spacing between closes (in calendar days) up to which a series counts as daily
+MAX_DAILY_SPACING = 4
+# Most recent gaps between closes the median spacing is taken from
+SPACING_SAMPLE = 60
+ONE_YEAR_DAYS = 365
+FIVE_YEARS_DAYS = 5 * 365 + 1
+SHORT_MOVING_AVERAGE = 50
+LONG_MOVING_AVERAGE = 200
+# Ordinal padding the start of shorter histories, before any real date
+PADDING_DATE = -1
+
+
+def align_histories(companies: List[Company]):
+    """(prices, dates) matrices with one row per company, right-aligned on each history's last point.
+
+    Shorter histories are padded at the start (NaN price, PADDING_DATE date), so the last column
+    is every ticker's latest point and a trailing window is a plain column slice.
+    """
+    width = max((len(company.price_history) for company in companies), default=0)
+    prices = np.full((len(companies), width), np.nan)
+    dates = np.full((len(companies), width), PADDING_DATE, dtype=np.int64)
+    for row, company in enumerate(companies):
+        count = len(company.price_history)
+        if count:
+            prices[row, width - count:] = np.frombuffer(company.price_history, dtype=np.float64)
+            dates[row, width - count:] = np.frombuffer(company.price_dates, dtype=np.int32)
+    return prices, dates
+
+
+def _percent(values: np.ndarray) -> List:
+    return [None if value != value else round(float(value) * 100, 2) for value in values]
+
+
+def _rounded(values: np.ndarray) -> List:
+    return [None if value != value else round(float(value), 4) for value in values]
+
+
+def get_median_spacing(dates: np.ndarray) -> np.ndarray:
+    """Median number of calendar days between each row's latest closes (NaN under two closes)."""
+    dates = dates[:, -SPACING_SAMPLE - 1:]
+    valid = (dates[:, :-1] != PADDING_DATE) & (dates[:, 1:] != PADDING_DATE)
+    spacing = np.where(valid, np.diff(dates, axis=1), np.nan)
+    medians = np.full(len(dates), np.nan)
+    has_spacing = valid.any(axis=1)
+    medians[has_spacing] = np.nanmedian(spacing[has_spacing], axis=1)
+    return medians
+
+
+def get_periods_per_year(spacing: np.ndarray) -> np.ndarray:
+    """Closes per year of each row: trading days for daily series, else from the spacing, rounded
+    (month ends are 31 days apart at the median, still 12 a year)."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(spacing <= MAX_DAILY_SPACING, TRADING_DAYS_PER_YEAR, np.round(DAYS_PER_YEAR / spacing))
+
+
+def _return_since(prices: np.ndarray, dates: np.ndarray, reference: np.ndarray) -> np.ndarray:
+    """Return from the last close on or before each row's `reference` ordinal to the latest close (NaN if none)."""
+    rows = np.arange(len(prices))
+    # Dates are sorted and the padding sorts first, so this counts the columns up to the reference
+    columns = (dates <= reference[:, None]).sum(axis=1) - 1
+    valid = (columns >= 0) & (dates[rows, np.maximum(columns, 0)] != PADDING_DATE)
+    start = np.where(valid, prices[rows, np.maximum(columns, 0)], np.nan)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        change = prices[:, -1] / start - 1
+    return np.where(np.isfinite(change), change, np.nan)
+
+
+def compute_price_analytics(companies: List[Company]) -> Dict[str, List]:
+    """Per-company metrics from the price histories, each one a single NumPy pass over all tickers.
+
+    Returns (percentages rounded to 2 decimals, None when the history is too short):
+    return_ytd, return_1y, return_5y, volatility_1y (annualized, from the log returns of the last
+    year), max_drawdown (over the stored history), ma_50 / ma_200 (last 50 / 200 closes).
+
+    Series are not all daily (the Alpha Vantage path stores monthly closes): volatility is
+    annualized with the number of closes per year given by each series' median spacing, and the
+    moving averages, defined in trading days, are only computed for daily series.
+    """
+    metrics = ("return_ytd", "return_1y", "return_5y", "volatility_1y", "max_drawdown", "ma_50", "ma_200")
+    if not companies:
+        return {name: [] for name in metrics}
+    prices, dates = align_histories(companies)
+    if prices.shape[1] == 0:
+        return {name: [None] * len(companies) for name in metrics}
+
+    last_dates = dates[:, -1]
+    spacing = get_median_spacing(dates)
+    is_daily = spacing <= MAX_DAILY_SPACING
+    # Day before Jan 1st of each latest point's year
+    year_starts = np.array([date(date.fromordinal(day).year, 1, 1).toordinal() - 1 if day > 0 else PADDING_DATE
+                            for day in last_dates.tolist()])
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        log_returns = np.diff(np.log(prices), axis=1)
+        # Returns ending within the last year, skipping the padding and non-positive prices
+        in_year = (dates[:, 1:] > (last_dates - ONE_YEAR_DAYS)[:, None]) & np.isfinite(log_returns)
+        counts = in_year.sum(axis=1)
+        means = np.where(in_year, log_returns, 0).sum(axis=1) / counts
+        variances = np.where(in_year, (log_returns - means[:, None]) ** 2, 0).sum(axis=1) / (counts - 1)
+        volatility = np.where(counts >= 2, np.sqrt(variances * get_periods_per_year(spacing)), np.nan)
+
+        peaks = np.fmax.accumulate(prices, axis=1)
+        drawdowns = np.where(peaks > 0, prices / peaks - 1, np.nan)
+    has_prices = ~np.all(np.isnan(drawdowns), axis=1)
+    max_drawdown = np.full(len(companies), np.nan)
+    max_drawdown[has_prices] = np.nanmin(drawdowns[has_prices], axis=1)
+
+    def moving_average(window: int) -> np.ndarray:
+        if prices.shape[1] < window:
+            return np.full(len(companies), np.nan)
+        # Rows with fewer closes keep padding in the window, hence NaN
+        return np.where(is_daily, prices[:, -window:].mean(axis=1), np.nan)
+
+    return {
+        "return_ytd": _percent(_return_since(prices, dates, year_starts)),
+        "return_1y": _percent(_return_since(prices, dates, last_dates - ONE_YEAR_DAYS)),
+        "return_5y": _percent(_return_since(prices, dates, last_dates - FIVE_YEARS_DAYS)),
+        "volatility_1y": _percent(volatility),
+        "max_drawdown": _percent(max_drawdown),
+        "ma_50": _rounded(moving_average(SHORT_MOVING_AVERAGE)),
+        "ma_200": _rounded(moving_average(LONG_MOVING_AVERAGE)),
+    }
+
+
+def add_price_analytics(companies: List[Company]) -> List[Company]:
+    """Analytics stage of a build: stores compute_price_analytics on each company record."""
+    for name, values in compute_price_analytics(companies).items():
+        for company, value in zip(companies, values):
+            setattr(company, name, value)
+    return companies
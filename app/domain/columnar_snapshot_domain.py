@@ -0,0 +1,118 @@
+import json
+import mmap
+import struct
+import sys
+from array import array
+from dataclasses import fields
+from typing import Dict, List, Optional, Tuple
+
+from app.misc.files import get_file_key
+from app.models.companies import Company
+
+# Layout: magic | header length (uint32 LE) | JSON header (padded to 8 bytes) | closes | dates.
+# closes is every price_history value (float64 LE) and dates every price_dates ordinal (int32 LE),
+# concatenated in row order. The header holds the scalar fields as a table (one row per company)
+# and the index: ticker -> [row, start, count], the ticker's history being closes[start:start + count].
+COLUMNAR_MAGIC = b"BAMCOL01"
+COLUMNAR_PREFIX = struct.Struct("<8sI")
+COLUMNAR_EXTENSION = ".col"
+HISTORY_FIELDS = ("price_history", "price_dates")
+SCALAR_FIELDS = [f.name for f in fields(Company) if f.name not in HISTORY_FIELDS]
+NEEDS_BYTESWAP = sys.byteorder != "little"
+
+
+def _to_little_endian(values: array) -> bytes:
+    if NEEDS_BYTESWAP:
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_little_endian(typecode: str, data: bytes) -> array:
+    values = array(typecode)
+    values.frombytes(data)
+    if NEEDS_BYTESWAP:
+        values.byteswap()
+    return values
+
+
+def encode_columnar_snapshot(companies: List[Company]) -> bytes:
+    rows = []
+    index = {}
+    closes = array('d')
+    dates = array('i')
+    for row, company in enumerate(companies):
+        rows.append([getattr(company, name) for name in SCALAR_FIELDS])
+        index[company.ticker] = [row, len(closes), len(company.price_history)]
+        closes.extend(company.price_history)
+        dates.extend(company.price_dates)
+
+    header = json.dumps({"fields": SCALAR_FIELDS, "rows": rows, "index": index, "points": len(closes)},
+                        ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    # Keeps the float64 block 8-byte aligned in the mapping
+    header += b" " * (-(COLUMNAR_PREFIX.size + len(header)) % 8)
+    return (COLUMNAR_PREFIX.pack(COLUMNAR_MAGIC, len(header)) + header
+            + _to_little_endian(closes) + _to_little_endian(dates))
+
+
+class ColumnarSnapshotFile:
+    """Read-only memory map of a columnar snapshot.
+
+    Only the header (scalar table and index) is parsed on open; a ticker's history is copied out
+    of the mapping when that ticker is decoded.
+    """
+
+    def __init__(self, filepath: str):
+        self.path = filepath
+        with open(filepath, "rb") as f:
+            self.file_key = get_file_key(filepath)
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.mm) < COLUMNAR_PREFIX.size:
+            raise ValueError(f"{filepath} is truncated")
+        magic, header_length = COLUMNAR_PREFIX.unpack_from(self.mm, 0)
+        if magic != COLUMNAR_MAGIC:
+            raise ValueError(f"{filepath} is not a columnar snapshot")
+        header_start = COLUMNAR_PREFIX.size
+        header = json.loads(self.mm[header_start:header_start + header_length])
+        self.fields: List[str] = header["fields"]
+        self.rows: List[list] = header["rows"]
+        self.index: Dict[str, list] = header["index"]
+        self.closes_start = header_start + header_length
+        self.dates_start = self.closes_start + header["points"] * 8
+        if self.dates_start + header["points"] * 4 > len(self.mm):
+            raise ValueError(f"{filepath} is truncated")
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    @property
+    def tickers(self) -> List[str]:
+        return list(self.index)
+
+    def get_history(self, ticker: str) -> Optional[Tuple[array, array]]:
+        """(price_history, price_dates) of a ticker, without decoding its scalar fields."""
+        entry = self.index.get(ticker)
+        if entry is None:
+            return None
+        _, start, count = entry
+        closes_start = self.closes_start + start * 8
+        dates_start = self.dates_start + start * 4
+        return (_from_little_endian('d', self.mm[closes_start:closes_start + count * 8]),
+                _from_little_endian('i', self.mm[dates_start:dates_start + count * 4]))
+
+    def get(self, ticker: str) -> Optional[Company]:
+        history = self.get_history(ticker)
+        if history is None:
+            return None
+        return Company(
+            **dict(zip(self.fields, self.rows[self.index[ticker][0]])),
+            price_history=history[0],
+            price_dates=history[1],
+        )
+
+    def read_all(self) -> List[Company]:
+        return [self.get(ticker) for ticker in self.index]
+
+
+def read_columnar_snapshot(filepath: str) -> List[Company]:
+    return ColumnarSnapshotFile(filepath).read_all()
@@ -0,0 +1,104 @@
+from datetime import date
+from typing import Optional, Tuple
+
+import numpy as np
+
+from app.domain.price_matrix_domain import PriceMatrix
+
+CORRELATION = "correlation"
+COVARIANCE = "covariance"
+KINDS = (CORRELATION, COVARIANCE)
+DAILY = "daily"
+WEEKLY = "weekly"
+MONTHLY = "monthly"
+FREQUENCIES = (DAILY, WEEKLY, MONTHLY)
+DEFAULT_WINDOW_DAYS = 365
+MAX_WINDOW_DAYS = 20 * 365
+# Returns two tickers must share for their coefficient to be reported
+MIN_OBSERVATIONS = 3
+
+
+def parse_correlation_query(window: Optional[str], frequency: Optional[str], kind: Optional[str]) -> Tuple[Optional[int], str, str]:
+    """(window in calendar days or None for the whole history, frequency, kind). Raises ValueError on bad input."""
+    if window == "all":
+        days = None
+    else:
+        try:
+            days = int(window) if window else DEFAULT_WINDOW_DAYS
+        except ValueError:
+            raise ValueError("window must be a number of days or 'all'") from None
+        if not 1 <= days <= MAX_WINDOW_DAYS:
+            raise ValueError(f"window must be between 1 and {MAX_WINDOW_DAYS} days")
+    frequency = (frequency or DAILY).lower()
+    if frequency not in FREQUENCIES:
+        raise ValueError(f"frequency must be one of {', '.join(FREQUENCIES)}")
+    kind = (kind or CORRELATION).lower()
+    if kind not in KINDS:
+        raise ValueError(f"kind must be one of {', '.join(KINDS)}")
+    return days, frequency, kind
+
+
+def get_period_ends(dates: np.ndarray, frequency: str) -> np.ndarray:
+    """Rows closing each week (Monday to Sunday) or month of the calendar, or every row for daily."""
+    if frequency == DAILY or not len(dates):
+        return np.arange(len(dates))
+    if frequency == WEEKLY:
+        periods = (dates.astype(np.int64) - 1) // 7  # Ordinal 1 is a Monday
+    else:
+        periods = np.array([day.year * 12 + day.month for day in map(date.fromordinal, dates.tolist())])
+    return np.append(np.flatnonzero(np.diff(periods)), len(dates) - 1)
+
+
+def get_returns(matrix: PriceMatrix, window: Optional[int], frequency: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(log returns, validity mask, dates of the returns) of every ticker over the window.
+
+    Daily returns only count on days a ticker actually traded (from its previous close); weekly and
+    monthly ones compare the forward-filled closes of consecutive period ends.
+    """
+    dates = np.asarray(matrix.dates)
+    start = 0
+    if window is not None and len(dates):
+        # The close before the window's first day anchors its first return
+        start = max(int(np.searchsorted(dates, dates[-1] - window, side="right")) - 1, 0)
+    rows = start + get_period_ends(dates[start:], frequency)
+    prices = np.asarray(matrix.prices)[rows]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        returns = np.diff(np.log(prices), axis=0)
+    valid = np.isfinite(returns)
+    if frequency == DAILY:
+        valid &= np.asarray(matrix.observed)[rows[1:]]
+    return np.where(valid, returns, 0.0), valid, dates[rows[1:]]
+
+
+def compute_return_matrix(matrix: PriceMatrix, window: Optional[int], frequency: str, kind: str) -> dict:
+    """Pairwise correlation or covariance of the tickers' returns, over the returns each pair shares.
+
+    The pairwise sums are matrix products over the whole return table, so the cost is a few
+    (periods x tickers) products rather than one pass per pair.
+    """
+    returns, valid, dates = get_returns(matrix, window, frequency)
+    present = valid.astype(np.float64)
+    counts = present.T @ present                    # shared returns of i and j
+    sums = returns.T @ present                      # sum of i's returns where j has one
+    squares = (returns ** 2).T @ present
+    products = returns.T @ returns
+    with np.errstate(divide="ignore", invalid="ignore"):
+        covariance = (products - sums * sums.T / counts) / (counts - 1)
+        if kind == COVARIANCE:
+            values = covariance
+        else:
+            variances = (squares - sums ** 2 / counts) / (counts - 1)
+            values = covariance / np.sqrt(variances * variances.T)
+            values = np.clip(values, -1.0, 1.0)
+    values = np.where((counts >= MIN_OBSERVATIONS) & np.isfinite(values), values, np.nan)
+
+    return {
+        "tickers": list(matrix.tickers),
+        "kind": kind,
+        "frequency": frequency,
+        "window": window,
+        "from": date.fromordinal(int(dates[0])).isoformat() if len(dates) else None,
+        "to": date.fromordinal(int(dates[-1])).isoformat() if len(dates) else None,
+        # 6 significant digits: daily covariances are tiny numbers
+        "matrix": [[None if value != value else float(f"{value:.6g}") for value in row] for row in values.tolist()],
+    }
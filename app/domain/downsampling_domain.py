@@ -0,0 +1,93 @@
+from array import array
+from typing import Tuple
+
+import numpy as np
+
+LTTB = "lttb"
+MINMAX = "minmax"
+STRIDE = "stride"
+ALGORITHMS = (LTTB, MINMAX, STRIDE)
+MIN_POINTS = 3
+MAX_POINTS = 5000
+
+
+def parse_downsampling(points: str, algo: str) -> Tuple[int, str]:
+    """(points, algorithm) for ?points=N&algo=. Raises ValueError on bad input."""
+    try:
+        count = int(points)
+    except ValueError:
+        raise ValueError("points must be an integer") from None
+    if not MIN_POINTS <= count <= MAX_POINTS:
+        raise ValueError(f"points must be between {MIN_POINTS} and {MAX_POINTS}")
+    algo = (algo or LTTB).lower()
+    if algo not in ALGORITHMS:
+        raise ValueError(f"algo must be one of {', '.join(ALGORITHMS)}")
+    return count, algo
+
+
+def _bucket_edges(start: int, end: int, buckets: int) -> np.ndarray:
+    # Series are longer than the buckets asked for, so every bucket holds at least one point
+    return np.linspace(start, end, buckets + 1).astype(np.int64)
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, points: int) -> np.ndarray:
+    """Largest-triangle-three-buckets: keeps the ends, then per bucket the point spanning the
+    largest triangle with the previous pick and the next bucket's average, which preserves peaks."""
+    n = len(y)
+    edges = _bucket_edges(1, n - 1, points - 2)
+    counts = np.diff(edges)
+    # Every bucket's average at once, from running sums
+    sum_x = np.concatenate(([0.0], np.cumsum(x)))
+    sum_y = np.concatenate(([0.0], np.cumsum(y)))
+    average_x = np.append((sum_x[edges[1:]] - sum_x[edges[:-1]]) / counts, x[-1])
+    average_y = np.append((sum_y[edges[1:]] - sum_y[edges[:-1]]) / counts, y[-1])
+
+    selected = np.empty(points, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    previous = 0
+    for bucket in range(points - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        px, py = x[previous], y[previous]
+        areas = np.abs((px - average_x[bucket + 1]) * (y[start:end] - py)
+                       - (px - x[start:end]) * (average_y[bucket + 1] - py))
+        previous = start + int(np.argmax(areas))
+        selected[bucket + 1] = previous
+    return selected
+
+
+def minmax_indices(y: np.ndarray, points: int) -> np.ndarray:
+    """The ends plus the lowest and highest point of each bucket, in series order."""
+    n = len(y)
+    buckets = (points - 2) // 2
+    if buckets == 0:
+        return np.array([0, n - 1], dtype=np.int64)
+    starts = _bucket_edges(1, n - 1, buckets)[:-1]
+    interior = y[1:n - 1]
+    positions = np.arange(1, n - 1)
+    offsets = starts - 1
+    lows = np.repeat(np.minimum.reduceat(interior, offsets), np.diff(np.append(offsets, n - 2)))
+    highs = np.repeat(np.maximum.reduceat(interior, offsets), np.diff(np.append(offsets, n - 2)))
+    # First position reaching the bucket's extreme (n is never picked: every bucket has one)
+    first_low = np.minimum.reduceat(np.where(interior == lows, positions, n), offsets)
+    first_high = np.minimum.reduceat(np.where(interior == highs, positions, n), offsets)
+    return np.unique(np.concatenate(([0, n - 1], first_low, first_high)))
+
+
+def stride_indices(n: int, points: int) -> np.ndarray:
+    return np.unique(np.linspace(0, n - 1, points).round().astype(np.int64))
+
+
+def downsample_series(prices: array, dates: array, points: int, algo: str) -> Tuple[array, array]:
+    """At most `points` points of a (prices, day ordinals) series; shorter series are returned as is."""
+    n = len(prices)
+    if n <= points:
+        return prices, dates
+    y = np.frombuffer(prices, dtype=np.float64)
+    x = np.frombuffer(dates, dtype=np.int32)
+    if algo == LTTB:
+        indices = lttb_indices(x.astype(np.float64), y, points)
+    elif algo == MINMAX:
+        indices = minmax_indices(y, points)
+    else:
+        indices = stride_indices(n, points)
+    return array('d', y[indices].tobytes()), array('i', x[indices].tobytes())
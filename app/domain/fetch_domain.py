@@ -0,0 +1,114 @@
+import gzip
+import hashlib
+import json
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from app.config import INGESTION_MAX_WORKERS, UPSTREAM_TIMEOUT
+from app.misc.files import write_atomic
+
+FETCH_FOLDER = ".fetch"
+
+_session: Optional[requests.Session] = None
+
+
+def get_session() -> requests.Session:
+    """Pooled session shared by every upstream download (keeps connections to Google alive)."""
+    global _session
+    if _session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=INGESTION_MAX_WORKERS, pool_maxsize=INGESTION_MAX_WORKERS)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        _session = session
+    return _session
+
+
+@dataclass
+class FetchResult:
+    """Outcome of a conditional download.
+
+    `changed` is False when the server answered 304 or the bytes hash to the stored SHA-256;
+    `content` is then the copy kept from the previous download.
+    """
+    name: str
+    cache_folder: Optional[str]
+    content: bytes
+    changed: bool
+    meta: dict = field(default_factory=dict)
+
+    def commit(self) -> None:
+        """Stores validators, hash and raw bytes; call once the parsed snapshot has been saved."""
+        if self.cache_folder is None:
+            return
+        if self.changed:
+            write_atomic(get_raw_path(self.cache_folder, self.name), gzip.compress(self.content))
+        write_atomic(get_meta_path(self.cache_folder, self.name), json.dumps(self.meta, indent=2).encode("utf-8"))
+
+
+def get_meta_path(cache_folder: str, name: str) -> str:
+    return os.path.join(cache_folder, FETCH_FOLDER, f"{name}.json")
+
+
+def get_raw_path(cache_folder: str, name: str) -> str:
+    return os.path.join(cache_folder, FETCH_FOLDER, f"{name}.csv.gz")
+
+
+def read_fetch_meta(cache_folder: str, name: str) -> dict:
+    try:
+        with open(get_meta_path(cache_folder, name), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def read_raw_copy(cache_folder: str, name: str) -> Optional[bytes]:
+    try:
+        with gzip.open(get_raw_path(cache_folder, name), "rb") as f:
+            return f.read()
+    except (OSError, EOFError):
+        return None
+
+
+def fetch_if_changed(url: str, name: str, cache_folder: Optional[str], force: bool = False) -> FetchResult:
+    """GETs `url`, sending the stored ETag / Last-Modified when a previous copy exists.
+
+    Without a `cache_folder`, or with `force` (e.g. the snapshot built from it is gone), the
+    download is unconditional and always reported as changed.
+    """
+    meta = read_fetch_meta(cache_folder, name) if cache_folder else {}
+    previous = None
+    if not force and cache_folder and meta.get("url") == url:
+        previous = read_raw_copy(cache_folder, name)
+
+    headers = {}
+    if previous is not None:
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+    response = get_session().get(url, headers=headers, timeout=UPSTREAM_TIMEOUT)
+    if response.status_code == 304 and previous is not None:
+        print(f"[Fetch] {name} not modified (304)")
+        return FetchResult(name, cache_folder, previous, False, meta)
+    response.raise_for_status()
+
+    content = response.content
+    digest = hashlib.sha256(content).hexdigest()
+    new_meta = {
+        "url": url,
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "sha256": digest,
+        "fetched_at": time.time(),
+    }
+    changed = previous is None or digest != meta.get("sha256")
+    if not changed:
+        print(f"[Fetch] {name} unchanged (same SHA-256)")
+    return FetchResult(name, cache_folder, content, changed, new_meta)
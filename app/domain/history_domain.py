@@ -0,0 +1,371 @@
+import bisect
+import csv
+import json
+import re
+from array import array
+from dataclasses import dataclass, field
+from datetime import date
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+from app.misc.files import write_atomic
+
+# pandas suffixes duplicated headers with ".1", ".2", ...
+DUPLICATE_HEADER_SUFFIX = re.compile(r'\.\d+$')
+HEADER_SEPARATORS = re.compile(r'[\s|:/()\-]+')
+UNIX_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+# 2: marks hold the stored point count and the sheet row count, edits are found from the raw CSV
+# 3: plus the size of the unchanged sheet head, which is not read again
+HISTORY_MARKS_VERSION = 3
+
+
+def parse_close(value) -> float:
+    try:
+        return float(str(value).replace(",", ".").replace("€", "").strip())
+    except ValueError:
+        return np.nan
+
+
+def parse_sheet_dates(date_strings: pd.Series) -> pd.Series:
+    """Typed dates from the sheet's dd/mm/yyyy cells, falling back to ISO dates."""
+    dates = pd.to_datetime(date_strings, format="%d/%m/%Y", errors="coerce")
+    missing = dates.isna()
+    if missing.any():
+        dates[missing] = pd.to_datetime(date_strings[missing], format="ISO8601", errors="coerce")
+    return dates
+
+
+def find_header_ticker(header, known_tickers: Dict[str, str]) -> Optional[str]:
+    header = DUPLICATE_HEADER_SUFFIX.sub('', str(header).replace('\ufeff', '').strip())
+    for token in HEADER_SEPARATORS.split(header):
+        ticker = known_tickers.get(token.upper())
+        if ticker:
+            return ticker
+    return None
+
+
+def detect_history_tickers(df_history: DataFrame, tickers: List[str]) -> List[Optional[str]]:
+    """Ticker of each (Date | Close) column pair.
+
+    A pair whose header names a known ticker is mapped to it. The other pairs fall back to the
+    row order of the data sheet, unless that ticker was already claimed by a header.
+    """
+    known_tickers = {ticker.upper(): ticker for ticker in tickers}
+    n_pairs = df_history.shape[1] // 2
+    headers = list(df_history.columns)
+
+    from_headers = []
+    for pair in range(n_pairs):
+        from_headers.append(find_header_ticker(headers[pair * 2], known_tickers)
+                            or find_header_ticker(headers[pair * 2 + 1], known_tickers))
+
+    claimed = {ticker for ticker in from_headers if ticker}
+    mapping = []
+    for pair, ticker in enumerate(from_headers):
+        if ticker is None and pair < len(tickers) and tickers[pair] not in claimed:
+            ticker = tickers[pair]
+        mapping.append(ticker)
+    return mapping
+
+
+def empty_price_history() -> DataFrame:
+    return DataFrame({"ticker": pd.Series(dtype=object), "date": pd.Series(dtype="datetime64[ns]"),
+                      "date_str": pd.Series(dtype=object), "close": pd.Series(dtype=float)})
+
+
+def melt_pair_segments(values: np.ndarray, segments: List[Tuple[str, int, int, int]], first_row: int = 0) -> DataFrame:
+    """Long (ticker, date, date_str, close) table of the given (ticker, pair, start row, end row) segments.
+
+    `values` holds the sheet rows from `first_row` on. Rows are kept only when both cells of the
+    pair are set and the close parses as a float.
+    """
+    segments = [segment for segment in segments if segment[3] > segment[2]]
+    if not segments:
+        return empty_price_history()
+
+    # Segment order: every row of the first pair, then every row of the second, ...
+    raw_dates = np.concatenate([values[start - first_row:end - first_row, pair * 2] for _, pair, start, end in segments])
+    raw_closes = np.concatenate([values[start - first_row:end - first_row, pair * 2 + 1] for _, pair, start, end in segments])
+    pair_tickers = np.repeat(np.array([ticker for ticker, *_ in segments], dtype=object),
+                             [end - start for _, _, start, end in segments])
+
+    present = pd.notna(raw_dates) & pd.notna(raw_closes)
+
+    # Dates repeat across tickers and closes often repeat too: each distinct cell is parsed once
+    close_codes, close_cells = pd.factorize(raw_closes[present])
+    close = np.array([parse_close(cell) for cell in close_cells], dtype=float)[close_codes]
+
+    date_codes, date_cells = pd.factorize(raw_dates[present])
+    date_strings = pd.Series([str(cell).split(" ")[0] for cell in date_cells], dtype=object)
+    dates = parse_sheet_dates(date_strings).to_numpy()
+
+    parsed = ~np.isnan(close)
+    date_codes = date_codes[parsed]
+    return DataFrame({
+        "ticker": pair_tickers[present][parsed],
+        "date": dates[date_codes],
+        "date_str": date_strings.to_numpy(dtype=object)[date_codes],
+        "close": close[parsed],
+    })
+
+
+def melt_price_history(df_history: DataFrame, tickers: List[str]) -> DataFrame:
+    """Reshapes the wide (Date | Close) sheet into one long (ticker, date, date_str, close) table."""
+    mapping = detect_history_tickers(df_history, tickers)
+    n_rows = len(df_history)
+    segments = [(ticker, pair, 0, n_rows) for pair, ticker in enumerate(mapping) if ticker is not None]
+    if not segments or n_rows == 0:
+        return empty_price_history()
+    return melt_pair_segments(df_history.to_numpy(dtype=object), segments)
+
+
+def to_day_ordinals(dates: np.ndarray) -> np.ndarray:
+    """datetime64 values -> proleptic Gregorian day ordinals (date.toordinal())."""
+    return dates.astype("datetime64[D]").astype(np.int64) + UNIX_EPOCH_ORDINAL
+
+
+def group_price_history(long_df: DataFrame) -> Dict[str, Tuple[array, array]]:
+    """(price_history, price_dates) per ticker, in date order, as array('d') closes and array('i') day ordinals.
+
+    Points whose date could not be parsed are dropped; points of the same date keep their sheet order.
+    """
+    long_df = long_df[long_df["date"].notna()]
+    ordinals = to_day_ordinals(long_df["date"].to_numpy())
+    closes = long_df["close"].to_numpy(dtype=float)
+    histories = {}
+    for ticker, positions in long_df.groupby("ticker", sort=False).indices.items():
+        dates = ordinals[positions]
+        if np.any(dates[1:] < dates[:-1]):
+            # Range queries bisect over the dates, so a sheet not in date order is sorted here
+            order = np.argsort(dates, kind="stable")
+            positions, dates = positions[order], dates[order]
+        histories[ticker] = (array('d', closes[positions].tobytes()), array('i', dates.astype(np.int32).tobytes()))
+    return histories
+
+
+def get_price_histories(df_history: DataFrame, tickers: List[str]) -> Dict[str, Tuple[array, array]]:
+    return group_price_history(melt_price_history(df_history, tickers))
+
+
+PriceHistory = Tuple[array, array]
+
+
+def get_date_range(dates: array, start: Optional[int], end: Optional[int]) -> Tuple[int, int]:
+    """Positions [low, high) of the points dated within [start, end] (ordinals, None: unbounded), by bisection."""
+    low = bisect.bisect_left(dates, start) if start is not None else 0
+    high = bisect.bisect_right(dates, end) if end is not None else len(dates)
+    return low, max(low, high)
+
+
+def slice_price_history(history: PriceHistory, start: Optional[int], end: Optional[int]) -> PriceHistory:
+    closes, dates = history
+    low, high = get_date_range(dates, start, end)
+    return closes[low:high], dates[low:high]
+
+
+@dataclass
+class HistoryMark:
+    """How far a ticker's column pair was ingested: `rows` sheet rows consumed, `points` kept in the
+    stored series, the last one dated `last_date` (ordinal)."""
+    pair: int
+    rows: int
+    points: int
+    last_date: Optional[int]
+
+
+@dataclass
+class HistoryMarks:
+    """Marks of a history sheet, with its row count (sheet rows are matched to CSV lines by position).
+
+    `prefix_rows` is the lowest ticker mark and `prefix_bytes` the size of the raw CSV up to that
+    row (header included): no ticker can have new cells above it, so when those bytes are the same
+    next time the rows above it are neither split, compared nor parsed again.
+    """
+    rows: int = 0
+    tickers: Dict[str, HistoryMark] = field(default_factory=dict)
+    prefix_rows: int = 0
+    prefix_bytes: int = 0
+
+
+def get_first_line_offset(content: bytes) -> int:
+    """Offset of the first data line of a raw CSV (right after the header)."""
+    return content.find(b"\n") + 1
+
+
+def get_line_offset(content: bytes, row: int) -> int:
+    """Offset of data line `row` of a raw CSV."""
+    offset = get_first_line_offset(content)
+    for _ in range(row):
+        offset = content.index(b"\n", offset) + 1
+    return offset
+
+
+def get_unchanged_prefix(content: Optional[bytes], previous_content: Optional[bytes], marks: HistoryMarks) -> Tuple[int, int]:
+    """(rows, bytes) of the head of `content` that is byte for byte the one the marks were taken
+    from, (0, 0) when it differs. One length check and one memcmp, whatever the sheet size."""
+    size = marks.prefix_bytes
+    if content is None or previous_content is None or not size or len(content) < size or len(previous_content) < size:
+        return 0, 0
+    # startswith compares the buffer with memcmp, without copying either side
+    if content[size - 1:size] != b"\n" or not content.startswith(memoryview(previous_content)[:size]):
+        return 0, 0
+    return marks.prefix_rows, size
+
+
+def split_sheet_lines(content: Optional[bytes], rows: int, offset: Optional[int] = None) -> Optional[List[bytes]]:
+    """Data lines of a raw CSV from byte `offset` on (default: the first data line), line i being
+    DataFrame row i from there; None when they do not map one to one to the `rows` rows left
+    (quoted line breaks, blank or skipped lines)."""
+    if content is None:
+        return None
+    if offset is None:
+        offset = get_first_line_offset(content)
+    lines = content[offset:].split(b"\n")
+    if lines and lines[-1] in (b"", b"\r"):
+        lines.pop()
+    if len(lines) != rows or not all(line.strip(b"\r") for line in lines):
+        return None
+    return lines
+
+
+def parse_sheet_line(line: bytes) -> List[str]:
+    return next(csv.reader([line.decode("utf-8", errors="replace").rstrip("\r")]), [])
+
+
+def get_changed_cells(previous_lines: List[bytes], lines: List[bytes], first_row: int,
+                      rows: int) -> Dict[int, Tuple[List[str], List[str]]]:
+    """(previous cells, cells) of the lines whose bytes differ, by sheet row, for rows `first_row`
+    (the row of both lists' first line) to `rows`. A line is compared as a whole first, so only the
+    lines touched since the previous ingestion are parsed."""
+    changed = {}
+    for index in range(min(rows - first_row, len(lines))):
+        previous = previous_lines[index] if index < len(previous_lines) else b""
+        if previous != lines[index]:
+            changed[first_row + index] = (parse_sheet_line(previous), parse_sheet_line(lines[index]))
+    return changed
+
+
+def is_pair_unchanged(changed: Dict[int, Tuple[List[str], List[str]]], pair: int, rows: int) -> bool:
+    """Whether the cells of a pair in its first `rows` rows are the ones of the previous ingestion."""
+    columns = slice(pair * 2, pair * 2 + 2)
+    return all(previous[columns] == cells[columns] for row, (previous, cells) in changed.items() if row < rows)
+
+
+def get_filled_rows(present: np.ndarray, pair: int) -> int:
+    """Rows up to the last one holding a cell of the pair (shorter columns are padded with NaN)."""
+    filled = np.flatnonzero(present[:, pair * 2] | present[:, pair * 2 + 1])
+    return int(filled[-1]) + 1 if len(filled) else 0
+
+
+def get_pair_values(df_history: DataFrame, pairs: List[int]) -> Tuple[np.ndarray, Dict[int, int]]:
+    """Whole (Date | Close) columns of the given pairs only, with the position of each pair in them."""
+    columns = [column for pair in pairs for column in (pair * 2, pair * 2 + 1)]
+    return df_history.iloc[:, columns].to_numpy(dtype=object), {pair: index for index, pair in enumerate(pairs)}
+
+
+def get_price_histories_incremental(df_history: DataFrame, tickers: List[str],
+                                    previous: Dict[str, PriceHistory], marks: HistoryMarks,
+                                    content: Optional[bytes] = None,
+                                    previous_content: Optional[bytes] = None) -> Tuple[Dict[str, PriceHistory], HistoryMarks]:
+    """Same result as get_price_histories, reading only the rows added since the previous ingestion.
+
+    `content` is the raw CSV of `df_history` and `previous_content` the one the marks were taken
+    from. When the sheet head up to the lowest ticker mark is byte for byte unchanged (one memcmp,
+    see get_unchanged_prefix), only the rows after it are split into lines, converted and compared;
+    in those, only the lines that differ are split into cells. A ticker's stored series is extended
+    with the rows after its mark when none of its cells above the mark changed and the new points
+    are dated after its high-water mark. Otherwise (edited or reordered rows, ticker moved to
+    another column, no stored series, no previous copy) the ticker is rebuilt from its whole
+    column, and an edit in the head makes every row compared as bytes again. Returns the histories
+    and the marks to store with them.
+    """
+    mapping = detect_history_tickers(df_history, tickers)
+    n_rows = len(df_history)
+    first_row, offset = get_unchanged_prefix(content, previous_content, marks)
+    if first_row > n_rows:
+        first_row, offset = 0, 0
+
+    # Rows of the head are not converted: nothing can have been appended there
+    values = df_history.iloc[first_row:].to_numpy(dtype=object)
+    # NaN is the only cell read_csv leaves unequal to itself (much cheaper than pd.notna on objects)
+    present = values == values
+
+    lines = split_sheet_lines(content, n_rows - first_row, offset or None)
+    previous_lines = split_sheet_lines(previous_content, marks.rows - first_row, offset or None)
+    changed = None
+    if lines is not None and previous_lines is not None:
+        changed = get_changed_cells(previous_lines, lines, first_row,
+                                    max((mark.rows for mark in marks.tickers.values()), default=0))
+
+    appended, rebuilt = [], []
+    for pair, ticker in enumerate(mapping):
+        if ticker is None:
+            continue
+        mark = marks.tickers.get(ticker)
+        # A column without cells past the head ends within it, where it ended last time
+        filled = first_row + get_filled_rows(present, pair)
+        if (changed is not None and mark is not None and ticker in previous and mark.pair == pair
+                and first_row <= mark.rows <= filled and len(previous[ticker][1]) == mark.points
+                and is_pair_unchanged(changed, pair, mark.rows)):
+            appended.append((ticker, pair, mark.rows, filled))
+        else:
+            rebuilt.append((ticker, pair))
+
+    histories = group_price_history(melt_pair_segments(values, appended, first_row))
+    for ticker, pair, start, end in appended:
+        closes, dates = previous[ticker]
+        new_closes, new_dates = histories.get(ticker, (array('d'), array('i')))
+        last_date = marks.tickers[ticker].last_date
+        if len(new_dates) and last_date is not None and new_dates[0] <= last_date:
+            # New rows dated before the high-water mark were inserted or re-sorted, not appended
+            rebuilt.append((ticker, pair))
+            continue
+        histories[ticker] = (closes + new_closes, dates + new_dates)
+
+    rebuilt_tickers = {ticker for ticker, _ in rebuilt}
+    histories = {ticker: history for ticker, history in histories.items() if ticker not in rebuilt_tickers}
+    new_marks = HistoryMarks(n_rows)
+    ends = {ticker: end for ticker, _, _, end in appended if ticker not in rebuilt_tickers}
+    if rebuilt:
+        # Rebuilt tickers are read from their whole column, the other columns are not converted
+        pair_values, positions = get_pair_values(df_history, [pair for _, pair in rebuilt])
+        pair_present = pair_values == pair_values
+        segments = [(ticker, positions[pair], 0, get_filled_rows(pair_present, positions[pair])) for ticker, pair in rebuilt]
+        histories.update(group_price_history(melt_pair_segments(pair_values, segments)))
+        ends.update((ticker, end) for ticker, _, _, end in segments)
+
+    for ticker, pair in ((ticker, pair) for pair, ticker in enumerate(mapping) if ticker in ends):
+        dates = histories.get(ticker, (array('d'), array('i')))[1]
+        new_marks.tickers[ticker] = HistoryMark(pair, ends[ticker], len(dates), dates[-1] if len(dates) else None)
+
+    if lines is not None and new_marks.tickers:
+        new_marks.prefix_rows = min(mark.rows for mark in new_marks.tickers.values())
+        if new_marks.prefix_rows >= first_row:
+            start = offset or get_first_line_offset(content)
+            new_marks.prefix_bytes = start + sum(len(line) + 1 for line in lines[:new_marks.prefix_rows - first_row])
+        else:
+            new_marks.prefix_bytes = get_line_offset(content, new_marks.prefix_rows)
+    return histories, new_marks
+
+
+def read_history_marks(filepath: str) -> Tuple[Optional[str], HistoryMarks]:
+    """(snapshot the marks were stored with, marks of the sheet); marks of an older layout are ignored."""
+    try:
+        with open(filepath, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != HISTORY_MARKS_VERSION:
+            return None, HistoryMarks()
+        return data["snapshot"], HistoryMarks(data["rows"], {ticker: HistoryMark(*mark) for ticker, mark in data["tickers"].items()},
+                                              data["prefix_rows"], data["prefix_bytes"])
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        return None, HistoryMarks()
+
+
+def write_history_marks(filepath: str, snapshot: str, marks: HistoryMarks) -> None:
+    data = {"version": HISTORY_MARKS_VERSION, "snapshot": snapshot, "rows": marks.rows,
+            "tickers": {ticker: [mark.pair, mark.rows, mark.points, mark.last_date] for ticker, mark in marks.tickers.items()},
+            "prefix_rows": marks.prefix_rows, "prefix_bytes": marks.prefix_bytes}
+    write_atomic(filepath, json.dumps(data).encode("utf-8"))
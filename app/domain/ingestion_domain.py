@@ -0,0 +1,112 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from io import BytesIO
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import pandas as pd
+from pandas import DataFrame
+
+from app.config import INGESTION_MAX_WORKERS
+from app.domain.fetch_domain import FetchResult, fetch_if_changed
+from app.domain.jobs_domain import job_detail
+
+@dataclass
+class SheetSource:
+    url: str
+    read_csv_kwargs: dict = field(default_factory=dict)
+    # Folder of the snapshot built from the sheet, where validators and the raw copy are kept
+    cache_folder: Optional[str] = None
+    force: bool = False
+
+
+SheetSources = Dict[str, SheetSource]
+# DataFrame.attrs key of the raw CSV a sheet was parsed from
+RAW_CONTENT = "raw_content"
+# name -> (names of the sheets it needs, build function called with those DataFrames)
+SheetBuilds = Dict[str, Tuple[Sequence[str], Callable[..., object]]]
+
+
+@dataclass
+class IngestionResult:
+    results: Dict[str, object] = field(default_factory=dict)
+    # Builds skipped because none of their sheets changed since the last commit
+    unchanged: List[str] = field(default_factory=list)
+    fetches: Dict[str, FetchResult] = field(default_factory=dict)
+
+    def commit(self) -> None:
+        for fetch in self.fetches.values():
+            fetch.commit()
+
+
+def parse_csv(content: bytes, **read_csv_kwargs) -> DataFrame:
+    """Parsed sheet, carrying the raw bytes it was parsed from (see get_raw_content)."""
+    frame = pd.read_csv(BytesIO(content), on_bad_lines='skip', **read_csv_kwargs)
+    frame.attrs[RAW_CONTENT] = content
+    return frame
+
+
+def get_raw_content(frame: DataFrame) -> Optional[bytes]:
+    return frame.attrs.get(RAW_CONTENT)
+
+
+def read_sheet(name: str, source: SheetSource) -> Tuple[FetchResult, Optional[DataFrame]]:
+    """Downloads a sheet and parses it, unless its content is unchanged since the last commit."""
+    fetch = fetch_if_changed(source.url, name, source.cache_folder, source.force)
+    if not fetch.changed:
+        return fetch, None
+    return fetch, parse_csv(fetch.content, **source.read_csv_kwargs)
+
+
+def run_ingestion(sheets: SheetSources, builds: SheetBuilds) -> IngestionResult:
+    """Downloads every sheet concurrently and runs each build as soon as its inputs are parsed.
+
+    Each sheet is downloaded and parsed by its own pool task, and builds are queued on the same
+    bounded pool, so parsing and building overlap with the downloads still in flight. A full
+    refresh takes about as long as the slowest sheet. Builds whose sheets are all unchanged are
+    skipped; an unchanged sheet is only parsed when a sibling of its build changed. The first
+    failure cancels what is left and is re-raised. Call `commit()` on the result once the
+    outputs are saved.
+    """
+    started = time.monotonic()
+    ingestion = IngestionResult()
+    frames: Dict[str, Optional[DataFrame]] = {}
+
+    def build_from_sheets(inputs: Sequence[str], build: Callable[..., object]) -> object:
+        for sheet in inputs:
+            if frames[sheet] is None:
+                frames[sheet] = parse_csv(ingestion.fetches[sheet].content, **sheets[sheet].read_csv_kwargs)
+        return build(*(frames[sheet] for sheet in inputs))
+
+    pool = ThreadPoolExecutor(max_workers=INGESTION_MAX_WORKERS, thread_name_prefix="ingestion")
+    try:
+        pending = {pool.submit(read_sheet, name, source): ("sheet", name) for name, source in sheets.items()}
+        queued = set()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                kind, name = pending.pop(future)
+                if kind == "build":
+                    ingestion.results[name] = future.result()
+                    print(f"[Ingestion] Built {name} after {time.monotonic() - started:.1f}s")
+                    job_detail(f"{len(ingestion.fetches)}/{len(sheets)} sheets fetched, {len(ingestion.results)} built")
+                    continue
+
+                ingestion.fetches[name], frames[name] = future.result()
+                print(f"[Ingestion] Fetched sheet {name} after {time.monotonic() - started:.1f}s")
+                job_detail(f"{len(ingestion.fetches)}/{len(sheets)} sheets fetched, {len(ingestion.results)} built")
+                for build_name, (inputs, build) in builds.items():
+                    if build_name in queued or not all(sheet in frames for sheet in inputs):
+                        continue
+                    queued.add(build_name)
+                    if not any(ingestion.fetches[sheet].changed for sheet in inputs):
+                        ingestion.unchanged.append(build_name)
+                        print(f"[Ingestion] {build_name} unchanged, skipping parse")
+                        continue
+                    pending[pool.submit(build_from_sheets, inputs, build)] = ("build", build_name)
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+    print(f"[Ingestion] {len(sheets)} sheets, {len(ingestion.results)} builds, "
+          f"{len(ingestion.unchanged)} unchanged in {time.monotonic() - started:.1f}s")
+    return ingestion
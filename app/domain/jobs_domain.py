@@ -0,0 +1,209 @@
+import json
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional
+
+from app.config import DATA_FOLDER, JOBS_MAX_WORKERS, JOBS_RETENTION_SECONDS
+from app.domain.refresh_lock_domain import file_lock
+from app.misc.files import write_atomic
+
+JOBS_FOLDER = os.path.join(DATA_FOLDER, "jobs")
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+FINISHED = (SUCCEEDED, FAILED)
+
+
+def get_job_path(job_id: str) -> str:
+    return os.path.join(JOBS_FOLDER, f"{job_id}.json")
+
+
+def read_job(job_id: str) -> Optional[dict]:
+    """State of a job as last written by the process running it, or None if unknown."""
+    if not all(c in "0123456789abcdef" for c in job_id):
+        return None
+    try:
+        with open(get_job_path(job_id), "r", encoding="utf-8") as f:
+            job = json.load(f)
+    except (OSError, ValueError):
+        return None
+    # A job whose process (or the worker that queued it) died is never going to finish
+    if job["status"] == RUNNING and job.get("pid") and not is_process_alive(job["pid"]):
+        job.update(status=FAILED, error="Job process exited before finishing")
+    elif job["status"] == QUEUED and not is_process_alive(job["queued_by"]):
+        job.update(status=FAILED, error="Worker that queued the job exited before running it")
+    return job
+
+
+def write_job(job: dict) -> None:
+    write_atomic(get_job_path(job["id"]), json.dumps(job, indent=2).encode("utf-8"))
+
+
+def is_process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobReporter:
+    """Records the progress of a job in data/jobs/<id>.json, from inside the process running it.
+
+    Stages are timed as they run; `detail` updates the running stage (e.g. sheets fetched so far).
+    """
+
+    def __init__(self, job_id: str):
+        self.job = read_job(job_id) or {"id": job_id, "stages": []}
+        self._lock = threading.Lock()
+
+    def _save(self) -> None:
+        with self._lock:
+            write_job(self.job)
+
+    def start(self) -> None:
+        self.job.update(status=RUNNING, pid=os.getpid(), started_at=time.time())
+        self._save()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        stage = {"name": name, "status": RUNNING, "started_at": time.time()}
+        self.job["stages"].append(stage)
+        self._save()
+        started = time.monotonic()
+        try:
+            yield
+            stage["status"] = SUCCEEDED
+        except BaseException:
+            stage["status"] = FAILED
+            raise
+        finally:
+            stage["seconds"] = round(time.monotonic() - started, 3)
+            self._save()
+
+    def detail(self, detail: str) -> None:
+        # Called from the ingestion threads while the stage runs
+        with self._lock:
+            if self.job["stages"]:
+                self.job["stages"][-1]["detail"] = detail
+                write_job(self.job)
+
+    def finish(self, result: object) -> None:
+        self.job.update(status=SUCCEEDED, result=result, finished_at=time.time())
+        self.job["seconds"] = round(self.job["finished_at"] - self.job["started_at"], 3)
+        self._save()
+
+    def fail(self, error: Exception) -> None:
+        self.job.update(status=FAILED, error=str(error), finished_at=time.time())
+        self._save()
+
+
+# Reporter of the job running in this process, so deep stages can report without threading it through
+_current: Optional[JobReporter] = None
+
+
+@contextmanager
+def job_stage(name: str) -> Iterator[None]:
+    """Times `name` as a stage of the current job; does nothing outside a job."""
+    if _current is None:
+        yield
+        return
+    with _current.stage(name):
+        yield
+
+
+def job_detail(detail: str) -> None:
+    if _current is not None:
+        _current.detail(detail)
+
+
+def run_job(job_id: str, target: Callable[[], object]) -> None:
+    """Entry point in the pool process: runs `target` and records its outcome."""
+    global _current
+    _current = JobReporter(job_id)
+    _current.start()
+    try:
+        _current.finish(target())
+    except Exception as e:
+        print(f"[Jobs] Job {job_id} failed: {e}")
+        _current.fail(e)
+    finally:
+        _current = None
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_pid: Optional[int] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ProcessPoolExecutor:
+    # Separate processes keep the pandas work off the request threads; "spawn" because forking a
+    # threaded worker can copy held locks. One pool per worker process (gunicorn forks after import).
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ProcessPoolExecutor(max_workers=JOBS_MAX_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def get_active_job_path(kind: str) -> str:
+    return os.path.join(JOBS_FOLDER, f"{kind}.active")
+
+
+def submit_job(kind: str, target: Callable[[], object]) -> dict:
+    """Queues `target` (a picklable, module-level callable) and returns the job state.
+
+    A job of the same kind still queued or running in any worker is returned instead of a new one.
+    """
+    with file_lock(f"jobs-{kind}", 10) as acquired:
+        if not acquired:
+            raise TimeoutError(f"Could not queue a {kind} job")
+        try:
+            with open(get_active_job_path(kind), "r", encoding="utf-8") as f:
+                active = read_job(f.read().strip())
+        except OSError:
+            active = None
+        if active is not None and active["status"] not in FINISHED:
+            return active
+
+        clean_old_jobs()
+        job = {"id": uuid.uuid4().hex, "kind": kind, "status": QUEUED, "created_at": time.time(),
+               "queued_by": os.getpid(), "stages": [], "result": None, "error": None}
+        write_job(job)
+        write_atomic(get_active_job_path(kind), job["id"].encode("utf-8"))
+
+    future = get_pool().submit(run_job, job["id"], target)
+    future.add_done_callback(lambda done: _on_job_done(job["id"], done))
+    print(f"[Jobs] Queued {kind} job {job['id']}")
+    return job
+
+
+def _on_job_done(job_id: str, future: Future) -> None:
+    # run_job records its own failures; this only catches a pool that could not run it at all
+    error = future.exception()
+    if error is not None:
+        job = read_job(job_id)
+        if job is not None and job["status"] not in FINISHED:
+            job.update(status=FAILED, error=str(error), finished_at=time.time())
+            write_job(job)
+
+
+def clean_old_jobs() -> None:
+    cutoff = time.time() - JOBS_RETENTION_SECONDS
+    for name in os.listdir(JOBS_FOLDER) if os.path.isdir(JOBS_FOLDER) else []:
+        path = os.path.join(JOBS_FOLDER, name)
+        if name.endswith(".json") and os.path.getmtime(path) < cutoff:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
@@ -0,0 +1,178 @@
+import json
+import math
+import os
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import date
+from typing import Dict, List, Optional, Sequence
+
+from app.config import ALPHA_VANTAGE_DAILY_QUOTA, DATA_FOLDER
+from app.domain.refresh_lock_domain import file_lock
+from app.domain.response_cache_domain import DEFAULT_TTL, FUNCTION_TTLS, get_payload_age
+from app.misc.files import write_atomic
+
+PLANNER_FOLDER = os.path.join(DATA_FOLDER, "alphavantage")
+REQUEST_COUNTS_PATH = os.path.join(PLANNER_FOLDER, "request_counts.json")
+USAGE_PATH = os.path.join(PLANNER_FOLDER, "usage.json")
+LAST_PLAN_PATH = os.path.join(PLANNER_FOLDER, "last_plan.json")
+
+REQUEST_COUNTS_FLUSH_INTERVAL = 60
+USAGE_LOCK_TIMEOUT = 5
+# Staleness given to a payload that was never fetched: above any expired one, so new tickers come first
+MISSING_STALENESS = math.inf
+
+_pending_requests: Counter = Counter()
+_pending_lock = threading.Lock()
+_last_flush = time.monotonic()
+# API calls made while another worker held the usage file, written with the next call
+_pending_calls = 0
+
+
+def read_json(path: str, default):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+# ---- Per-ticker request counts (GET /api/company/<ticker>) ----
+
+def record_company_request(ticker: str) -> None:
+    """Counts a view in memory; counts are merged into the shared file at most once a minute."""
+    with _pending_lock:
+        _pending_requests[ticker] += 1
+    if time.monotonic() - _last_flush >= REQUEST_COUNTS_FLUSH_INTERVAL:
+        flush_request_counts()
+
+
+def flush_request_counts() -> None:
+    global _last_flush
+    with _pending_lock:
+        pending = dict(_pending_requests)
+        _pending_requests.clear()
+        _last_flush = time.monotonic()
+    if not pending:
+        return
+    with file_lock("request-counts", 1) as acquired:
+        if not acquired:
+            # Another worker is flushing, keep the counts for the next flush
+            with _pending_lock:
+                _pending_requests.update(pending)
+            return
+        counts = Counter(read_json(REQUEST_COUNTS_PATH, {}))
+        counts.update(pending)
+        write_atomic(REQUEST_COUNTS_PATH, json.dumps(dict(counts)).encode("utf-8"))
+
+
+def get_request_counts() -> Dict[str, int]:
+    counts = Counter(read_json(REQUEST_COUNTS_PATH, {}))
+    with _pending_lock:
+        counts.update(_pending_requests)
+    return dict(counts)
+
+
+# ---- Daily API usage ----
+
+def record_api_call() -> None:
+    global _pending_calls
+    today = date.today().isoformat()
+    with _pending_lock:
+        _pending_calls += 1
+    with file_lock("alphavantage-usage", USAGE_LOCK_TIMEOUT) as acquired:
+        if not acquired:
+            # Keep the call pending rather than losing it, the next call that gets the lock writes it
+            print("[Planner] usage file busy, API call kept pending")
+            return
+        with _pending_lock:
+            pending, _pending_calls = _pending_calls, 0
+        usage = read_json(USAGE_PATH, {})
+        calls = usage.get("calls", 0) if usage.get("date") == today else 0
+        write_atomic(USAGE_PATH, json.dumps({"date": today, "calls": calls + pending}).encode("utf-8"))
+
+
+def get_calls_used_today() -> int:
+    usage = read_json(USAGE_PATH, {})
+    calls = usage.get("calls", 0) if usage.get("date") == date.today().isoformat() else 0
+    with _pending_lock:
+        return calls + _pending_calls
+
+
+# ---- Planning ----
+
+@dataclass
+class RefreshPlan:
+    budget: int
+    # ticker -> functions to fetch from the API this cycle, in priority order
+    planned: Dict[str, List[str]] = field(default_factory=dict)
+    # stale tickers that did not fit in the budget (served from the stale cache)
+    deferred: List[str] = field(default_factory=list)
+    # tickers whose payloads are all within their TTL
+    skipped: List[str] = field(default_factory=list)
+
+    @property
+    def calls(self) -> int:
+        return sum(len(functions) for functions in self.planned.values())
+
+    def report(self) -> dict:
+        return {
+            "planned_at": time.time(),
+            "budget": self.budget,
+            "calls": self.calls,
+            "planned": len(self.planned),
+            "deferred": len(self.deferred),
+            "skipped": len(self.skipped),
+            "planned_tickers": list(self.planned),
+            "deferred_tickers": self.deferred,
+        }
+
+
+def get_staleness(function: str, ticker: str) -> Optional[float]:
+    """Age over TTL (> 1 means expired), MISSING_STALENESS (infinite) if never fetched, None while fresh."""
+    age = get_payload_age(function, ticker)
+    if age is None:
+        return MISSING_STALENESS
+    staleness = age / FUNCTION_TTLS.get(function, DEFAULT_TTL)
+    return staleness if staleness > 1 else None
+
+
+def plan_refresh(tickers: Sequence[str], functions: Sequence[str], budget: Optional[int] = None) -> RefreshPlan:
+    """Spends the remaining daily quota on the most-viewed and most-stale tickers first.
+
+    priority = (1 + log(1 + views)) * worst staleness among the ticker's expired payloads.
+    A ticker is planned only if all its expired payloads fit in what is left of the budget.
+    """
+    if budget is None:
+        budget = max(0, ALPHA_VANTAGE_DAILY_QUOTA - get_calls_used_today())
+    plan = RefreshPlan(budget=budget)
+    views = get_request_counts()
+
+    candidates = []
+    for ticker in dict.fromkeys(tickers):
+        stale = {function: get_staleness(function, ticker) for function in functions}
+        needed = [function for function, staleness in stale.items() if staleness is not None]
+        if not needed:
+            plan.skipped.append(ticker)
+            continue
+        priority = (1 + math.log1p(views.get(ticker, 0))) * max(stale[function] for function in needed)
+        candidates.append((priority, ticker, needed))
+
+    remaining = budget
+    for _, ticker, needed in sorted(candidates, key=lambda candidate: -candidate[0]):
+        if len(needed) <= remaining:
+            plan.planned[ticker] = needed
+            remaining -= len(needed)
+        else:
+            plan.deferred.append(ticker)
+
+    report = plan.report()
+    write_atomic(LAST_PLAN_PATH, json.dumps(report, indent=2).encode("utf-8"))
+    print(f"[Planner] budget {budget}: {report['planned']} planned ({report['calls']} calls), "
+          f"{report['deferred']} deferred, {report['skipped']} skipped")
+    return plan
+
+
+def get_last_plan_report() -> dict:
+    return read_json(LAST_PLAN_PATH, {})
@@ -0,0 +1,132 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+from array import array
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from app.models.companies import Company
+
+MATRIX_FOLDER = "matrix"
+MATRIX_FILES = ("dates.npy", "prices.npy", "observed.npy", "tickers.json")
+
+
+@dataclass
+class PriceMatrix:
+    """Every ticker's closes aligned on one calendar (the union of all their dates).
+
+    prices[day, column] is forward-filled from the ticker's last close (NaN before its first one),
+    observed[day, column] tells whether the ticker actually has a close that day. Loaded from disk,
+    the arrays are read-only memory maps.
+    """
+    tickers: List[str]
+    dates: np.ndarray     # int32 day ordinals, ascending
+    prices: np.ndarray    # float64, len(dates) x len(tickers)
+    observed: np.ndarray  # bool, same shape
+
+    def column(self, ticker: str) -> Optional[int]:
+        try:
+            return self.tickers.index(ticker)
+        except ValueError:
+            return None
+
+
+def build_price_matrix(companies: List[Company]) -> PriceMatrix:
+    companies = list({company.ticker: company for company in companies}.values())
+    tickers = [company.ticker for company in companies]
+    all_dates = [np.frombuffer(company.price_dates, dtype=np.int32) for company in companies]
+    dates = np.unique(np.concatenate(all_dates)) if all_dates else np.empty(0, dtype=np.int32)
+
+    raw = np.full((len(dates), len(tickers)), np.nan)
+    observed = np.zeros((len(dates), len(tickers)), dtype=bool)
+    for column, (company, company_dates) in enumerate(zip(companies, all_dates)):
+        rows = np.searchsorted(dates, company_dates)
+        # A date listed twice keeps its last close, as in the stored series
+        raw[rows, column] = np.frombuffer(company.price_history, dtype=np.float64)
+        observed[rows, column] = True
+
+    # Forward fill: each cell takes the row of the latest observation at or before it
+    latest = np.maximum.accumulate(np.where(observed, np.arange(len(dates))[:, None], 0), axis=0)
+    prices = raw[latest, np.arange(len(tickers))]
+    return PriceMatrix(tickers, dates.astype(np.int32), prices, observed)
+
+
+def get_observed_histories(matrix: PriceMatrix) -> Dict[str, Tuple[array, array]]:
+    """(closes, day ordinals) of each ticker on the days it traded, back out of the matrix.
+
+    A date listed twice in a series only kept its last close in the matrix, so such a series comes
+    back shorter than it was stored.
+    """
+    columns, rows = np.nonzero(np.asarray(matrix.observed).T)
+    bounds = np.searchsorted(columns, np.arange(len(matrix.tickers) + 1))
+    prices, dates = np.asarray(matrix.prices), np.asarray(matrix.dates, dtype=np.int32)
+    histories = {}
+    for column, ticker in enumerate(matrix.tickers):
+        ticker_rows = rows[bounds[column]:bounds[column + 1]]
+        histories[ticker] = (array('d', np.ascontiguousarray(prices[ticker_rows, column]).tobytes()),
+                             array('i', dates[ticker_rows].tobytes()))
+    return histories
+
+
+def get_price_matrix_folder(snapshot_path: str) -> str:
+    """data/<T>/matrix/<hash>/ for the store object data/<T>/objects/<hash>.<ext>."""
+    root = os.path.dirname(os.path.dirname(snapshot_path))
+    return os.path.join(root, MATRIX_FOLDER, os.path.splitext(os.path.basename(snapshot_path))[0])
+
+
+def _encode_npy(values: np.ndarray) -> bytes:
+    buffer = io.BytesIO()
+    np.save(buffer, values, allow_pickle=False)
+    return buffer.getvalue()
+
+
+def save_price_matrix(snapshot_path: str, matrix: PriceMatrix) -> str:
+    """Writes the matrix next to its snapshot version; the folder appears whole or not at all."""
+    folder = get_price_matrix_folder(snapshot_path)
+    parent = os.path.dirname(folder)
+    os.makedirs(parent, exist_ok=True)
+    tmp_folder = tempfile.mkdtemp(dir=parent, prefix=".tmp-")
+    try:
+        for name, values in (("dates.npy", matrix.dates), ("prices.npy", matrix.prices), ("observed.npy", matrix.observed)):
+            with open(os.path.join(tmp_folder, name), "wb") as f:
+                f.write(_encode_npy(np.ascontiguousarray(values)))
+        with open(os.path.join(tmp_folder, "tickers.json"), "w", encoding="utf-8") as f:
+            json.dump(matrix.tickers, f, ensure_ascii=False)
+        os.chmod(tmp_folder, 0o755)
+        try:
+            os.rename(tmp_folder, folder)
+        except OSError:
+            pass  # Another process saved the same version first
+    finally:
+        shutil.rmtree(tmp_folder, ignore_errors=True)
+    return folder
+
+
+def load_price_matrix(snapshot_path: str) -> Optional[PriceMatrix]:
+    """The saved matrix of a snapshot version, memory-mapped, or None if it was never saved."""
+    folder = get_price_matrix_folder(snapshot_path)
+    try:
+        with open(os.path.join(folder, "tickers.json"), "r", encoding="utf-8") as f:
+            tickers = json.load(f)
+        dates, prices, observed = (np.load(os.path.join(folder, name), mmap_mode="r", allow_pickle=False)
+                                   for name in MATRIX_FILES[:3])
+    except (OSError, ValueError):
+        return None
+    if prices.shape != (len(dates), len(tickers)) or observed.shape != prices.shape:
+        return None
+    return PriceMatrix(tickers, dates, prices, observed)
+
+
+def remove_stale_price_matrices(snapshot_paths: Iterable[str]) -> None:
+    """Deletes the matrices of versions no longer in the store (given the paths of the kept ones)."""
+    kept = {get_price_matrix_folder(path) for path in snapshot_paths}
+    parents = {os.path.dirname(folder) for folder in kept}
+    for parent in parents:
+        for name in os.listdir(parent) if os.path.isdir(parent) else []:
+            folder = os.path.join(parent, name)
+            if folder not in kept and not name.startswith(".tmp-"):
+                shutil.rmtree(folder, ignore_errors=True)
@@ -0,0 +1,141 @@
+import fcntl
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Optional
+
+from app.config import DATA_FOLDER
+from app.misc.files import write_atomic
+
+LOCK_FOLDER = os.path.join(DATA_FOLDER, ".locks")
+LOCK_POLL_INTERVAL = 0.1
+
+REFRESHED = "refreshed"
+ALREADY_FRESH = "already_fresh"
+TIMED_OUT = "timed_out"
+
+STATS_LOCK_TIMEOUT = 1
+
+# Per-process counters; every process also merges them into <name>.stats.json, read by /api/metrics
+# (refreshes run in job processes, so a web worker's own counters stay empty)
+_stats: Dict[str, Dict[str, float]] = {}
+# Counters not merged into the shared file yet (its lock was busy)
+_unsaved: Dict[str, Dict[str, float]] = {}
+_stats_lock = threading.Lock()
+
+
+def _new_stats() -> Dict[str, float]:
+    return {
+        REFRESHED: 0, ALREADY_FRESH: 0, TIMED_OUT: 0, "failed": 0,
+        "waits": 0, "wait_seconds_total": 0.0, "wait_seconds_max": 0.0,
+    }
+
+
+def _add_stats(stats: dict, values: Dict[str, float]) -> None:
+    for key, value in values.items():
+        if key == "wait_seconds_max":
+            stats[key] = max(stats.get(key, 0.0), value)
+        else:
+            stats[key] = stats.get(key, 0) + value
+
+
+def _record(name: str, duration: Optional[float] = None, **values: float) -> None:
+    with _stats_lock:
+        _add_stats(_stats.setdefault(name, _new_stats()), values)
+        _add_stats(_unsaved.setdefault(name, {}), values)
+    _save_shared_stats(name, duration)
+
+
+@contextmanager
+def file_lock(name: str, timeout: float) -> Iterator[bool]:
+    """Exclusive flock on data/.locks/<name>.lock, shared by every thread and process.
+
+    Yields whether the lock was acquired within `timeout` seconds (0 means a single attempt).
+    """
+    os.makedirs(LOCK_FOLDER, exist_ok=True)
+    fd = os.open(os.path.join(LOCK_FOLDER, f"{name}.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+    deadline = time.monotonic() + timeout
+    acquired = False
+    try:
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                acquired = True
+                break
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    break
+                time.sleep(LOCK_POLL_INTERVAL)
+        yield acquired
+    finally:
+        if acquired:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+
+def _save_shared_stats(name: str, duration: Optional[float] = None) -> None:
+    """Merges this process's unsaved counters (and the last refresh, given its `duration`) into the shared file."""
+    with file_lock(f"{name}.stats", STATS_LOCK_TIMEOUT) as acquired:
+        if not acquired:
+            # Kept in _unsaved, merged by the next save of this process
+            return
+        with _stats_lock:
+            unsaved = _unsaved.pop(name, {})
+        stats = read_shared_stats(name)
+        _add_stats(stats, unsaved)
+        if duration is not None:
+            stats["refresh_count"] = stats.get("refresh_count", 0) + 1
+            stats["last_refresh_at"] = time.time()
+            stats["last_refresh_seconds"] = round(duration, 3)
+            stats["last_refresh_pid"] = os.getpid()
+        write_atomic(os.path.join(LOCK_FOLDER, f"{name}.stats.json"), json.dumps(stats).encode("utf-8"))
+
+
+def read_shared_stats(name: str) -> dict:
+    try:
+        with open(os.path.join(LOCK_FOLDER, f"{name}.stats.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def single_flight(name: str, is_fresh: Callable[[], bool], refresh: Callable[[], object], wait_timeout: float) -> str:
+    """Runs `refresh` in exactly one process at a time.
+
+    Callers that find the lock taken wait up to `wait_timeout` seconds for the holder to finish,
+    then re-check `is_fresh` instead of refreshing again. Returns REFRESHED, ALREADY_FRESH or
+    TIMED_OUT (the caller should then serve its stale snapshot).
+    """
+    started = time.monotonic()
+    with file_lock(name, wait_timeout) as acquired:
+        waited = time.monotonic() - started
+        wait = dict(waits=1, wait_seconds_total=waited, wait_seconds_max=waited) if waited >= LOCK_POLL_INTERVAL else {}
+        if not acquired:
+            _record(name, **wait, **{TIMED_OUT: 1})
+            print(f"[{name}] Refresh in progress elsewhere, serving stale data")
+            return TIMED_OUT
+        if is_fresh():
+            _record(name, **wait, **{ALREADY_FRESH: 1})
+            return ALREADY_FRESH
+        refresh_started = time.monotonic()
+        try:
+            refresh()
+        except Exception:
+            _record(name, **wait, failed=1)
+            raise
+        _record(name, time.monotonic() - refresh_started, **wait, **{REFRESHED: 1})
+        return REFRESHED
+
+
+def get_refresh_metrics() -> dict:
+    with _stats_lock:
+        local = {name: dict(stats) for name, stats in _stats.items()}
+    names = set(local)
+    if os.path.isdir(LOCK_FOLDER):
+        names.update(f[:-len(".stats.json")] for f in os.listdir(LOCK_FOLDER) if f.endswith(".stats.json"))
+    return {
+        "pid": os.getpid(),
+        "refresh": {name: {"process": local.get(name, {}), "shared": read_shared_stats(name)} for name in sorted(names)},
+    }
@@ -0,0 +1,58 @@
+import os
+import threading
+import time
+from typing import Callable, Optional
+
+
+class BackgroundRefresher:
+    """Daemon thread that keeps a dataset warm so requests never wait on the upstream.
+
+    Every `interval` seconds (or as soon as `trigger` is called) it runs `refresh` if `is_fresh`
+    reports the dataset as stale. Failures are logged, the last good snapshot stays in place and
+    triggers are ignored for `retry_delay` seconds so a failing upstream is not hammered.
+    """
+
+    def __init__(self, name: str, refresh: Callable[[], object], is_fresh: Callable[[], bool],
+                 interval: float, retry_delay: float = 60):
+        self.name = name
+        self.refresh = refresh
+        self.is_fresh = is_fresh
+        self.interval = interval
+        self.retry_delay = retry_delay
+        self.last_refresh_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+
+    def start(self) -> None:
+        # Threads do not survive a fork (gunicorn --preload), so each worker starts its own
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name=f"{self.name}-refresher", daemon=True)
+            self._thread.start()
+
+    def trigger(self) -> None:
+        self.start()
+        self._wake.set()
+
+    def _run(self) -> None:
+        while True:
+            self._wake.clear()
+            try:
+                if not self.is_fresh():
+                    started = time.monotonic()
+                    self.refresh()
+                    self.last_refresh_at = time.time()
+                    self.last_error = None
+                    print(f"[{self.name}] Refreshed in {time.monotonic() - started:.1f}s")
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"[{self.name}] Background refresh failed: {e}")
+                time.sleep(self.retry_delay)
+            self._wake.wait(self.interval)
@@ -0,0 +1,89 @@
+import gzip
+import json
+import os
+import re
+import threading
+import time
+from typing import Dict, Optional
+
+from app.config import ALPHA_VANTAGE_CACHE_MAX_BYTES, DATA_FOLDER
+from app.misc.files import write_atomic
+
+CACHE_FOLDER = os.path.join(DATA_FOLDER, "alphavantage", "cache")
+
+DAY = 24 * 3600
+# How long a payload is reused, per Alpha Vantage function
+FUNCTION_TTLS: Dict[str, float] = {
+    "OVERVIEW": 30 * DAY,  # fundamentals move with quarterly reports
+    "TIME_SERIES_MONTHLY_ADJUSTED": 7 * DAY,  # one new point a month, the current month is refreshed weekly
+    "GLOBAL_QUOTE": 3600,  # intraday
+}
+DEFAULT_TTL = DAY
+
+_lock = threading.Lock()
+
+
+def get_cache_path(function: str, symbol: str) -> str:
+    safe_symbol = re.sub(r'[^A-Za-z0-9._-]', '_', symbol)
+    return os.path.join(CACHE_FOLDER, function, f"{safe_symbol}.json.gz")
+
+
+def get_payload_age(function: str, symbol: str) -> Optional[float]:
+    """Seconds since (function, symbol) was fetched, None if it was never cached."""
+    try:
+        return time.time() - os.stat(get_cache_path(function, symbol)).st_mtime
+    except OSError:
+        return None
+
+
+def get_cached_payload(function: str, symbol: str, allow_stale: bool = False) -> Optional[dict]:
+    """Cached payload for (function, symbol) if younger than the function's TTL (or at all with `allow_stale`)."""
+    path = get_cache_path(function, symbol)
+    try:
+        fetched_at = os.stat(path).st_mtime
+        if not allow_stale and time.time() - fetched_at > FUNCTION_TTLS.get(function, DEFAULT_TTL):
+            return None
+        with gzip.open(path, "rb") as f:
+            payload = json.loads(f.read())
+        # mtime is the fetch time, atime the last use (drives LRU eviction)
+        os.utime(path, (time.time(), fetched_at))
+        return payload
+    except (OSError, EOFError, ValueError):
+        return None
+
+
+def store_payload(function: str, symbol: str, payload: dict) -> None:
+    data = gzip.compress(json.dumps(payload, separators=(",", ":")).encode("utf-8"))
+    write_atomic(get_cache_path(function, symbol), data)
+    evict_cache()
+
+
+def evict_cache(max_bytes: int = ALPHA_VANTAGE_CACHE_MAX_BYTES) -> int:
+    """Deletes least recently used payloads until the cache fits in `max_bytes`. Returns the number deleted."""
+    with _lock:
+        entries = []
+        total = 0
+        for root, _, files in os.walk(CACHE_FOLDER):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_atime, stat.st_size, path))
+                total += stat.st_size
+        if total <= max_bytes:
+            return 0
+
+        deleted = 0
+        for _, size, path in sorted(entries):
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                deleted += 1
+            except OSError:
+                continue
+        print(f"[Alpha Vantage cache] Evicted {deleted} payloads")
+        return deleted
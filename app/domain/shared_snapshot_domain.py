@@ -0,0 +1,89 @@
+import json
+import mmap
+import os
+import struct
+import threading
+from typing import Callable, Dict, Optional, Tuple
+
+from app.config import SHARED_SNAPSHOT_FOLDER
+from app.misc.files import FileKey, get_file_key, write_atomic
+
+# Layout: magic | header length (uint32 LE) | JSON header | payload.
+# Offsets stored in the header are relative to the start of the payload.
+SHARED_MAGIC = b"BAMSNAP1"
+SHARED_PREFIX = struct.Struct("<8sI")
+
+
+class SharedSnapshotFile:
+    """Read-only memory map of a published snapshot, shared through the page cache by every worker."""
+
+    def __init__(self, filepath: str):
+        self.path = filepath
+        with open(filepath, "rb") as f:
+            self.file_key = get_file_key(filepath)
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, header_length = SHARED_PREFIX.unpack_from(self.mm, 0)
+        if magic != SHARED_MAGIC:
+            raise ValueError(f"{filepath} is not a shared snapshot")
+        header_start = SHARED_PREFIX.size
+        self.header = json.loads(self.mm[header_start:header_start + header_length])
+        self.payload_start = header_start + header_length
+        self.payload_size = len(self.mm) - self.payload_start
+        source = self.header.get("source")
+        self.source_key = tuple(source) if source else None
+
+    def read(self, offset: int, length: int) -> bytes:
+        start = self.payload_start + offset
+        return self.mm[start:start + length]
+
+    @property
+    def payload(self) -> bytes:
+        return self.read(0, self.payload_size)
+
+
+def get_shared_snapshot_path(name: str) -> str:
+    return os.path.join(SHARED_SNAPSHOT_FOLDER, f"{name}.snap")
+
+
+def write_shared_snapshot(filepath: str, header: dict, payload: bytes) -> None:
+    header_bytes = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    write_atomic(filepath, SHARED_PREFIX.pack(SHARED_MAGIC, len(header_bytes)) + header_bytes + payload)
+
+
+def open_shared_snapshot(filepath: str) -> Optional[SharedSnapshotFile]:
+    try:
+        return SharedSnapshotFile(filepath)
+    except (OSError, ValueError, struct.error) as e:
+        if not isinstance(e, FileNotFoundError):
+            print(f"[Shared] Could not attach {filepath}: {e}")
+        return None
+
+
+_attached: Dict[str, SharedSnapshotFile] = {}
+_attached_lock = threading.Lock()
+
+
+def attach_shared_snapshot(name: str, source_key: FileKey,
+                           build: Callable[[], Tuple[dict, bytes]], layout: int = 1) -> SharedSnapshotFile:
+    """Returns the published snapshot for `source_key`, publishing it first if no worker has done it yet.
+
+    `build` returns the header and payload to publish. A republish swaps the file atomically,
+    so workers that still map the previous version keep reading a consistent copy. A file
+    published with another `layout` (header format) is republished as well.
+    """
+    filepath = get_shared_snapshot_path(name)
+    shared = _attached.get(name)
+    if shared is not None and shared.source_key == source_key and shared.file_key == get_file_key(filepath):
+        return shared
+
+    with _attached_lock:
+        shared = open_shared_snapshot(filepath)
+        if shared is None or shared.source_key != source_key or shared.header.get("layout", 1) != layout:
+            header, payload = build()
+            header["source"] = list(source_key) if source_key else None
+            header["layout"] = layout
+            write_shared_snapshot(filepath, header, payload)
+            print(f"[Shared] Published {filepath}")
+            shared = SharedSnapshotFile(filepath)
+        _attached[name] = shared
+        return shared
@@ -0,0 +1,494 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from array import array
+from dataclasses import fields
+from datetime import date
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple, Union
+
+from app.config import SHARED_SNAPSHOTS, SNAPSHOT_STAT_INTERVAL
+from app.domain.columnar_snapshot_domain import COLUMNAR_EXTENSION, ColumnarSnapshotFile
+from app.domain.correlation_domain import compute_return_matrix
+from app.domain.downsampling_domain import downsample_series
+from app.domain.history_domain import slice_price_history
+from app.domain.price_matrix_domain import PriceMatrix, build_price_matrix, load_price_matrix
+from app.domain.shared_snapshot_domain import SharedSnapshotFile, attach_shared_snapshot
+from app.domain.stocks_domain import get_companies_file_as_of, get_latest_companies_file, read_companies_file
+from app.domain.watchlist_index_domain import INDEXED_FIELDS, WatchlistIndex
+from app.misc.files import FileKey, get_file_key
+from app.models.companies import Company, build_price_series, format_day
+
+SnapshotKey = FileKey
+# (from, to) day ordinals, either end may be open (None)
+DateWindow = Tuple[Optional[int], Optional[int]]
+# Past versions kept decoded for ?as_of= requests
+HISTORICAL_SNAPSHOTS_CACHED = 4
+# Distinct ?fields= projections of a watchlist kept encoded per snapshot
+PROJECTIONS_CACHED = 8
+COMPANY_FIELDS = [f.name for f in fields(Company) if f.name != "source_text"]
+# Date ranges / downsamplings of price histories kept encoded per snapshot
+HISTORY_VIEWS_CACHED = 4096
+HISTORY_FIELDS = ("price_dates", "price_history")
+# Correlation / covariance matrices kept encoded per snapshot
+CORRELATIONS_CACHED = 16
+# Header format of the shared watchlist files (2: entries carry the field offsets, 3: analytics fields,
+# 4: source text and dd/mm/yyyy dates served again, 5: typed values of the sort index)
+SHARED_LAYOUT = 5
+
+
+def encode_json(data) -> bytes:
+    """Encodes like Flask's default JSON provider (sorted keys, compact separators)."""
+    return json.dumps(data, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+
+def compute_etag(body: bytes) -> str:
+    return hashlib.sha256(body).hexdigest()[:32]
+
+
+def encode_fields(data: dict) -> Dict[str, bytes]:
+    """One `"key":value` fragment per field; joined in key order they give encode_json(data)."""
+    return {key: encode_json(key) + b":" + encode_json(value) for key, value in data.items()}
+
+
+def join_fields(fragments: List[bytes]) -> bytes:
+    return b"{" + b",".join(fragments) + b"}"
+
+
+def get_projection(fields: Optional[str], exclude: Optional[str]) -> Optional[Tuple[str, ...]]:
+    """Sorted field names to serve for ?fields= / ?exclude= (None: the whole record).
+
+    The ticker is always kept so projected list items can still be told apart.
+    Raises ValueError on an unknown field.
+    """
+    if not fields and not exclude:
+        return None
+    requested = {name.strip() for name in (fields or "").split(",") if name.strip()} or set(COMPANY_FIELDS)
+    excluded = {name.strip() for name in (exclude or "").split(",") if name.strip()}
+    unknown = (requested | excluded) - set(COMPANY_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    return tuple(sorted((requested - excluded) | {"ticker"}))
+
+
+def lay_out_records(companies: List[Company]) -> Tuple[bytes, Dict[str, list]]:
+    """Encodes the companies as one JSON array, each record a slice of it and each field a slice of the record.
+
+    Returns the array and, per ticker, [offset, length, etag, {field: [offset, length]}].
+    """
+    entries = {}
+    chunks = [b"["]
+    offset = 1
+    for i, company in enumerate(companies):
+        if i:
+            chunks.append(b",")
+            offset += 1
+        fragments = encode_fields(company.to_dict())
+        names = sorted(fragments)
+        record = join_fields([fragments[name] for name in names])
+        field_offsets = {}
+        position = offset + 1
+        for name in names:
+            field_offsets[name] = [position, len(fragments[name])]
+            position += len(fragments[name]) + 1
+        entries[company.ticker] = [offset, len(record), compute_etag(record), field_offsets]
+        chunks.append(record)
+        offset += len(record)
+    chunks.append(b"]")
+    return b"".join(chunks), entries
+
+
+class ProjectedSnapshot(ABC):
+    """Serves ?fields= projections by joining pre-encoded field fragments, never re-serializing a record.
+
+    Subclasses provide `key`, `tickers` (response order) and `get_fragments`. Projected watchlist
+    bodies are cached per field set, and the sort index built once, for the life of the snapshot.
+    """
+
+    key: SnapshotKey
+    _projections: Dict[Tuple[str, ...], Tuple[bytes, str]]
+    _history_views: Dict[tuple, Dict[str, bytes]]
+    _correlations: Dict[tuple, Tuple[bytes, str]]
+    _sort_index: Optional[WatchlistIndex] = None
+    _price_matrix: Optional[PriceMatrix] = None
+
+    @abstractmethod
+    def get_fragments(self, ticker: str, names: Tuple[str, ...]) -> Optional[List[bytes]]:
+        """Encoded `"name":value` fragments of a company's `names` fields (None: unknown ticker)."""
+
+    def get_history(self, ticker: str) -> Optional[Tuple[array, array]]:
+        company = self.get(ticker)
+        return (company.price_history, company.price_dates) if company else None
+
+    def get_history_fragments(self, ticker: str, window: Optional[DateWindow],
+                              downsampling: Optional[Tuple[int, str]]) -> Optional[Dict[str, bytes]]:
+        """Encoded price_dates / price_history fragments of a date range of the series and/or of it
+        downsampled, computed once per snapshot."""
+        key = (ticker, window, downsampling)
+        fragments = self._history_views.get(key)
+        if fragments is None:
+            history = self.get_history(ticker)
+            if history is None:
+                return None
+            if window is not None:
+                history = slice_price_history(history, *window)
+            if downsampling is not None:
+                history = downsample_series(*history, *downsampling)
+            prices, dates = history
+            fragments = encode_fields({
+                "price_dates": [format_day(ordinal) for ordinal in dates],
+                "price_history": prices.tolist(),
+            })
+            if len(self._history_views) < HISTORY_VIEWS_CACHED:
+                self._history_views[key] = fragments
+        return fragments
+
+    def get_history_view(self, ticker: str, names: Optional[Tuple[str, ...]], window: Optional[DateWindow],
+                         downsampling: Optional[Tuple[int, str]]) -> Optional[Tuple[bytes, str]]:
+        """A record (or projection of it) with only part of its price history: the dates within
+        `window` (ordinals, inclusive) and/or at most `points` points of it."""
+        names = names or tuple(sorted(COMPANY_FIELDS))
+        if not set(HISTORY_FIELDS) & set(names):
+            return self.get_projected(ticker, names)
+        history = self.get_history_fragments(ticker, window, downsampling)
+        if history is None:
+            return None
+        others = tuple(name for name in names if name not in history)
+        fragments = dict(zip(others, self.get_fragments(ticker, others)))
+        fragments.update(history)
+        body = join_fields([fragments[name] for name in names])
+        return body, compute_etag(body)
+
+    @abstractmethod
+    def get_index_rows(self, names: Tuple[str, ...]) -> List[list]:
+        """Typed values of `names` per company, in `tickers` order (served fields may hold source text)."""
+
+    @property
+    def price_matrix(self) -> PriceMatrix:
+        """Aligned calendar x tickers closes of this version, memory-mapped from the file saved with it.
+
+        Matrices are written when a version is saved or imported, never on the request path: a
+        version without one gets it built in memory, for the life of the snapshot.
+        """
+        if self._price_matrix is None:
+            matrix = load_price_matrix(self.key[0]) if self.key else None
+            if matrix is None:
+                matrix = build_price_matrix([self.get(ticker) for ticker in self.tickers])
+            self._price_matrix = matrix
+        return self._price_matrix
+
+    def get_correlation_body(self, window: Optional[int], frequency: str, kind: str) -> Tuple[bytes, str]:
+        """Encoded compute_return_matrix of this version's price matrix, cached per window, frequency and kind."""
+        key = (window, frequency, kind)
+        encoded = self._correlations.get(key)
+        if encoded is None:
+            body = encode_json(compute_return_matrix(self.price_matrix, window, frequency, kind))
+            encoded = body, compute_etag(body)
+            if len(self._correlations) < CORRELATIONS_CACHED:
+                self._correlations[key] = encoded
+        return encoded
+
+    @property
+    def sort_index(self) -> WatchlistIndex:
+        if self._sort_index is None:
+            # Cursors carry the version so a page is never read against another snapshot
+            version = compute_etag(repr(self.key).encode())[:12]
+            self._sort_index = WatchlistIndex(version, self.tickers, self.get_index_rows(INDEXED_FIELDS))
+        return self._sort_index
+
+    def get_projected(self, ticker: str, names: Tuple[str, ...]) -> Optional[Tuple[bytes, str]]:
+        fragments = self.get_fragments(ticker, names)
+        if fragments is None:
+            return None
+        body = join_fields(fragments)
+        return body, compute_etag(body)
+
+    def get_projected_body(self, names: Tuple[str, ...]) -> Tuple[bytes, str]:
+        projected = self._projections.get(names)
+        if projected is None:
+            body = b"[" + b",".join(join_fields(self.get_fragments(ticker, names)) for ticker in self.tickers) + b"]"
+            projected = body, compute_etag(body)
+            if len(self._projections) < PROJECTIONS_CACHED:
+                self._projections[names] = projected
+        return projected
+
+
+class CompanySnapshot(ProjectedSnapshot):
+    """Decoded watchlist file with a ticker index, valid as long as the file identity does not change.
+
+    Response bodies are encoded once per snapshot, so serving a company, a whole watchlist or a
+    projection of them only copies bytes.
+    """
+
+    def __init__(self, key: SnapshotKey, companies: List[Company]):
+        self.key = key
+        self.companies = companies
+        self.index: Dict[str, Company] = {company.ticker: company for company in companies}
+        self.body, self.entries = lay_out_records(companies)
+        self.etag = compute_etag(self.body)
+        self.checked_at = time.monotonic()
+        self._projections = {}
+        self._history_views = {}
+        self._correlations = {}
+
+    def __len__(self) -> int:
+        return len(self.companies)
+
+    @property
+    def tickers(self) -> List[str]:
+        return list(self.entries)
+
+    def get(self, ticker: str) -> Optional[Company]:
+        return self.index.get(ticker)
+
+    def get_index_rows(self, names: Tuple[str, ...]) -> List[list]:
+        return [[getattr(self.index[ticker], name) for name in names] for ticker in self.entries]
+
+    def get_encoded(self, ticker: str) -> Optional[Tuple[bytes, str]]:
+        entry = self.entries.get(ticker)
+        if entry is None:
+            return None
+        offset, length, etag, _ = entry
+        return self.body[offset:offset + length], etag
+
+    def get_fragments(self, ticker: str, names: Tuple[str, ...]) -> Optional[List[bytes]]:
+        entry = self.entries.get(ticker)
+        if entry is None:
+            return None
+        return [self.body[offset:offset + length] for offset, length in (entry[3][name] for name in names)]
+
+
+class SharedCompanySnapshot(ProjectedSnapshot):
+    """Same interface as CompanySnapshot, backed by a memory-mapped file published once for all workers.
+
+    Only the ticker offsets are held per worker; records are decoded lazily when a Company is needed.
+    """
+
+    def __init__(self, key: SnapshotKey, shared: SharedSnapshotFile):
+        self.key = key
+        self.shared = shared
+        self.entries: Dict[str, list] = shared.header["entries"]
+        self.etag: str = shared.header["etag"]
+        self.checked_at = time.monotonic()
+        self._companies: Optional[List[Company]] = None
+        self._projections = {}
+        self._history_views = {}
+        self._correlations = {}
+
+    @property
+    def body(self) -> bytes:
+        return self.shared.payload
+
+    @property
+    def companies(self) -> List[Company]:
+        if self._companies is None:
+            self._companies = [Company.from_dict(data) for data in json.loads(self.body)]
+        return self._companies
+
+    @property
+    def tickers(self) -> List[str]:
+        return list(self.entries)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, ticker: str) -> Optional[Company]:
+        encoded = self.get_encoded(ticker)
+        if encoded is None:
+            return None
+        return Company.from_dict(json.loads(encoded[0]))
+
+    def get_encoded(self, ticker: str) -> Optional[Tuple[bytes, str]]:
+        entry = self.entries.get(ticker)
+        if entry is None:
+            return None
+        offset, length, etag, _ = entry
+        return self.shared.read(offset, length), etag
+
+    def get_history(self, ticker: str) -> Optional[Tuple[array, array]]:
+        # Decodes the two history fields only
+        fragments = self.get_fragments(ticker, HISTORY_FIELDS)
+        if fragments is None:
+            return None
+        values = json.loads(join_fields(fragments))
+        return build_price_series(values["price_history"], values["price_dates"])
+
+    def get_index_rows(self, names: Tuple[str, ...]) -> List[list]:
+        # Published in the header, typed: the record fragments hold the source text of some fields
+        index = self.shared.header["index"]
+        columns = [index["fields"].index(name) if name in index["fields"] else None for name in names]
+        return [[None if column is None else row[column] for column in columns] for row in index["rows"]]
+
+    def get_fragments(self, ticker: str, names: Tuple[str, ...]) -> Optional[List[bytes]]:
+        # Only the requested fields are read from the mapping
+        entry = self.entries.get(ticker)
+        if entry is None:
+            return None
+        return [self.shared.read(offset, length) for offset, length in (entry[3][name] for name in names)]
+
+
+class ColumnarCompanySnapshot(ProjectedSnapshot):
+    """Same interface as CompanySnapshot over a memory-mapped columnar file.
+
+    Opening it only parses the header; a company is decoded and encoded the first time it is requested.
+    """
+
+    def __init__(self, key: SnapshotKey, columnar: ColumnarSnapshotFile):
+        self.key = key
+        self.columnar = columnar
+        self.checked_at = time.monotonic()
+        self._fragments: Dict[str, Dict[str, bytes]] = {}
+        self._encoded: Dict[str, Tuple[bytes, str]] = {}
+        self._body: Optional[Tuple[bytes, str]] = None
+        self._companies: Optional[List[Company]] = None
+        self._projections = {}
+        self._history_views = {}
+        self._correlations = {}
+
+    @property
+    def companies(self) -> List[Company]:
+        if self._companies is None:
+            self._companies = self.columnar.read_all()
+        return self._companies
+
+    @property
+    def tickers(self) -> List[str]:
+        return self.columnar.tickers
+
+    @property
+    def body(self) -> bytes:
+        return self._get_body()[0]
+
+    @property
+    def etag(self) -> str:
+        return self._get_body()[1]
+
+    def _get_body(self) -> Tuple[bytes, str]:
+        if self._body is None:
+            body = b"[" + b",".join(self.get_encoded(ticker)[0] for ticker in self.columnar.tickers) + b"]"
+            self._body = body, compute_etag(body)
+        return self._body
+
+    def __len__(self) -> int:
+        return len(self.columnar)
+
+    def get(self, ticker: str) -> Optional[Company]:
+        return self.columnar.get(ticker)
+
+    def get_history(self, ticker: str) -> Optional[Tuple[array, array]]:
+        return self.columnar.get_history(ticker)
+
+    def get_index_rows(self, names: Tuple[str, ...]) -> List[list]:
+        # Straight from the scalar table, without decoding any history (files older than a field lack it)
+        fields = self.columnar.fields
+        rows = self.columnar.rows
+        columns = [fields.index(name) if name in fields else None for name in names]
+        return [[None if column is None else rows[entry[0]][column] for column in columns]
+                for entry in self.columnar.index.values()]
+
+    def _get_all_fragments(self, ticker: str) -> Optional[Dict[str, bytes]]:
+        fragments = self._fragments.get(ticker)
+        if fragments is None:
+            company = self.columnar.get(ticker)
+            if company is None:
+                return None
+            fragments = self._fragments[ticker] = encode_fields(company.to_dict())
+        return fragments
+
+    def get_encoded(self, ticker: str) -> Optional[Tuple[bytes, str]]:
+        encoded = self._encoded.get(ticker)
+        if encoded is None:
+            fragments = self._get_all_fragments(ticker)
+            if fragments is None:
+                return None
+            body = join_fields([fragments[name] for name in sorted(fragments)])
+            encoded = self._encoded[ticker] = body, compute_etag(body)
+        return encoded
+
+    def get_fragments(self, ticker: str, names: Tuple[str, ...]) -> Optional[List[bytes]]:
+        fragments = self._get_all_fragments(ticker)
+        if fragments is None:
+            return None
+        return [fragments[name] for name in names]
+
+
+def build_shared_payload(companies: List[Company]) -> Tuple[dict, bytes]:
+    """Lays the encoded records out as one JSON array, so each record is a slice of the watchlist body.
+
+    The header also carries the typed INDEXED_FIELDS values of each entry, for the sort index.
+    """
+    payload, entries = lay_out_records(companies)
+    by_ticker = {company.ticker: company for company in companies}
+    index = {"fields": list(INDEXED_FIELDS),
+             "rows": [[getattr(by_ticker[ticker], name) for name in INDEXED_FIELDS] for ticker in entries]}
+    return {"etag": compute_etag(payload), "entries": entries, "index": index}, payload
+
+
+Snapshot = Union[CompanySnapshot, ColumnarCompanySnapshot, SharedCompanySnapshot]
+
+_snapshots: Dict[str, Snapshot] = {}
+_snapshots_lock = threading.Lock()
+
+
+def read_companies(key: SnapshotKey) -> List[Company]:
+    if key is None:
+        return []
+    return read_companies_file(key[0])
+
+
+def load_snapshot(companies_type: str, key: SnapshotKey) -> Snapshot:
+    if not SHARED_SNAPSHOTS:
+        if key is not None and key[0].endswith(COLUMNAR_EXTENSION):
+            return ColumnarCompanySnapshot(key, ColumnarSnapshotFile(key[0]))
+        return CompanySnapshot(key, read_companies(key))
+    shared = attach_shared_snapshot(companies_type, key, lambda: build_shared_payload(read_companies(key)), SHARED_LAYOUT)
+    return SharedCompanySnapshot(key, shared)
+
+
+def get_companies_snapshot(companies_type: str) -> Snapshot:
+    snapshot = _snapshots.get(companies_type)
+    if snapshot is not None and time.monotonic() - snapshot.checked_at < SNAPSHOT_STAT_INTERVAL:
+        return snapshot
+
+    filepath = get_latest_companies_file(companies_type)
+    key = get_file_key(filepath) if filepath else None
+    if snapshot is not None and snapshot.key == key:
+        snapshot.checked_at = time.monotonic()
+        return snapshot
+
+    with _snapshots_lock:
+        snapshot = _snapshots.get(companies_type)
+        if snapshot is None or snapshot.key != key:
+            try:
+                snapshot = load_snapshot(companies_type, key)
+            except (OSError, ValueError) as e:
+                print(f"[{companies_type}] Failed to load snapshot {key}: {e}")
+                snapshot = CompanySnapshot(None, [])
+            _snapshots[companies_type] = snapshot
+            print(f"[{companies_type}] Snapshot loaded ({len(snapshot)} companies)")
+        snapshot.checked_at = time.monotonic()
+        return snapshot
+
+
+@lru_cache(maxsize=HISTORICAL_SNAPSHOTS_CACHED)
+def load_historical_snapshot(filepath: str) -> Snapshot:
+    # Store objects are never rewritten, so the path alone identifies the content
+    key = get_file_key(filepath)
+    if filepath.endswith(COLUMNAR_EXTENSION):
+        return ColumnarCompanySnapshot(key, ColumnarSnapshotFile(filepath))
+    return CompanySnapshot(key, read_companies_file(filepath))
+
+
+def get_companies_snapshot_as_of(companies_type: str, day: date) -> Optional[Snapshot]:
+    filepath = get_companies_file_as_of(companies_type, day)
+    if filepath is None:
+        return None
+    return load_historical_snapshot(filepath)
+
+
+def invalidate_snapshots() -> None:
+    with _snapshots_lock:
+        _snapshots.clear()
@@ -0,0 +1,224 @@
+import bisect
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from datetime import date, timedelta
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from app.config import SNAPSHOT_RETENTION_DAYS
+from app.domain.refresh_lock_domain import file_lock
+from app.misc.files import FileKey, get_file_key, write_atomic
+
+MANIFEST_NAME = "manifest.json"
+OBJECTS_FOLDER = "objects"
+STORE_LOCK_TIMEOUT = 30
+
+
+@dataclass
+class SnapshotVersion:
+    """One distinct content of a dataset, valid from `date` until the next version's date.
+
+    `last_seen` is the last day the source was confirmed to still hold this content.
+    """
+    date: str
+    last_seen: str
+    hash: str
+    file: str
+    size: int
+    checked_at: float
+
+
+class SnapshotStore:
+    """Append-only, content-addressed history of a dataset's daily snapshots.
+
+    Snapshot bytes are kept once per content in <folder>/objects/<sha256><extension>, and
+    <folder>/manifest.json lists the versions in date order. Saving the same content again only
+    moves `last_seen` forward. Readers go through the manifest (cached per file identity), never
+    through a listing of the folder, and look a date up with a bisect over the version dates.
+    """
+
+    def __init__(self, name: str, folder: str, legacy_suffixes: Tuple[str, ...] = (),
+                 on_import: Optional[Callable[[List[str]], None]] = None):
+        self.name = name
+        self.folder = folder
+        # Dated files (<YYYY-MM-DD><suffix>) written before the store existed, imported once
+        self.legacy_suffixes = legacy_suffixes
+        # Called with the paths of the imported versions, e.g. to write what a save would write next to them
+        self.on_import = on_import
+        self.manifest_path = os.path.join(folder, MANIFEST_NAME)
+        self._legacy_checked = not legacy_suffixes
+        # (manifest identity, versions, version dates), swapped as a whole
+        self._state: Tuple[FileKey, List[SnapshotVersion], List[str]] = (None, [], [])
+        self._lock = threading.Lock()
+
+    def get_path(self, version: SnapshotVersion) -> str:
+        return os.path.join(self.folder, version.file)
+
+    def _load(self) -> Tuple[List[SnapshotVersion], List[str]]:
+        key = get_file_key(self.manifest_path)
+        if key is None and not self._legacy_checked:
+            self._import_legacy_files()
+            self._legacy_checked = True
+            key = get_file_key(self.manifest_path)
+        state = self._state
+        if key != state[0]:
+            with self._lock:
+                versions = self._read_manifest() if key else []
+                state = self._state = (key, versions, [version.date for version in versions])
+        return state[1], state[2]
+
+    def versions(self) -> List[SnapshotVersion]:
+        return self._load()[0]
+
+    def latest(self) -> Optional[SnapshotVersion]:
+        versions = self.versions()
+        return versions[-1] if versions else None
+
+    def latest_path(self) -> Optional[str]:
+        version = self.latest()
+        return self.get_path(version) if version else None
+
+    def as_of(self, day: date) -> Optional[SnapshotVersion]:
+        """Version that was current on `day`, or None if the history starts later."""
+        versions, dates = self._load()
+        position = bisect.bisect_right(dates, day.isoformat())
+        return versions[position - 1] if position else None
+
+    def is_recent(self, max_age_days: int) -> bool:
+        version = self.latest()
+        if version is None:
+            return False
+        return (date.today() - date.fromisoformat(version.last_seen)).days <= max_age_days
+
+    def save(self, data: bytes, extension: str) -> SnapshotVersion:
+        """Records `data` as today's snapshot, storing its bytes only if that content is new."""
+        digest = hashlib.sha256(data).hexdigest()
+        filename = os.path.join(OBJECTS_FOLDER, f"{digest}{extension}")
+        filepath = os.path.join(self.folder, filename)
+        with self._locked():
+            if not os.path.exists(filepath):
+                write_atomic(filepath, data)
+            versions = self._read_manifest()
+            today = date.today().isoformat()
+            now = time.time()
+            if versions and versions[-1].file == filename:
+                versions[-1].last_seen, versions[-1].checked_at = today, now
+                self._write_manifest(versions)
+                return versions[-1]
+
+            dropped = []
+            if versions and versions[-1].date == today:
+                dropped.append(versions.pop())  # Several contents the same day: the last one wins
+            version = SnapshotVersion(today, today, digest, filename, len(data), now)
+            versions.append(version)
+            kept = self._compact(versions)
+            self._write_manifest(kept)
+            self._remove_unreferenced(kept, dropped + versions)
+            return version
+
+    def carry_forward(self) -> Optional[SnapshotVersion]:
+        """Confirms the latest version is still current today (the source did not change)."""
+        with self._locked():
+            versions = self._read_manifest()
+            if not versions:
+                return None
+            versions[-1].last_seen, versions[-1].checked_at = date.today().isoformat(), time.time()
+            self._write_manifest(versions)
+            return versions[-1]
+
+    def _compact(self, versions: List[SnapshotVersion]) -> List[SnapshotVersion]:
+        """Keeps every version of the last SNAPSHOT_RETENTION_DAYS days and the last one of each month before that."""
+        cutoff = (date.today() - timedelta(days=SNAPSHOT_RETENTION_DAYS)).isoformat()
+        kept = []
+        for i, version in enumerate(versions):
+            following = versions[i + 1] if i + 1 < len(versions) else None
+            if version.date >= cutoff or following is None or following.date[:7] != version.date[:7]:
+                kept.append(version)
+        if len(kept) < len(versions):
+            print(f"[{self.name}] Compacted {len(versions) - len(kept)} old snapshot versions")
+        return kept
+
+    def _remove_unreferenced(self, kept: List[SnapshotVersion], candidates: List[SnapshotVersion]) -> None:
+        """Deletes the objects of `candidates` no kept version points to (call once the manifest is written)."""
+        referenced = {version.file for version in kept}
+        for version in candidates:
+            if version.file not in referenced:
+                referenced.add(version.file)
+                try:
+                    os.remove(self.get_path(version))
+                except FileNotFoundError:
+                    pass
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        # Manifest updates are serialized across processes; failing beats losing a version
+        with file_lock(f"store-{self.name}", STORE_LOCK_TIMEOUT) as acquired:
+            if not acquired:
+                raise TimeoutError(f"Snapshot store {self.name} is locked")
+            yield
+
+    def _read_manifest(self) -> List[SnapshotVersion]:
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                return [SnapshotVersion(**version) for version in json.load(f)["versions"]]
+        except FileNotFoundError:
+            return []
+
+    def _write_manifest(self, versions: List[SnapshotVersion]) -> None:
+        manifest = {"versions": [asdict(version) for version in versions]}
+        write_atomic(self.manifest_path, json.dumps(manifest, indent=2).encode("utf-8"))
+
+    def _import_legacy_files(self) -> None:
+        with self._locked():
+            if os.path.exists(self.manifest_path):
+                return
+            try:
+                names = sorted(os.listdir(self.folder))
+            except FileNotFoundError:
+                return
+            imported = []
+            versions: List[SnapshotVersion] = []
+            for name in names:
+                day = name[:len("YYYY-MM-DD")]
+                if name[len(day):] not in self.legacy_suffixes:
+                    continue
+                try:
+                    date.fromisoformat(day)
+                except ValueError:
+                    continue
+                source = os.path.join(self.folder, name)
+                with open(source, "rb") as f:
+                    data = f.read()
+                digest = hashlib.sha256(data).hexdigest()
+                filename = os.path.join(OBJECTS_FOLDER, f"{digest}{os.path.splitext(name)[1]}")
+                if not os.path.exists(os.path.join(self.folder, filename)):
+                    write_atomic(os.path.join(self.folder, filename), data)
+                if versions and versions[-1].file == filename:
+                    versions[-1].last_seen = day
+                else:
+                    versions.append(SnapshotVersion(day, day, digest, filename, len(data), os.path.getmtime(source)))
+                imported.append(source)
+            if versions:
+                self._write_manifest(versions)
+                for source in imported:
+                    os.remove(source)
+                print(f"[{self.name}] Imported {len(imported)} dated files into {self.manifest_path}")
+                if self.on_import is not None:
+                    self.on_import([self.get_path(version) for version in versions])
+
+
+_stores: Dict[str, SnapshotStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_snapshot_store(name: str, folder: str, legacy_suffixes: Tuple[str, ...] = (),
+                       on_import: Optional[Callable[[List[str]], None]] = None) -> SnapshotStore:
+    with _stores_lock:
+        store = _stores.get(name)
+        if store is None:
+            store = _stores[name] = SnapshotStore(name, folder, legacy_suffixes, on_import)
+        return store
@@ -1,13 +1,23 @@
+import bisect
+from array import array
 from datetime import date, datetime, timedelta
 import json
 import math
 import os
 import re
-from typing import List, Union
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple, Union
 
+import numpy as np
 from pandas import DataFrame, Series
-from app.models.companies import Company
-from dataclasses import asdict
+from pandas.api.types import is_numeric_dtype
+from app.config import DATA_FOLDER, SNAPSHOT_FORMAT
+from app.domain.columnar_snapshot_domain import COLUMNAR_EXTENSION, ColumnarSnapshotFile, encode_columnar_snapshot, read_columnar_snapshot
+from app.domain.fetch_domain import FETCH_FOLDER
+from app.domain.history_domain import HistoryMarks, PriceHistory, get_price_histories, read_history_marks, write_history_marks
+from app.domain.price_matrix_domain import build_price_matrix, get_observed_histories, get_price_matrix_folder, load_price_matrix, remove_stale_price_matrices, save_price_matrix
+from app.domain.snapshot_store_domain import SnapshotStore, get_snapshot_store
+from app.models.companies import Company, get_source_text
 
 SECTOR_PE_BASELINES = {
     'technologie': 20,
@@ -22,50 +32,75 @@ SECTOR_PE_BASELINES = {
     'media': 16
 }
 DEFAULT_PE_BASELINE = 15
+# Sheet column of each typed field whose text is served as written
+SOURCE_TEXT_COLUMNS = {"price": "Price", "high_price": "Plus haut prix", "pe": "PE", "daily_change": "cours J %", "eps": "EPS"}
 
-# def build_company_data(company_info: dict, global_quote: dict, time_series: dict) -> Union[Company, None]:
-#     company = None
-#     try:
-#         price = float(global_quote['Global Quote']['05. price'])
-#         high_price = float(company_info['52WeekHigh'])
-#         drop_from_high = f"{((price - high_price) / high_price) * 100:.2f}%"
-#         price_history_10y = get_last_10_years_price_history(time_series)
-#         discount, fair_value =  calculate_fair_discount_and_fair_value(company_info, price)      
-#         attractiveness_score = calculate_attractiveness_score(company_info, price, high_price)
-#         company = Company(
-#             ticker=company_info['Symbol'],
-#             name=company_info['Name'],
-#             market_cap=company_info['MarketCapitalization'],
-#             currency=company_info['Currency'],
-#             price=global_quote['Global Quote']['05. price'],
-#             high_price=company_info['52WeekHigh'],
-#             drop_from_high=drop_from_high,
-#             pe=str(company_info['PERatio']),
-#             daily_change=global_quote['Global Quote']['10. change percent'],
-#             eps=str(company_info['EPS']),
-#             sector=company_info['Sector'].lower(),
-#             fair_value_gap=safe_number(discount),
-#             fair_value=safe_number(fair_value),
-#             attractiveness_score=attractiveness_score,
-#             moat='-',
-#             price_history=price_history_10y,
-#             price_dates=[]
-#         )
-#     except KeyError as e:
-#         print(f"KeyError: {e} - Missing data in company_info or global_quote")
-#         return None
-#     except Exception as e:
-#         print(f"An error occurred while building company data: {e}")
-#         return None
-#     return company
-
-def get_last_10_years_price_history(time_series: dict) -> list[float]:
+# (history sheet, tickers) -> price history per ticker
+HistoryLoader = Callable[[DataFrame, List[str]], Dict[str, PriceHistory]]
+
+
+@dataclass
+class WatchlistBuild:
+    companies: List[Company] = field(default_factory=list)
+    # Where the history sheet was ingested up to, stored with the snapshot built from it
+    history_marks: HistoryMarks = field(default_factory=HistoryMarks)
+
+def build_company_data(company_info: dict, global_quote: dict, time_series: dict) -> Union[Company, None]:
+    company = None
+    try:
+        price = float(global_quote['Global Quote']['05. price'])
+        high_price = float(company_info['52WeekHigh'])
+        drop_from_high = f"{((price - high_price) / high_price) * 100:.2f}%"
+        price_history_10y, price_dates_10y = get_last_10_years_price_series(time_series)
+        # Same scoring as the sheet path, fed with the API fields
+        row = {
+            "PE": company_info['PERatio'],
+            "EPS": company_info['EPS'],
+            "Price": price,
+            "Plus haut prix": high_price,
+            "Secteur": company_info['Sector'],
+            "Beta": company_info.get('Beta', 1.0),
+        }
+        discount, fair_value = calculate_fair_discount_and_fair_value(row)
+        attractiveness_score = calculate_long_term_quality_score(row)
+        company = Company.from_dict({
+            "ticker": company_info['Symbol'],
+            "name": company_info['Name'],
+            "market_cap": company_info['MarketCapitalization'],
+            "currency": company_info['Currency'],
+            "price": global_quote['Global Quote']['05. price'],
+            "high_price": company_info['52WeekHigh'],
+            "drop_from_high": drop_from_high,
+            "pe": company_info['PERatio'],
+            "daily_change": global_quote['Global Quote']['10. change percent'],
+            "eps": company_info['EPS'],
+            "sector": company_info['Sector'].lower(),
+            "fair_value_gap": safe_number(discount),
+            "fair_value": safe_number(fair_value),
+            "attractiveness_score": attractiveness_score,
+            "moat": '-',
+            "price_history": price_history_10y,
+            "price_dates": price_dates_10y
+        })
+    except KeyError as e:
+        print(f"KeyError: {e} - Missing data in company_info or global_quote")
+        return None
+    except Exception as e:
+        print(f"An error occurred while building company data: {e}")
+        return None
+    return company
+
+def get_last_10_years_price_series(time_series: dict) -> Tuple[list[float], list[str]]:
+    """(adjusted closes, dates) of the last 10 years, oldest first.
+
+    ISO dates sort chronologically as strings, so the start is a bisect over the sorted keys
+    rather than a parse of every date.
+    """
     ten_years_ago = datetime.today().replace(day=1) - timedelta(days=365 * 10)
-    return [
-        float(data["5. adjusted close"])
-        for date_str, data in sorted(time_series.items())
-        if datetime.strptime(date_str, "%Y-%m-%d") >= ten_years_ago
-    ]
+    dates = sorted(time_series)
+    # ten_years_ago carries today's time of day, so its own date was never included
+    dates = dates[bisect.bisect_right(dates, ten_years_ago.date().isoformat()):]
+    return [float(time_series[date_str]["5. adjusted close"]) for date_str in dates], dates
 
 def parse_float(value: any) -> float:
     """Cleans and converts a string to float, returns 0.0 if invalid."""
@@ -165,106 +200,226 @@ def calculate_long_term_quality_score(row: dict) -> int:
         return 0
 
 
-def save_companies_data(companies: list[Company], save_path: str='data') -> None:
-    postfix = save_path.replace('data/', '')
-    os.makedirs(save_path, exist_ok=True)
-    today = date.today().isoformat()
-    filename = f"{today}-{postfix}.json"
-    filepath = os.path.join(save_path, filename)
-    json_ready_companies = [asdict(company) for company in companies]
-    with open(filepath, 'w', encoding='utf-8') as f:
-        json.dump(json_ready_companies, f, ensure_ascii=False, indent=2)
+def get_companies_folder(companies_type: str) -> str:
+    return os.path.join(DATA_FOLDER, 'PEA' if companies_type == 'PEA' else 'CTO')
+
+def save_companies_data(companies: list[Company], save_path: str) -> None:
+    companies_type = os.path.basename(os.path.normpath(save_path))
+    save_companies_snapshot(companies, companies_type)
+
+def save_companies_snapshot(companies: list[Company], companies_type: str) -> str:
+    """Records today's snapshot in the watchlist's store (an unchanged content is not stored twice),
+    with the aligned price matrix of that version."""
+    store = get_companies_store(companies_type)
+    version = store.save(encode_companies_file(companies, get_companies_file_extension()), get_companies_file_extension())
+    filepath = store.get_path(version)
     print(f"✅ Saved company data to {filepath}")
+    save_missing_price_matrix(filepath, companies)
+    remove_stale_price_matrices([store.get_path(kept) for kept in store.versions()])
+    return filepath
+
+def save_missing_price_matrix(filepath: str, companies: Optional[list[Company]] = None) -> None:
+    """Saves the price matrix of a snapshot version that has none yet (reading the version if `companies` is not given)."""
+    if os.path.isdir(get_price_matrix_folder(filepath)):
+        return
+    save_price_matrix(filepath, build_price_matrix(companies if companies is not None else read_companies_file(filepath)))
+
+def save_imported_price_matrices(filepaths: List[str]) -> None:
+    # Dated files imported into the store get their matrices here rather than on a correlation request
+    for filepath in filepaths:
+        save_missing_price_matrix(filepath)
+
+def get_companies_store(companies_type: str) -> SnapshotStore:
+    folder = get_companies_folder(companies_type)
+    legacy_suffixes = (f"-{companies_type}.json", f"-{companies_type}{COLUMNAR_EXTENSION}")
+    return get_snapshot_store(companies_type, folder, legacy_suffixes, save_imported_price_matrices)
+
+def get_companies_file_extension() -> str:
+    return COLUMNAR_EXTENSION if SNAPSHOT_FORMAT == "columnar" else ".json"
+
+def encode_companies_file(companies: list[Company], extension: str) -> bytes:
+    if extension == COLUMNAR_EXTENSION:
+        return encode_columnar_snapshot(companies)
+    json_ready_companies = [company.to_dict() for company in companies]
+    return json.dumps(json_ready_companies, ensure_ascii=False, indent=2).encode("utf-8")
+
+def read_companies_file(filepath: str) -> list[Company]:
+    """Reads a snapshot in the format given by its extension (a format switch keeps older versions readable)."""
+    if filepath.endswith(COLUMNAR_EXTENSION):
+        return read_columnar_snapshot(filepath)
+    with open(filepath, 'r', encoding='utf-8') as f:
+        companies_data = json.load(f)
+    return [Company.from_dict(data) for data in companies_data]
 
 def is_companies_data_recent(companies_type: str, max_age_days: int = 4) -> bool:
-    folder = 'data/PEA' if companies_type == 'PEA' else 'data/CTO'
-    today = date.today()
-
     try:
-        files = [f for f in os.listdir(folder) if f.endswith(f"-{companies_type}.json")]
-        dates = []
-        for file in files:
-            try:
-                date_str = file.split(f"-{companies_type}.json")[0]
-                file_date = datetime.strptime(date_str, "%Y-%m-%d").date()
-                dates.append(file_date)
-            except ValueError:
-                continue 
-        if not dates:
-            return False 
-        most_recent = max(dates)
-        age = (today - most_recent).days
-        return age <= max_age_days
-
+        return get_companies_store(companies_type).is_recent(max_age_days)
     except Exception as e:
         print(f"[{companies_type}] Erreur lors de la vérification de la date des fichiers : {e}")
         return False
 
-def buil_companies_data_from_dataframe(df: DataFrame, df_history: DataFrame) -> List[Company]:
-    companies = []
+NUMBER_PATTERN = r'-?(?:\d+\.?\d*|\.\d+)'
 
-    for i, row in df.iterrows():
-        ticker = str(row["Ticker"]).strip()
-        discount, fair_value = calculate_fair_discount_and_fair_value(row)      
-        # attractiveness_score = calculate_attractiveness_score(row)
-        attractiveness_score = calculate_long_term_quality_score(row)
-        company = {
-            "ticker": ticker,
-            "name": row["Nom"],
-            "market_cap": row["Market Cap"],
-            "currency": row["Devise"],
-            "price": row["Price"],
-            "high_price": row["Plus haut prix"],
-            "drop_from_high": row["Plus haut"],
-            "pe": safe_number(row["PE"]),
-            "daily_change": row["cours J %"],
-            "eps": safe_number(row["EPS"]),
-            "sector": row["Secteur"],
-            "fair_value_gap": safe_number(discount),
-            "fair_value": safe_number(fair_value),
-            "attractiveness_score": attractiveness_score,
-            "moat": row.get("Type de Moat principal", ""),
-            "price_history": [],
-            "price_dates": []
-        }
+def parse_float_series(values: Series, default: float = 0.0) -> np.ndarray:
+    """Vectorized parse_float: same cleaning rules and results, applied to a whole column at once.
+
+    Cells that do not hold a number get `default` (parse_float's 0.0, or NaN to tell them apart).
+    """
+    if is_numeric_dtype(values):
+        return values.astype(float).to_numpy()
 
-        # Get columns: assume (Date | Close) repeating
-        date_col_idx = i * 2
-        price_col_idx = i * 2 + 1
+    is_number = values.map(lambda v: isinstance(v, (int, float))).to_numpy(dtype=bool)
+    cleaned = (values.astype(str)
+               .str.replace(r'[^\d\-,\.]', '', regex=True)
+               .str.replace(',', '.', regex=False))
+    # Only strings float() would accept are converted (object -> float goes through float() itself)
+    valid = cleaned.str.fullmatch(NUMBER_PATTERN).fillna(False).to_numpy(dtype=bool) & ~is_number
 
-        if price_col_idx < df_history.shape[1]:
-            raw_dates = df_history.iloc[:, date_col_idx].dropna().astype(str).tolist()
-            raw_prices = df_history.iloc[:, price_col_idx].dropna().astype(str).tolist()
+    parsed = np.full(len(values), default, dtype=float)
+    parsed[valid] = cleaned[valid].to_numpy(dtype=object).astype(float)
+    parsed[is_number] = values[is_number].to_numpy(dtype=object).astype(float)
+    return parsed
 
-            price_history = []
-            price_dates = []
+def to_optional_floats(values: np.ndarray) -> list:
+    """NaN -> None, for the typed Company fields."""
+    return [None if math.isnan(value) else value for value in values.tolist()]
 
-            for date_str, price_str in zip(raw_dates, raw_prices):
-                try:
-                    price = float(price_str.replace(",", ".").replace("€", "").strip())
-                    date_only = date_str.split(" ")[0]
-                    price_history.append(price)
-                    price_dates.append(date_only)
-                except ValueError:
-                    continue
+def get_column(df: DataFrame, column: str, default: float, invalid: float = 0.0) -> np.ndarray:
+    if column not in df.columns:
+        return np.full(len(df), default, dtype=float)
+    return parse_float_series(df[column], invalid)
 
-            company["price_history"] = price_history
-            company["price_dates"] = price_dates
+def calculate_fair_discount_and_fair_value_columns(df: DataFrame) -> tuple[np.ndarray, np.ndarray]:
+    """Column version of calculate_fair_discount_and_fair_value (unrounded)."""
+    eps = get_column(df, "EPS", 0)
+    price = get_column(df, "Price", 0)
+    baseline_pe = get_sector_baselines(df)
 
-        companies.append(company)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fair_value = eps * baseline_pe
+        discount = ((fair_value - price) / fair_value) * 100
+    no_earnings = eps <= 0
+    return np.where(no_earnings, 0.0, discount), np.where(no_earnings, 0.0, fair_value)
+
+def calculate_long_term_quality_score_columns(df: DataFrame) -> np.ndarray:
+    """Column version of calculate_long_term_quality_score, same penalties applied in the same order."""
+    pe = get_column(df, "PE", 0)
+    eps = get_column(df, "EPS", 0)
+    price = get_column(df, "Price", 0)
+    high52 = get_column(df, "Plus haut prix", 0)
+    beta = get_column(df, "Beta", 1.0)
+
+    score = np.full(len(df), 100.0)
+    score = np.where(pe > 45, score * 0.4,
+            np.where(pe > 30, score * 0.6,
+            np.where(pe > 20, score * 0.8,
+            np.where(pe <= 0, 0.0, score))))
+
+    has_price = price > 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        yield_val = np.where(has_price, eps / np.where(has_price, price, 1.0), 0)
+        ratio_high = np.where(high52 > 0, price / np.where(high52 > 0, high52, 1.0), 0)
+    score = np.where(yield_val < 0.03, score * 0.7, np.where(yield_val < 0.05, score * 0.9, score))
+    score = np.where(ratio_high < 0.70, score * 0.5, np.where(ratio_high > 0.97, score * 0.9, score))
+    score = np.where(beta > 1.4, score * 0.8, np.where(beta > 1.1, score * 0.95, score))
+
+    return np.where(np.isfinite(score), np.trunc(score), 0).astype(int)
+
+def get_sector_baselines(df: DataFrame) -> np.ndarray:
+    if "Secteur" not in df.columns:
+        return np.full(len(df), DEFAULT_PE_BASELINE, dtype=float)
+    sectors = df["Secteur"].astype(str).str.lower()
+    return sectors.map(SECTOR_PE_BASELINES).fillna(DEFAULT_PE_BASELINE).to_numpy(dtype=float)
+
+def buil_companies_data_from_dataframe(df: DataFrame, df_history: DataFrame,
+                                       get_histories: HistoryLoader = get_price_histories) -> List[Company]:
+    # Scores are computed column-wise once, then records are emitted in a single pass
+    discounts, fair_values = calculate_fair_discount_and_fair_value_columns(df)
+    # attractiveness_scores = calculate_attractiveness_score(row)
+    attractiveness_scores = calculate_long_term_quality_score_columns(df)
+    has_moat = "Type de Moat principal" in df.columns
+    tickers = df["Ticker"].astype(str).str.strip().tolist()
+    price_histories = get_histories(df_history, tickers)
+
+    # Typed numeric fields are parsed here, once per column
+    prices, high_prices, pes, daily_changes, epss = (
+        to_optional_floats(get_column(df, column, np.nan, np.nan))
+        for column in SOURCE_TEXT_COLUMNS.values())
+
+    companies = []
+    for i, (ticker, row, discount, fair_value, attractiveness_score) in enumerate(zip(
+            tickers, df.to_dict('records'), discounts.tolist(), fair_values.tolist(), attractiveness_scores.tolist())):
+        price_history, price_dates = price_histories.get(ticker, (array('d'), array('i')))
+        companies.append(Company(
+            ticker=ticker,
+            name=row["Nom"],
+            market_cap=row["Market Cap"],
+            currency=row["Devise"],
+            price=prices[i],
+            high_price=high_prices[i],
+            drop_from_high=row["Plus haut"],
+            pe=pes[i],
+            daily_change=daily_changes[i],
+            eps=epss[i],
+            sector=row["Secteur"],
+            fair_value_gap=safe_number(round(discount, 2)),
+            fair_value=safe_number(round(fair_value, 2)),
+            attractiveness_score=attractiveness_score,
+            moat=row["Type de Moat principal"] if has_moat else "",
+            price_history=price_history,
+            price_dates=price_dates,
+            source_text=get_source_text({name: row.get(column) for name, column in SOURCE_TEXT_COLUMNS.items()},
+                                        {"price": prices[i], "high_price": high_prices[i], "pe": pes[i],
+                                         "daily_change": daily_changes[i], "eps": epss[i]})
+        ))
     return companies
 
+def get_latest_companies_file(companies_type: str) -> Union[str, None]:
+    return get_companies_store(companies_type).latest_path()
+
+def get_companies_file_as_of(companies_type: str, day: date) -> Union[str, None]:
+    """Snapshot that was current on `day` (None before the first one)."""
+    store = get_companies_store(companies_type)
+    version = store.as_of(day)
+    return store.get_path(version) if version else None
+
+def carry_forward_companies_file(companies_type: str) -> bool:
+    """Marks the latest snapshot as still current today when the sheets did not change. Returns False without snapshot."""
+    version = get_companies_store(companies_type).carry_forward()
+    if version is None:
+        return False
+    print(f"✅ {companies_type} unchanged, version of {version.date} still current")
+    return True
+
 def get_companies_data_from_file(companies_type: str) -> list[Company]:
-    today = date.today().isoformat()
-    filename = f"{today}-{companies_type}.json"
-    folder = 'data/PEA' if companies_type == 'PEA' else 'data/CTO'  
-    filepath = os.path.join(folder, filename)
-    if not os.path.exists(filepath):
-        print(f"File {filepath} does not exist.")
+    filepath = get_latest_companies_file(companies_type)
+    if filepath is None:
+        print(f"No {companies_type} snapshot.")
         return []
-    with open(filepath, 'r', encoding='utf-8') as f:
-        companies_data = json.load(f)
-    return [Company(**data) for data in companies_data]
+    return read_companies_file(filepath)
+
+def get_history_marks_path(companies_type: str) -> str:
+    return os.path.join(get_companies_folder(companies_type), FETCH_FOLDER, "history.marks.json")
+
+def get_history_state(companies_type: str) -> Tuple[Dict[str, PriceHistory], HistoryMarks]:
+    """Stored series and ingestion marks of the latest snapshot, empty when the marks belong to another one."""
+    latest = get_latest_companies_file(companies_type)
+    snapshot, marks = read_history_marks(get_history_marks_path(companies_type))
+    if latest is None or snapshot != latest:
+        return {}, HistoryMarks()
+    return read_stored_histories(latest), marks
+
+def read_stored_histories(filepath: str) -> Dict[str, PriceHistory]:
+    """Price series of a snapshot, copied out of its columnar file or of its price matrix (both
+    memory-mapped), never decoded from the JSON records. Empty when neither is available."""
+    if filepath.endswith(COLUMNAR_EXTENSION):
+        columnar = ColumnarSnapshotFile(filepath)
+        return {ticker: columnar.get_history(ticker) for ticker in columnar.tickers}
+    matrix = load_price_matrix(filepath)
+    return get_observed_histories(matrix) if matrix is not None else {}
+
+def save_history_marks(companies_type: str, snapshot: str, marks: HistoryMarks) -> None:
+    write_history_marks(get_history_marks_path(companies_type), snapshot, marks)
 
 def safe_number(val):
     try:
@@ -0,0 +1,166 @@
+import bisect
+from array import array
+from dataclasses import dataclass
+from typing import Dict, List, Mapping, Optional, Tuple
+
+NUMERIC_SORT_FIELDS = ("attractiveness_score", "daily_change", "eps", "fair_value", "fair_value_gap",
+                       "high_price", "pe", "price", "return_ytd", "return_1y", "return_5y", "volatility_1y",
+                       "max_drawdown")
+TEXT_SORT_FIELDS = ("name", "sector", "ticker")
+SORT_FIELDS = NUMERIC_SORT_FIELDS + TEXT_SORT_FIELDS
+# Scalar values a snapshot hands over to build its index
+INDEXED_FIELDS = SORT_FIELDS
+QUERY_PARAMS = ("sort", "sector", "min", "max", "limit", "cursor")
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 1000
+
+
+@dataclass
+class WatchlistQuery:
+    """One page of a watchlist: ?sort=[-]field&sector=&min=&max=&limit=&cursor=.
+
+    min/max bound the sort field; companies without a value for it come last, in both directions,
+    and are left out when a bound is given.
+    """
+    sort: Optional[str]
+    descending: bool
+    sector: Optional[str]
+    min: Optional[float]
+    max: Optional[float]
+    limit: int
+    offset: int
+    version: Optional[str]
+
+
+def parse_watchlist_query(params: Mapping[str, str]) -> Optional[WatchlistQuery]:
+    """None when no paging parameter is given (the whole watchlist is served). Raises ValueError on bad input."""
+    if not any(params.get(name) for name in QUERY_PARAMS):
+        return None
+    sort = params.get("sort") or None
+    descending = bool(sort) and sort.startswith("-")
+    if descending:
+        sort = sort[1:]
+    if sort is not None and sort not in SORT_FIELDS:
+        raise ValueError(f"sort must be one of {', '.join(SORT_FIELDS)} (prefixed with - for descending)")
+
+    bounds = []
+    for name in ("min", "max"):
+        value = params.get(name)
+        if not value:
+            bounds.append(None)
+            continue
+        if sort not in NUMERIC_SORT_FIELDS:
+            raise ValueError(f"{name} needs a numeric sort field")
+        try:
+            bounds.append(float(value))
+        except ValueError:
+            raise ValueError(f"{name} must be a number") from None
+
+    try:
+        limit = int(params.get("limit") or DEFAULT_PAGE_SIZE)
+    except ValueError:
+        raise ValueError("limit must be an integer") from None
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+
+    offset, version = 0, None
+    cursor = params.get("cursor")
+    if cursor:
+        version, _, position = cursor.partition(".")
+        if not position.isdigit():
+            raise ValueError("Invalid cursor")
+        offset = int(position)
+    return WatchlistQuery(sort, descending, params.get("sector") or None, bounds[0], bounds[1], limit, offset, version)
+
+
+def _is_set(value, numeric: bool) -> bool:
+    if numeric:
+        return isinstance(value, (int, float)) and not isinstance(value, bool) and value == value
+    return isinstance(value, str)
+
+
+class Ordering:
+    """Positions of one sector bucket (or the whole list) sorted by one field.
+
+    `values` runs parallel to `positions` so min/max bounds are two bisects; `nulls` holds the
+    positions without a value, in list order.
+    """
+
+    def __init__(self, positions: array, values, nulls: array):
+        self.positions = positions
+        self.values = values
+        self.nulls = nulls
+
+
+class WatchlistIndex:
+    """Sorted position arrays per field and per sector bucket, built once per snapshot version.
+
+    A page is then a bisect per bound and a slice: O(page size + log n), whatever the list size.
+    """
+
+    def __init__(self, version: str, tickers: List[str], rows: List[list]):
+        self.version = version
+        self.tickers = tickers
+        columns = dict(zip(INDEXED_FIELDS, zip(*rows))) if rows else {name: () for name in INDEXED_FIELDS}
+
+        sectors = columns["sector"]
+        buckets: Dict[Optional[str], array] = {None: array('i', range(len(tickers)))}
+        # Buckets each position belongs to: the whole list and its sector's
+        memberships: List[Tuple[Optional[str], ...]] = []
+        for position, sector in enumerate(sectors):
+            if isinstance(sector, str):
+                buckets.setdefault(sector, array('i')).append(position)
+                memberships.append((None, sector))
+            else:
+                memberships.append((None,))
+
+        # (sector or None, sort field or None) -> Ordering; the None field keeps the list order
+        self.orderings: Dict[Tuple[Optional[str], Optional[str]], Ordering] = {
+            (sector, None): Ordering(positions, None, array('i')) for sector, positions in buckets.items()
+        }
+        for name in SORT_FIELDS:
+            numeric = name in NUMERIC_SORT_FIELDS
+            column = columns[name]
+            ordered = sorted((position for position in range(len(tickers)) if _is_set(column[position], numeric)),
+                             key=column.__getitem__)
+            nulls = [position for position in range(len(tickers)) if not _is_set(column[position], numeric)]
+            # Splitting the global order keeps every bucket sorted without sorting it again
+            split: Dict[Optional[str], Tuple[array, list, array]] = {
+                sector: (array('i'), array('d') if numeric else [], array('i')) for sector in buckets
+            }
+            for position in ordered:
+                for sector in memberships[position]:
+                    split[sector][0].append(position)
+                    split[sector][1].append(column[position])
+            for position in nulls:
+                for sector in memberships[position]:
+                    split[sector][2].append(position)
+            for sector, (positions, values, missing) in split.items():
+                self.orderings[(sector, name)] = Ordering(positions, values, missing)
+
+    def select(self, query: WatchlistQuery) -> Tuple[List[str], int]:
+        """Tickers of the requested page and the number of companies matching the query."""
+        ordering = self.orderings.get((query.sector, query.sort))
+        if ordering is None:
+            return [], 0
+        low, high = 0, len(ordering.positions)
+        if query.min is not None:
+            low = bisect.bisect_left(ordering.values, query.min)
+        if query.max is not None:
+            high = bisect.bisect_right(ordering.values, query.max)
+        matched = max(high - low, 0)
+        nulls = ordering.nulls if query.min is None and query.max is None else ()
+        total = matched + len(nulls)
+
+        start, end = min(query.offset, total), min(query.offset + query.limit, total)
+        if query.descending:
+            # Walks the sorted positions backwards from the top of the range
+            page = list(ordering.positions[max(high - end, low):high - start][::-1]) if start < matched else []
+        else:
+            page = list(ordering.positions[low + start:low + min(end, matched)])
+        page += nulls[max(start - matched, 0):max(end - matched, 0)]
+        return [self.tickers[position] for position in page], total
+
+    def next_cursor(self, query: WatchlistQuery, total: int) -> Optional[str]:
+        end = query.offset + query.limit
+        return f"{self.version}.{end}" if end < total else None
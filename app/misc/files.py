@@ -0,0 +1,32 @@
+import os
+import tempfile
+from typing import Optional, Tuple
+
+FileKey = Optional[Tuple[str, int, int]]
+
+
+def get_file_key(filepath: str) -> FileKey:
+    """Identity of a file as (path, mtime, size), or None if it does not exist."""
+    try:
+        stat = os.stat(filepath)
+    except OSError:
+        return None
+    return filepath, stat.st_mtime_ns, stat.st_size
+
+
+def write_atomic(filepath: str, data: bytes) -> None:
+    """Writes to a temporary file in the same folder and swaps it in, so readers never see a partial file."""
+    folder = os.path.dirname(filepath) or "."
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=folder, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, filepath)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
@@ -0,0 +1,8 @@
+from flask import Response, request
+
+
+def encoded_json_response(body: bytes, etag: str, status: int = 200) -> Response:
+    """Serves pre-encoded JSON bytes and answers If-None-Match with a 304."""
+    response = Response(body, status=status, mimetype="application/json")
+    response.set_etag(etag)
+    return response.make_conditional(request)
@@ -0,0 +1,53 @@
+import copy
+import json
+import sys
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from app.mocks.mock_response import GLOBAL_QUOTE, OVERVIEW, TIME_SERIES_MONTHLY_ADJUSTED
+
+# Local stand-in for https://www.alphavantage.co/query, serving the recorded AAPL payloads
+# under whatever symbol is requested:
+#   python -m app.mocks.mock_server 8001
+#   ALPHA_VANTAGE_URL=http://127.0.0.1:8001/query COMPANIES_SOURCE=alphavantage ...
+
+def make_mock_payload(function: str, symbol: str) -> dict:
+    if function == "OVERVIEW":
+        payload = copy.deepcopy(OVERVIEW)
+        payload["Symbol"] = symbol
+        return payload
+    if function == "GLOBAL_QUOTE":
+        payload = copy.deepcopy(GLOBAL_QUOTE)
+        payload["Global Quote"]["01. symbol"] = symbol
+        return payload
+    if function == "TIME_SERIES_MONTHLY_ADJUSTED":
+        payload = copy.deepcopy(TIME_SERIES_MONTHLY_ADJUSTED)
+        payload["Meta Data"]["2. Symbol"] = symbol
+        return payload
+    return {"Error Message": f"Invalid API call: unknown function {function}"}
+
+
+class MockAlphaVantageHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        function = query.get("function", [""])[0]
+        symbol = query.get("symbol", [""])[0]
+        body = json.dumps(make_mock_payload(function, symbol)).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def run_mock_server(port: int = 8001) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", port), MockAlphaVantageHandler)
+    print(f"Mock Alpha Vantage listening on http://127.0.0.1:{port}/query")
+    return server
+
+
+if __name__ == "__main__":
+    run_mock_server(int(sys.argv[1]) if len(sys.argv) > 1 else 8001).serve_forever()
@@ -1,22 +1,186 @@
+import re
+import sys
+from array import array
 from dataclasses import dataclass
-from typing import List
+from datetime import date, datetime
+from functools import lru_cache
+from typing import Dict, Iterable, Mapping, Optional, Tuple
 
-@dataclass
+NUMBER_CLEANUP = re.compile(r'[^\d\-,\.]')
+# Typed fields served as the source wrote them ("$301.09", "110,46"), when it gave text
+SOURCE_TEXT_FIELDS = ("price", "high_price", "pe", "daily_change", "eps")
+# Served price_dates format, the one of the history sheet
+PRICE_DATE_FORMAT = "%d/%m/%Y"
+
+
+def parse_optional_float(value) -> Optional[float]:
+    """parse_float rules (keep digits, comma as decimal point), but None when there is no number."""
+    if value is None or isinstance(value, bool):
+        return None if value is None else float(value)
+    if isinstance(value, (int, float)):
+        return None if value != value else float(value)
+    try:
+        return float(NUMBER_CLEANUP.sub('', str(value)).replace(',', '.'))
+    except ValueError:
+        return None
+
+
+def to_day_ordinal(value) -> Optional[int]:
+    """Day ordinal from an ordinal, an ISO date or a dd/mm/yyyy sheet date (time part ignored)."""
+    if isinstance(value, int):
+        return value
+    return _parse_day(str(value).strip().split(" ")[0])
+
+
+@lru_cache(maxsize=65536)
+def _parse_day(text: str) -> Optional[int]:
+    # A few thousand distinct trading days are shared by every ticker's history
+    try:
+        return date.fromisoformat(text[:10]).toordinal()
+    except ValueError:
+        pass
+    try:
+        return datetime.strptime(text, PRICE_DATE_FORMAT).toordinal()
+    except ValueError:
+        return None
+
+
+@lru_cache(maxsize=65536)
+def format_day(ordinal: int) -> str:
+    """Day ordinal as served in price_dates (dd/mm/yyyy)."""
+    return date.fromordinal(ordinal).strftime(PRICE_DATE_FORMAT)
+
+
+def get_source_text(texts: Mapping[str, object], values: Mapping[str, Optional[float]]) -> Optional[Dict[str, str]]:
+    """`source_text` of a record from the raw `texts` of the SOURCE_TEXT_FIELDS and their parsed `values`.
+
+    Only string values are kept, interned (a sheet repeats "N/A", "-", "0%"...). A text that is the
+    canonical formatting of its value is stored as "" and served back as repr(value). None when no
+    field was given as text, so number-only records carry no dict at all.
+    """
+    source_text = {}
+    for name, text in texts.items():
+        if isinstance(text, str):
+            value = values[name]
+            source_text[name] = "" if value is not None and text == repr(value) else sys.intern(text)
+    return source_text or None
+
+
+def build_price_series(prices: Iterable, dates: Iterable) -> Tuple[array, array]:
+    """Typed (array('d') prices, array('i') day ordinals), dropping points without a usable date or price."""
+    price_history = array('d')
+    price_dates = array('i')
+    for price, day in zip(prices, dates):
+        ordinal = to_day_ordinal(day)
+        value = parse_optional_float(price)
+        if ordinal is None or value is None:
+            continue
+        price_history.append(value)
+        price_dates.append(ordinal)
+    return price_history, price_dates
+
+
+@dataclass(slots=True)
 class Company:
+    """Typed, slotted company record.
+
+    Numeric fields are parsed once at ingest, the price history is held in contiguous buffers
+    (array('d') prices, array('i') day ordinals). `to_dict` produces the JSON shape served by the API:
+    the source text of the SOURCE_TEXT_FIELDS (kept in `source_text`) and dd/mm/yyyy price_dates.
+    """
     ticker: str
     name: str
-    market_cap: str
+    market_cap: str  # kept as written by the source, it carries its own unit (M, Md, T...)
     currency: str
-    price: str
-    high_price: str
+    price: Optional[float]
+    high_price: Optional[float]
     drop_from_high: str
-    pe: str
-    daily_change: str
-    eps: str
+    pe: Optional[float]
+    daily_change: Optional[float]
+    eps: Optional[float]
     sector: str
     moat: str
-    price_history: List[float]
-    price_dates: List[str]
-    fair_value_gap: float
-    fair_value: float
+    price_history: array
+    price_dates: array
+    fair_value_gap: Optional[float]
+    fair_value: Optional[float]
     attractiveness_score: int
+    # Price analytics, computed once per build (percentages; None when the history is too short)
+    return_ytd: Optional[float] = None
+    return_1y: Optional[float] = None
+    return_5y: Optional[float] = None
+    volatility_1y: Optional[float] = None
+    max_drawdown: Optional[float] = None
+    ma_50: Optional[float] = None
+    ma_200: Optional[float] = None
+    # Source text of the SOURCE_TEXT_FIELDS given as strings (see get_source_text); internal, not a served field
+    source_text: Optional[Dict[str, str]] = None
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Company":
+        """Builds a record from a JSON snapshot entry or raw source values (strings are parsed here)."""
+        price_history, price_dates = build_price_series(data.get("price_history") or [], data.get("price_dates") or [])
+        values = {name: parse_optional_float(data.get(name)) for name in SOURCE_TEXT_FIELDS}
+        return cls(
+            ticker=data["ticker"],
+            name=data.get("name"),
+            market_cap=data.get("market_cap"),
+            currency=data.get("currency"),
+            price=values["price"],
+            high_price=values["high_price"],
+            drop_from_high=data.get("drop_from_high"),
+            pe=values["pe"],
+            daily_change=values["daily_change"],
+            eps=values["eps"],
+            sector=data.get("sector"),
+            moat=data.get("moat"),
+            price_history=price_history,
+            price_dates=price_dates,
+            fair_value_gap=parse_optional_float(data.get("fair_value_gap")),
+            fair_value=parse_optional_float(data.get("fair_value")),
+            attractiveness_score=int(data.get("attractiveness_score") or 0),
+            return_ytd=parse_optional_float(data.get("return_ytd")),
+            return_1y=parse_optional_float(data.get("return_1y")),
+            return_5y=parse_optional_float(data.get("return_5y")),
+            volatility_1y=parse_optional_float(data.get("volatility_1y")),
+            max_drawdown=parse_optional_float(data.get("max_drawdown")),
+            ma_50=parse_optional_float(data.get("ma_50")),
+            ma_200=parse_optional_float(data.get("ma_200")),
+            source_text=get_source_text({name: data.get(name) for name in SOURCE_TEXT_FIELDS}, values),
+        )
+
+    def get_served(self, name: str):
+        """Served value of a SOURCE_TEXT_FIELDS field: its source text when it was given as one."""
+        value = getattr(self, name)
+        text = self.source_text.get(name) if self.source_text else None
+        if text is None:
+            return value
+        return text or repr(value)
+
+    def to_dict(self) -> dict:
+        return {
+            "ticker": self.ticker,
+            "name": self.name,
+            "market_cap": self.market_cap,
+            "currency": self.currency,
+            "price": self.get_served("price"),
+            "high_price": self.get_served("high_price"),
+            "drop_from_high": self.drop_from_high,
+            "pe": self.get_served("pe"),
+            "daily_change": self.get_served("daily_change"),
+            "eps": self.get_served("eps"),
+            "sector": self.sector,
+            "moat": self.moat,
+            "price_history": self.price_history.tolist(),
+            "price_dates": [format_day(ordinal) for ordinal in self.price_dates],
+            "fair_value_gap": self.fair_value_gap,
+            "fair_value": self.fair_value,
+            "attractiveness_score": self.attractiveness_score,
+            "return_ytd": self.return_ytd,
+            "return_1y": self.return_1y,
+            "return_5y": self.return_5y,
+            "volatility_1y": self.volatility_1y,
+            "max_drawdown": self.max_drawdown,
+            "ma_50": self.ma_50,
+            "ma_200": self.ma_200,
+        }
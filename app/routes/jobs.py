@@ -0,0 +1,6 @@
+from . import api
+from app.controllers.jobs_controller import get_job_data
+
+@api.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    return get_job_data(job_id)
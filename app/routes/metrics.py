@@ -0,0 +1,10 @@
+from flask import jsonify
+from app.domain.planner_domain import get_last_plan_report
+from app.domain.refresh_lock_domain import get_refresh_metrics
+from . import api
+
+@api.route('/metrics', methods=['GET'])
+def get_metrics():
+    metrics = get_refresh_metrics()
+    metrics["planner"] = get_last_plan_report()
+    return jsonify(metrics)
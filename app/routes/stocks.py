@@ -1,5 +1,6 @@
+from flask import request
 from . import api
-from app.controllers.stocks_controller import get_company_data, load_companies_data
+from app.controllers.stocks_controller import get_companies_batch_data, get_company_data, get_company_history_data, get_watchlist_correlation_data, get_watchlist_data, load_companies_data, post_companies_batch_data
 
 @api.route('/load_companies', methods=['POST'])
 def load_companies():
@@ -7,7 +8,33 @@ def load_companies():
 
 @api.route('/company/<ticker>', methods=['GET'])
 def get_company(ticker):
-    return get_company_data(ticker)
+    return get_company_data(ticker, request.args.get('fields'), request.args.get('exclude'),
+                            request.args.get('points'), request.args.get('algo'),
+                            request.args.get('from'), request.args.get('to'))
+
+@api.route('/company/<ticker>/history', methods=['GET'])
+def get_company_history(ticker):
+    return get_company_history_data(ticker, request.args.get('points'), request.args.get('algo'),
+                                    request.args.get('from'), request.args.get('to'))
+
+@api.route('/companies', methods=['GET'])
+def get_companies():
+    return get_companies_batch_data(request.args.get('tickers', '').split(','),
+                                    request.args.get('fields'), request.args.get('exclude'))
+
+@api.route('/companies', methods=['POST'])
+def post_companies():
+    return post_companies_batch_data(request.get_json(silent=True))
+
+@api.route('/watchlists/<name>', methods=['GET'])
+def get_watchlist(name):
+    return get_watchlist_data(name, request.args.get('as_of'), request.args.get('fields'), request.args.get('exclude'),
+                              request.args)
+
+@api.route('/watchlists/<name>/correlation', methods=['GET'])
+def get_watchlist_correlation(name):
+    return get_watchlist_correlation_data(name, request.args.get('window'), request.args.get('frequency'),
+                                          request.args.get('kind'))
 
 # @api.route('/stock/<ticker>', methods=['GET'])
 # def get_stock(ticker):
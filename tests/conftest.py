@@ -0,0 +1,68 @@
+import os
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+# Read by app.config at import: every lock, job and snapshot of the test run stays out of ./data
+os.environ.setdefault("DATA_FOLDER", tempfile.mkdtemp(prefix="bam-tests-"))
+
+
+class SheetServer:
+    """Local stand-in for the published Google Sheets CSVs.
+
+    `sheets` maps a path to its CSV bytes; with `etags` on, each sheet is served with an ETag and
+    a matching If-None-Match gets a 304. `requests` records (path, status) of every call.
+    """
+
+    def __init__(self):
+        self.sheets = {}
+        self.etags = True
+        self.requests = []
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._make_handler())
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def url(self, path: str) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}/{path}"
+
+    def _make_handler(self):
+        sheet_server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.lstrip("/")
+                body = sheet_server.sheets.get(path)
+                if body is None:
+                    sheet_server.requests.append((path, 404))
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                etag = f'"{hash(body) & 0xffffffff:x}"'
+                if sheet_server.etags and self.headers.get("If-None-Match") == etag:
+                    sheet_server.requests.append((path, 304))
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                sheet_server.requests.append((path, 200))
+                self.send_response(200)
+                self.send_header("Content-Type", "text/csv")
+                self.send_header("Content-Length", str(len(body)))
+                if sheet_server.etags:
+                    self.send_header("ETag", etag)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+@pytest.fixture
+def sheet_server():
+    server = SheetServer()
+    server.thread.start()
+    yield server
+    server.server.shutdown()
+    server.server.server_close()
@@ -0,0 +1,84 @@
+import os
+import threading
+import time
+
+import pytest
+
+from app.domain import alphavantage_domain, planner_domain, response_cache_domain
+from app.domain.alphavantage_domain import COMPANY_FUNCTIONS, TokenBucket, fetch_watchlists_data
+from app.mocks import mock_server
+
+QUOTA_REPLY = {"Information": "We have detected your API key and our standard API rate limit is 25 requests per day."}
+
+
+@pytest.fixture
+def alpha_vantage(monkeypatch, tmp_path):
+    """app/mocks/mock_server.py on a free port, with a fresh cache and usage file and no pacing.
+
+    Yields the list of (function, symbol) requested from the mock.
+    """
+    requests = []
+    make_payload = mock_server.make_mock_payload
+
+    def recording_payload(function, symbol):
+        requests.append((function, symbol))
+        return make_payload(function, symbol)
+
+    monkeypatch.setattr(mock_server, "make_mock_payload", recording_payload)
+    server = mock_server.run_mock_server(0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    monkeypatch.setattr(alphavantage_domain, "ALPHA_VANTAGE_URL", f"http://127.0.0.1:{server.server_address[1]}/query")
+    monkeypatch.setattr(alphavantage_domain, "rate_limiter", TokenBucket(1000, 100))
+    monkeypatch.setattr(response_cache_domain, "CACHE_FOLDER", str(tmp_path / "cache"))
+    for name in ("REQUEST_COUNTS_PATH", "USAGE_PATH", "LAST_PLAN_PATH"):
+        monkeypatch.setattr(planner_domain, name, str(tmp_path / f"{name.lower()}.json"))
+    yield requests
+    server.shutdown()
+    server.server_close()
+
+
+def expire_cache(ticker: str) -> None:
+    long_ago = time.time() - 365 * 24 * 3600
+    for function in COMPANY_FUNCTIONS:
+        os.utime(response_cache_domain.get_cache_path(function, ticker), (long_ago, long_ago))
+
+
+def test_fetch_watchlists_from_mock_server(alpha_vantage):
+    companies = fetch_watchlists_data({"CTO": ["AAPL", "MSFT"]})
+
+    assert [company.ticker for company in companies["CTO"]] == ["AAPL", "MSFT"]
+    assert all(company.price_history for company in companies["CTO"])
+    assert sorted(alpha_vantage) == sorted((function, ticker) for ticker in ("AAPL", "MSFT")
+                                           for function in COMPANY_FUNCTIONS)
+    assert planner_domain.get_calls_used_today() == 6
+
+
+def test_quota_reply_is_not_retried_and_serves_stale_cache(alpha_vantage, monkeypatch):
+    fetch_watchlists_data({"CTO": ["AAPL", "MSFT"]})
+    expire_cache("AAPL")
+    expire_cache("MSFT")
+    alpha_vantage.clear()
+
+    def quota_payload(function, symbol):
+        alpha_vantage.append((function, symbol))
+        return QUOTA_REPLY
+
+    monkeypatch.setattr(mock_server, "make_mock_payload", quota_payload)
+    monkeypatch.setattr(alphavantage_domain, "RETRY_BASE_DELAY", 0)
+    monkeypatch.setattr(alphavantage_domain, "ALPHA_VANTAGE_MAX_WORKERS", 1)
+
+    companies = fetch_watchlists_data({"CTO": ["AAPL", "MSFT"]})
+
+    # The first quota reply ends the cycle: no retry, no further call
+    assert len(alpha_vantage) == 1
+    assert alphavantage_domain.quota_exhausted.is_set()
+    assert [company.ticker for company in companies["CTO"]] == ["AAPL", "MSFT"]
+
+
+def test_quota_flag_is_reset_on_next_cycle(alpha_vantage):
+    alphavantage_domain.quota_exhausted.set()
+    companies = fetch_watchlists_data({"CTO": ["AAPL"]})
+
+    assert [company.ticker for company in companies["CTO"]] == ["AAPL"]
+    assert len(alpha_vantage) == len(COMPANY_FUNCTIONS)
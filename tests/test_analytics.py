@@ -0,0 +1,74 @@
+import math
+from array import array
+from datetime import date, timedelta
+
+import numpy as np
+import pytest
+
+from app.domain.analytics_domain import compute_price_analytics
+from app.models.companies import Company
+
+
+def company(ticker, closes, days):
+    return Company(ticker=ticker, name=ticker, market_cap="", currency="USD", price=closes[-1], high_price=None,
+                   drop_from_high="", pe=None, daily_change=None, eps=None, sector="", moat="",
+                   price_history=array('d', closes), price_dates=array('i', [day.toordinal() for day in days]),
+                   fair_value_gap=None, fair_value=None, attractiveness_score=0)
+
+
+def month_ends(count, last=date(2024, 12, 31)):
+    days = []
+    year, month = last.year, last.month
+    for _ in range(count):
+        following = date(year + month // 12, month % 12 + 1, 1)
+        days.append(following - timedelta(days=1))
+        year, month = (year, month - 1) if month > 1 else (year - 1, 12)
+    return days[::-1]
+
+
+def business_days(count, last=date(2024, 12, 31)):
+    days = []
+    day = last
+    while len(days) < count:
+        if day.weekday() < 5:
+            days.append(day)
+        day -= timedelta(days=1)
+    return days[::-1]
+
+
+def expected_volatility(closes, periods, per_year):
+    returns = np.diff(np.log(closes))[-periods:]
+    return round(float(np.std(returns, ddof=1) * math.sqrt(per_year)) * 100, 2)
+
+
+def test_monthly_series_is_annualized_with_twelve_periods():
+    closes = [100.0]
+    for month in range(1, 60):
+        closes.append(closes[-1] * (1.04 if month % 3 else 0.97))
+    metrics = compute_price_analytics([company("AAPL", closes, month_ends(60))])
+
+    # 12 monthly returns end within the last year
+    assert metrics["volatility_1y"] == [pytest.approx(expected_volatility(closes, 12, 12))]
+    # Moving averages are defined in trading days, not in months
+    assert metrics["ma_50"] == [None] and metrics["ma_200"] == [None]
+
+
+def test_daily_series_keeps_trading_days():
+    closes = [100 + math.sin(day) * 5 + day * 0.1 for day in range(400)]
+    days = business_days(400)
+    metrics = compute_price_analytics([company("MSFT", closes, days)])
+
+    in_year = sum(1 for day in days[1:] if day.toordinal() > days[-1].toordinal() - 365)
+    assert metrics["volatility_1y"] == [pytest.approx(expected_volatility(closes, in_year, 252))]
+    assert metrics["ma_50"] == [round(sum(closes[-50:]) / 50, 4)]
+    assert metrics["ma_200"] == [round(sum(closes[-200:]) / 200, 4)]
+
+
+def test_daily_and_monthly_series_in_one_build():
+    monthly = [100 * 1.01 ** month for month in range(24)]
+    daily = [50 + day * 0.05 for day in range(300)]
+    metrics = compute_price_analytics([company("AAPL", monthly, month_ends(24)),
+                                       company("MSFT", daily, business_days(300))])
+
+    assert metrics["ma_50"][0] is None and metrics["ma_50"][1] is not None
+    assert metrics["return_1y"][0] == pytest.approx(round((1.01 ** 12 - 1) * 100, 2))
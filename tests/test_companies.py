@@ -0,0 +1,67 @@
+import pytest
+
+from app.domain.columnar_snapshot_domain import ColumnarSnapshotFile, encode_columnar_snapshot
+from app.domain.snapshot_domain import get_projection
+from app.models.companies import Company
+
+SHEET_ENTRY = {
+    "ticker": "MSFT",
+    "name": "Microsoft",
+    "market_cap": "3 T$",
+    "currency": "USD",
+    "price": "$301.09",
+    "high_price": "$468.35",
+    "drop_from_high": "-35,71%",
+    "pe": "110,46",
+    "daily_change": "-0,52%",
+    "eps": None,
+    "sector": "Technologie",
+    "moat": "Réseau",
+    "price_history": [300.5, 301.09],
+    "price_dates": ["02/01/2024", "03/01/2024"],
+    "fair_value_gap": 12.5,
+    "fair_value": 344.0,
+    "attractiveness_score": 40,
+}
+
+
+def test_sheet_text_and_dates_are_served_as_written():
+    company = Company.from_dict(SHEET_ENTRY)
+    assert company.price == 301.09 and company.pe == 110.46
+
+    served = company.to_dict()
+    assert {name: served[name] for name in SHEET_ENTRY} == SHEET_ENTRY
+    assert Company.from_dict(served).to_dict() == served
+
+
+def test_only_non_canonical_text_is_stored():
+    entry = dict(SHEET_ENTRY, high_price="468.35")
+    company = Company.from_dict(entry)
+    assert company.source_text == {"price": "$301.09", "high_price": "", "pe": "110,46", "daily_change": "-0,52%"}
+
+    served = company.to_dict()
+    assert served["high_price"] == "468.35" and served["price"] == "$301.09"
+    assert served["price_dates"] == ["02/01/2024", "03/01/2024"]
+    assert Company.from_dict(served).to_dict() == served
+
+    numbers = dict(SHEET_ENTRY, price=301.09, high_price=468.35, pe=110.46, daily_change=-0.52)
+    assert Company.from_dict(numbers).source_text is None
+
+
+def test_iso_dates_and_numbers_from_older_snapshots_still_load():
+    entry = dict(SHEET_ENTRY, price=301.09, price_dates=["2024-01-02", "2024-01-03"])
+    served = Company.from_dict(entry).to_dict()
+    assert served["price"] == 301.09
+    assert served["price_dates"] == ["02/01/2024", "03/01/2024"]
+
+
+def test_columnar_snapshot_keeps_source_text(tmp_path):
+    path = tmp_path / "snapshot.col"
+    path.write_bytes(encode_columnar_snapshot([Company.from_dict(SHEET_ENTRY)]))
+    assert ColumnarSnapshotFile(str(path)).get("MSFT").to_dict()["price"] == "$301.09"
+
+
+def test_source_text_is_not_a_projectable_field():
+    with pytest.raises(ValueError):
+        get_projection("source_text", None)
+    assert "source_text" not in get_projection(None, "price")
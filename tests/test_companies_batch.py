@@ -0,0 +1,42 @@
+import pytest
+from flask import Flask
+
+from app.routes import api
+
+
+@pytest.fixture
+def client():
+    app = Flask(__name__)
+    app.register_blueprint(api, url_prefix='/api')
+    return app.test_client()
+
+
+@pytest.mark.parametrize("body, error", [
+    ({"tickers": 5}, "tickers must be a list of strings or a comma-separated string"),
+    (["MSFT", "AAPL"], "The body must be a JSON object"),
+    ({"tickers": ["MSFT", 5]}, "tickers must be a list of strings or a comma-separated string"),
+    ({"tickers": ["MSFT"], "fields": ["price", None]}, "fields must be a list of strings or a comma-separated string"),
+    ({"tickers": ["MSFT"], "exclude": [["price"]]}, "exclude must be a list of strings or a comma-separated string"),
+    ({"tickers": ["MSFT"], "fields": {"price": True}}, "fields must be a list of strings or a comma-separated string"),
+    ({}, "tickers is required"),
+    ({"tickers": ["MSFT"], "fields": ["no_such_field"]}, "Unknown fields: no_such_field"),
+])
+def test_malformed_body_is_a_bad_request(client, body, error):
+    response = client.post('/api/companies', json=body)
+    assert response.status_code == 400
+    assert response.get_json() == {"error": error}
+
+
+def test_body_that_is_not_json_is_a_bad_request(client):
+    response = client.post('/api/companies', data="tickers=MSFT", content_type="text/plain")
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("body", [
+    {"tickers": ["MSFT", "AAPL"], "fields": ["price"]},
+    {"tickers": "MSFT,AAPL", "fields": "price", "exclude": None},
+])
+def test_lists_and_comma_separated_strings_are_accepted(client, body):
+    response = client.post('/api/companies', json=body)
+    assert response.status_code == 200
+    assert sorted(response.get_json()["missing"]) == ["AAPL", "MSFT"]
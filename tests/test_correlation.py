@@ -0,0 +1,78 @@
+from array import array
+from datetime import date, timedelta
+
+import numpy as np
+import pytest
+
+from app.domain.correlation_domain import CORRELATION, COVARIANCE, DAILY, WEEKLY, compute_return_matrix, parse_correlation_query
+from app.domain.price_matrix_domain import build_price_matrix
+from app.models.companies import Company
+
+FIRST_DAY = date(2024, 1, 1)
+
+
+def company(ticker, closes, days):
+    return Company(ticker=ticker, name=ticker, market_cap="", currency="USD", price=closes[-1], high_price=None,
+                   drop_from_high="", pe=None, daily_change=None, eps=None, sector="", moat="",
+                   price_history=array('d', closes), price_dates=array('i', [day.toordinal() for day in days]),
+                   fair_value_gap=None, fair_value=None, attractiveness_score=0)
+
+
+def random_closes(generator, count):
+    return (100 * np.exp(np.cumsum(generator.normal(0, 0.02, count)))).tolist()
+
+
+@pytest.fixture
+def closes():
+    generator = np.random.default_rng(7)
+    return {ticker: random_closes(generator, 60) for ticker in ("MSFT", "AAPL", "NVDA")}
+
+
+def test_aligned_series_match_numpy(closes):
+    days = [FIRST_DAY + timedelta(days=day) for day in range(60)]
+    matrix = build_price_matrix([company(ticker, values, days) for ticker, values in closes.items()])
+    returns = np.diff(np.log(np.array(list(closes.values()))), axis=1)
+
+    correlation = compute_return_matrix(matrix, None, DAILY, CORRELATION)
+    assert correlation["tickers"] == ["MSFT", "AAPL", "NVDA"]
+    np.testing.assert_allclose(correlation["matrix"], np.corrcoef(returns), rtol=1e-5)
+
+    covariance = compute_return_matrix(matrix, None, DAILY, COVARIANCE)
+    np.testing.assert_allclose(covariance["matrix"], np.cov(returns), rtol=1e-5)
+
+
+def test_pairs_use_the_returns_they_share(closes):
+    days = [FIRST_DAY + timedelta(days=day) for day in range(60)]
+    # NVDA does not trade on the days of the second half of each ten
+    gaps = [index for index in range(60) if index % 10 < 5 or index == 59]
+    matrix = build_price_matrix([company("MSFT", closes["MSFT"], days),
+                                 company("NVDA", [closes["NVDA"][index] for index in gaps], [days[index] for index in gaps])])
+
+    msft = np.diff(np.log(closes["MSFT"]))
+    # NVDA's daily return on a trading day runs from its previous close
+    nvda_closes = np.log([closes["NVDA"][index] for index in gaps])
+    shared = [gap - 1 for gap in gaps[1:]]
+    expected = np.corrcoef(msft[shared], np.diff(nvda_closes))[0, 1]
+
+    correlation = compute_return_matrix(matrix, None, DAILY, CORRELATION)["matrix"]
+    assert correlation[0][1] == correlation[1][0] == pytest.approx(expected, rel=1e-5)
+    assert correlation[0][0] == correlation[1][1] == 1.0
+
+
+def test_window_and_weekly_frequency(closes):
+    days = [FIRST_DAY + timedelta(days=day) for day in range(60)]
+    matrix = build_price_matrix([company(ticker, values, days) for ticker, values in closes.items()])
+
+    weekly = compute_return_matrix(matrix, 28, WEEKLY, COVARIANCE)
+    # Closes of the Sundays within the last 28 days, then of the last day
+    rows = [index for index in range(31, 59) if days[index].weekday() == 6] + [59]
+    returns = np.diff(np.log(np.array(list(closes.values()))[:, rows]), axis=1)
+    np.testing.assert_allclose(weekly["matrix"], np.cov(returns), rtol=1e-5)
+    assert (weekly["from"], weekly["to"]) == (days[rows[1]].isoformat(), days[59].isoformat())
+
+
+@pytest.mark.parametrize("window, frequency, kind", [("0", None, None), ("abc", None, None),
+                                                      (None, "hourly", None), (None, None, "beta")])
+def test_bad_parameters_are_rejected(window, frequency, kind):
+    with pytest.raises(ValueError):
+        parse_correlation_query(window, frequency, kind)
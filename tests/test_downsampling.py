@@ -0,0 +1,54 @@
+import math
+from array import array
+
+import numpy as np
+import pytest
+
+from app.domain.downsampling_domain import LTTB, MINMAX, STRIDE, downsample_series, parse_downsampling
+
+
+def series(points):
+    prices = array('d', [100 + 10 * math.sin(day / 7) + (25 if day == 333 else 0) for day in range(points)])
+    return prices, array('i', range(738000, 738000 + points))
+
+
+@pytest.mark.parametrize("algo", [LTTB, MINMAX, STRIDE])
+def test_ends_are_kept_within_the_point_budget(algo):
+    prices, dates = series(1000)
+    sampled, sampled_dates = downsample_series(prices, dates, 50, algo)
+    assert len(sampled) == len(sampled_dates) <= 50
+    assert (sampled_dates[0], sampled_dates[-1]) == (dates[0], dates[-1])
+    assert list(sampled_dates) == sorted(set(sampled_dates))
+    # Every point kept is one of the series
+    assert all(prices[day - dates[0]] == price for price, day in zip(sampled, sampled_dates))
+
+
+@pytest.mark.parametrize("algo", [LTTB, MINMAX])
+def test_spike_survives(algo):
+    prices = array('d', [100 + day * 0.01 + (30 if day == 333 else 0) for day in range(1000)])
+    dates = array('i', range(738000, 739000))
+    sampled, sampled_dates = downsample_series(prices, dates, 50, algo)
+    assert 738333 in sampled_dates and max(sampled) == max(prices)
+
+
+def test_lttb_returns_exactly_the_points_asked_for():
+    prices, dates = series(1000)
+    assert len(downsample_series(prices, dates, 50, LTTB)[0]) == 50
+
+
+def test_short_series_is_returned_as_is():
+    prices, dates = series(20)
+    assert downsample_series(prices, dates, 50, LTTB) == (prices, dates)
+
+
+def test_minmax_keeps_each_bucket_extremes():
+    prices, dates = series(1000)
+    sampled, _ = downsample_series(prices, dates, 102, MINMAX)
+    assert min(sampled) == min(prices)
+    assert np.isin(np.frombuffer(sampled), np.frombuffer(prices)).all()
+
+
+@pytest.mark.parametrize("points, algo", [("x", LTTB), ("2", LTTB), ("100000", LTTB), ("100", "spline")])
+def test_bad_parameters_are_rejected(points, algo):
+    with pytest.raises(ValueError):
+        parse_downsampling(points, algo)
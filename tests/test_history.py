@@ -0,0 +1,129 @@
+import pytest
+
+from app.domain import history_domain
+from app.domain.history_domain import HistoryMarks, get_price_histories, get_price_histories_incremental
+from app.domain.ingestion_domain import get_raw_content, parse_csv
+
+TICKERS = ["MSFT", "AAPL"]
+HEADER = "MSFT Date,MSFT Close,AAPL Date,AAPL Close"
+ROWS = [
+    "02/01/2024 16:00:00,\"370,87\",02/01/2024 16:00:00,\"185,64\"",
+    "03/01/2024 16:00:00,\"370,60\",03/01/2024 16:00:00,\"184,25\"",
+    "04/01/2024 16:00:00,\"367,94\",,",
+]
+
+
+def sheet(rows):
+    return parse_csv(("\n".join([HEADER] + rows) + "\n").encode("utf-8"), header=0)
+
+
+@pytest.fixture
+def segments(monkeypatch):
+    """(ticker, start row, end row) of every segment the incremental parse reads."""
+    read = []
+    melt = history_domain.melt_pair_segments
+
+    def recording_melt(values, pair_segments, first_row=0):
+        read.extend((ticker, start, end) for ticker, _, start, end in pair_segments if end > start)
+        return melt(values, pair_segments, first_row)
+
+    monkeypatch.setattr(history_domain, "melt_pair_segments", recording_melt)
+    return read
+
+
+def ingest(df, previous=None, marks=None, previous_df=None):
+    return get_price_histories_incremental(df, TICKERS, previous or {}, marks or HistoryMarks(),
+                                           get_raw_content(df), get_raw_content(previous_df) if previous_df is not None else None)
+
+
+def test_appended_rows_only_are_read(segments):
+    first = sheet(ROWS)
+    histories, marks = ingest(first)
+    segments.clear()
+
+    # AAPL's new row lands on a line that already held MSFT's last close
+    rows = [ROWS[0], ROWS[1], "04/01/2024 16:00:00,\"367,94\",04/01/2024 16:00:00,\"181,91\"",
+            "05/01/2024 16:00:00,\"367,75\",,"]
+    df = sheet(rows)
+    histories, new_marks = ingest(df, histories, marks, first)
+
+    assert sorted(segments) == [("AAPL", 2, 3), ("MSFT", 3, 4)]
+    assert histories == get_price_histories(df, TICKERS)
+    assert new_marks.tickers["MSFT"].rows == 4 and new_marks.tickers["MSFT"].points == 4
+
+
+def test_edited_cell_rebuilds_its_ticker_only(segments):
+    first = sheet(ROWS)
+    histories, marks = ingest(first)
+    segments.clear()
+
+    df = sheet([ROWS[0].replace("185,64", "186,00"), ROWS[1], ROWS[2]])
+    histories, _ = ingest(df, histories, marks, first)
+
+    assert segments == [("AAPL", 0, 2)]
+    assert histories == get_price_histories(df, TICKERS)
+
+
+def test_without_previous_copy_everything_is_rebuilt(segments):
+    first = sheet(ROWS)
+    histories, marks = ingest(first)
+    segments.clear()
+
+    df = sheet(ROWS + ["05/01/2024 16:00:00,\"367,75\",,"])
+    histories, _ = ingest(df, histories, marks)
+
+    assert sorted(segments) == [("AAPL", 0, 2), ("MSFT", 0, 4)]
+    assert histories == get_price_histories(df, TICKERS)
+
+
+def test_stored_series_of_another_length_is_rebuilt(segments):
+    first = sheet(ROWS)
+    histories, marks = ingest(first)
+    segments.clear()
+
+    closes, dates = histories["MSFT"]
+    histories["MSFT"] = (closes[:-1], dates[:-1])
+    df = sheet(ROWS + ["05/01/2024 16:00:00,\"367,75\",,"])
+    histories, _ = ingest(df, histories, marks, first)
+
+    assert segments == [("MSFT", 0, 4)]
+    assert histories == get_price_histories(df, TICKERS)
+
+
+def test_unchanged_head_is_not_split_again(monkeypatch, segments):
+    first = sheet(ROWS)
+    histories, marks = ingest(first)
+    # AAPL's column ends at row 2: no ticker can get new cells above it
+    assert marks.prefix_rows == 2
+    assert marks.prefix_bytes == len(("\n".join([HEADER] + ROWS[:2]) + "\n").encode("utf-8"))
+
+    split = []
+    split_lines = history_domain.split_sheet_lines
+
+    def recording_split(content, rows, offset=None):
+        lines = split_lines(content, rows, offset)
+        split.append(len(lines) if lines is not None else None)
+        return lines
+
+    monkeypatch.setattr(history_domain, "split_sheet_lines", recording_split)
+    segments.clear()
+    rows = ROWS + ["05/01/2024 16:00:00,\"367,75\",05/01/2024 16:00:00,\"181,91\""]
+    df = sheet(rows)
+    histories, new_marks = ingest(df, histories, marks, first)
+
+    assert split == [2, 1]
+    assert sorted(segments) == [("AAPL", 2, 4), ("MSFT", 3, 4)]
+    assert histories == get_price_histories(df, TICKERS)
+    assert new_marks.prefix_rows == 4
+
+
+def test_successive_appends_match_a_full_parse():
+    rows = list(ROWS)
+    df = sheet(rows)
+    histories, marks = ingest(df)
+    for day in range(5, 9):
+        previous_df = df
+        rows.append(f"0{day}/01/2024 16:00:00,\"36{day},00\",0{day}/01/2024 16:00:00,\"18{day},50\"")
+        df = sheet(rows)
+        histories, marks = ingest(df, histories, marks, previous_df)
+        assert histories == get_price_histories(df, TICKERS)
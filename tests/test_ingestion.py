@@ -0,0 +1,91 @@
+from app import create_app
+from app.controllers import realt_controller, stocks_controller
+from app.domain.fetch_domain import fetch_if_changed
+from app.domain.ingestion_domain import SheetSource, run_ingestion
+
+DATA_CSV = b"Ticker,Nom\nMSFT,Microsoft\nAAPL,Apple\n"
+HISTORY_CSV = b"MSFT Date,MSFT Close\n01/01/2024,100\n02/01/2024,101\n"
+
+
+def test_not_modified_reuses_previous_copy(sheet_server, tmp_path):
+    sheet_server.sheets["data.csv"] = DATA_CSV
+    first = fetch_if_changed(sheet_server.url("data.csv"), "data", str(tmp_path))
+    assert first.changed
+    first.commit()
+
+    second = fetch_if_changed(sheet_server.url("data.csv"), "data", str(tmp_path))
+    assert not second.changed
+    assert second.content == DATA_CSV
+    assert sheet_server.requests == [("data.csv", 200), ("data.csv", 304)]
+
+
+def test_same_sha256_is_unchanged_without_validators(sheet_server, tmp_path):
+    sheet_server.etags = False
+    sheet_server.sheets["data.csv"] = DATA_CSV
+    fetch_if_changed(sheet_server.url("data.csv"), "data", str(tmp_path)).commit()
+
+    again = fetch_if_changed(sheet_server.url("data.csv"), "data", str(tmp_path))
+    assert not again.changed
+    assert sheet_server.requests == [("data.csv", 200), ("data.csv", 200)]
+
+    sheet_server.sheets["data.csv"] = DATA_CSV + b"NVDA,Nvidia\n"
+    assert fetch_if_changed(sheet_server.url("data.csv"), "data", str(tmp_path)).changed
+
+
+def test_commit_is_required_before_a_sheet_counts_as_seen(sheet_server, tmp_path):
+    sheet_server.sheets["data.csv"] = DATA_CSV
+    fetch_if_changed(sheet_server.url("data.csv"), "data", str(tmp_path))
+    assert fetch_if_changed(sheet_server.url("data.csv"), "data", str(tmp_path)).changed
+
+
+def run_watchlist(sheet_server, folder, builds_run):
+    def build(df, df_history):
+        builds_run.append((list(df["Ticker"]), len(df_history)))
+        return len(df)
+
+    sheets = {
+        "data": SheetSource(sheet_server.url("data.csv"), {}, folder),
+        "history": SheetSource(sheet_server.url("history.csv"), {"header": 0}, folder),
+    }
+    ingestion = run_ingestion(sheets, {"watchlist": (("data", "history"), build)})
+    ingestion.commit()
+    return ingestion
+
+
+def test_data_sheet_change_rebuilds_once(sheet_server, tmp_path):
+    sheet_server.sheets["data.csv"] = DATA_CSV
+    sheet_server.sheets["history.csv"] = HISTORY_CSV
+    builds_run = []
+
+    first = run_watchlist(sheet_server, str(tmp_path), builds_run)
+    assert first.results == {"watchlist": 2} and builds_run == [(["MSFT", "AAPL"], 2)]
+
+    unchanged = run_watchlist(sheet_server, str(tmp_path), builds_run)
+    assert unchanged.unchanged == ["watchlist"] and unchanged.results == {}
+    assert len(builds_run) == 1
+
+    sheet_server.sheets["data.csv"] = DATA_CSV + b"NVDA,Nvidia\n"
+    changed = run_watchlist(sheet_server, str(tmp_path), builds_run)
+    assert changed.results == {"watchlist": 3}
+    # The unchanged history sheet came back as a 304 and was parsed from the kept copy
+    assert builds_run[1:] == [(["MSFT", "AAPL", "NVDA"], 2)]
+    assert sheet_server.requests[-2:] in ([("data.csv", 200), ("history.csv", 304)],
+                                          [("history.csv", 304), ("data.csv", 200)])
+
+    run_watchlist(sheet_server, str(tmp_path), builds_run)
+    assert len(builds_run) == 2
+
+
+def test_rent_sheet_is_fetched_with_the_watchlists(sheet_server, monkeypatch):
+    monkeypatch.setattr(realt_controller, "RENT_URL", sheet_server.url("rent.csv"))
+    sheet_server.sheets["rent.csv"] = b'Date,Rent\n01/01/2024,"$12,50"\n01/02/2024,"$13,00"\n'
+
+    ingestion = stocks_controller.download_and_parse_watchlists({}, with_rent=True)
+    assert ingestion.results == {"rent": [{"date": "2024-01-01", "rent": 12.5}, {"date": "2024-02-01", "rent": 13.0}]}
+    assert sheet_server.requests == [("rent.csv", 200)]
+
+
+def test_rent_refresher_is_not_started_without_a_sheet(monkeypatch):
+    monkeypatch.setattr(realt_controller, "RENT_URL", "")
+    create_app()
+    assert realt_controller.rent_refresher._thread is None
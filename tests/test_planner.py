@@ -0,0 +1,51 @@
+import os
+import time
+
+import pytest
+
+from app.domain import planner_domain, response_cache_domain
+from app.domain.planner_domain import get_calls_used_today, plan_refresh, record_api_call
+from app.domain.refresh_lock_domain import file_lock
+from app.domain.response_cache_domain import store_payload
+
+GLOBAL_QUOTE = "GLOBAL_QUOTE"
+
+
+@pytest.fixture(autouse=True)
+def planner_files(monkeypatch, tmp_path):
+    monkeypatch.setattr(response_cache_domain, "CACHE_FOLDER", str(tmp_path / "cache"))
+    for name in ("REQUEST_COUNTS_PATH", "USAGE_PATH", "LAST_PLAN_PATH"):
+        monkeypatch.setattr(planner_domain, name, str(tmp_path / f"{name.lower()}.json"))
+    monkeypatch.setattr(planner_domain, "_pending_calls", 0)
+
+
+def store_day_old_quote(ticker: str) -> None:
+    store_payload(GLOBAL_QUOTE, ticker, {"Global Quote": {"01. symbol": ticker}})
+    day_ago = time.time() - 24 * 3600
+    os.utime(response_cache_domain.get_cache_path(GLOBAL_QUOTE, ticker), (day_ago, day_ago))
+
+
+def test_never_fetched_ticker_comes_before_day_old_quotes():
+    tickers = [f"T{index:02d}" for index in range(30)]
+    for ticker in tickers:
+        store_day_old_quote(ticker)
+
+    plan = plan_refresh(tickers + ["NEW"], [GLOBAL_QUOTE], budget=25)
+
+    assert "NEW" in plan.planned
+    assert "NEW" not in plan.deferred
+    assert len(plan.planned) == 25 and len(plan.deferred) == 6
+
+
+def test_api_call_is_kept_pending_while_usage_file_is_locked(monkeypatch):
+    monkeypatch.setattr(planner_domain, "USAGE_LOCK_TIMEOUT", 0)
+    record_api_call()
+    with file_lock("alphavantage-usage", 0) as acquired:
+        assert acquired
+        record_api_call()
+        assert get_calls_used_today() == 2
+    assert planner_domain.read_json(planner_domain.USAGE_PATH, {})["calls"] == 1
+
+    record_api_call()
+    assert planner_domain.read_json(planner_domain.USAGE_PATH, {})["calls"] == 3
+    assert get_calls_used_today() == 3
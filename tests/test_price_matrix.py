@@ -0,0 +1,72 @@
+import json
+import os
+from array import array
+from datetime import date
+
+import numpy as np
+
+from app.domain.correlation_domain import CORRELATION, DAILY
+from app.domain.price_matrix_domain import (build_price_matrix, get_observed_histories, get_price_matrix_folder,
+                                             load_price_matrix, save_price_matrix)
+from app.domain.snapshot_domain import CompanySnapshot
+from app.domain.snapshot_store_domain import SnapshotStore
+from app.domain.stocks_domain import save_imported_price_matrices
+from app.misc.files import get_file_key
+from app.models.companies import Company
+
+
+def company(ticker, closes, days):
+    return Company(ticker=ticker, name=ticker, market_cap="", currency="USD", price=closes[-1], high_price=None,
+                   drop_from_high="", pe=None, daily_change=None, eps=None, sector="", moat="",
+                   price_history=array('d', closes), price_dates=array('i', [day.toordinal() for day in days]),
+                   fair_value_gap=None, fair_value=None, attractiveness_score=0)
+
+
+COMPANIES = [
+    company("MSFT", [370.0, 371.5, 369.0, 372.25], [date(2024, 1, day) for day in (2, 3, 4, 5)]),
+    company("AAPL", [185.5, 184.0, 186.75], [date(2024, 1, day) for day in (2, 4, 5)]),
+]
+
+
+def test_legacy_import_saves_the_matrices(tmp_path):
+    entries = [company.to_dict() for company in COMPANIES]
+    (tmp_path / "2024-01-05-CTO.json").write_text(json.dumps(entries), encoding="utf-8")
+    store = SnapshotStore("test-import", str(tmp_path), ("-CTO.json",), save_imported_price_matrices)
+
+    matrix = load_price_matrix(store.latest_path())
+    assert matrix is not None and matrix.tickers == ["MSFT", "AAPL"]
+
+
+def test_correlation_request_does_not_save_a_matrix(tmp_path):
+    path = tmp_path / "objects" / "0123abcd.json"
+    os.makedirs(path.parent)
+    path.write_text(json.dumps([company.to_dict() for company in COMPANIES]), encoding="utf-8")
+    snapshot = CompanySnapshot(get_file_key(str(path)), COMPANIES)
+
+    snapshot.get_correlation_body(None, DAILY, CORRELATION)
+    assert snapshot.price_matrix.tickers == ["MSFT", "AAPL"]
+    assert not os.path.exists(get_price_matrix_folder(str(path)))
+
+
+def test_closes_are_aligned_on_the_union_calendar():
+    matrix = build_price_matrix(COMPANIES)
+
+    assert [date.fromordinal(int(day)).day for day in matrix.dates] == [2, 3, 4, 5]
+    assert matrix.observed[:, 1].tolist() == [True, False, True, True]
+    # AAPL did not trade on the 3rd: its last close is carried forward
+    assert matrix.prices[:, 1].tolist() == [185.5, 185.5, 184.0, 186.75]
+    assert matrix.prices[:, 0].tolist() == [370.0, 371.5, 369.0, 372.25]
+
+
+def test_close_before_the_first_one_is_nan(tmp_path):
+    late = company("NVDA", [495.0, 497.5], [date(2024, 1, 4), date(2024, 1, 5)])
+    matrix = build_price_matrix(COMPANIES + [late])
+    assert np.isnan(matrix.prices[:2, 2]).all() and matrix.prices[2:, 2].tolist() == [495.0, 497.5]
+
+    path = tmp_path / "objects" / "0123abcd.json"
+    save_price_matrix(str(path), matrix)
+    loaded = load_price_matrix(str(path))
+    assert loaded.tickers == ["MSFT", "AAPL", "NVDA"]
+    np.testing.assert_array_equal(loaded.prices, matrix.prices)
+    assert get_observed_histories(loaded) == {company.ticker: (company.price_history, company.price_dates)
+                                              for company in COMPANIES + [late]}
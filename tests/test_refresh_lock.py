@@ -0,0 +1,44 @@
+import multiprocessing
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+from app.domain.refresh_lock_domain import REFRESHED, TIMED_OUT, file_lock, get_refresh_metrics, single_flight
+
+
+def never_fresh() -> bool:
+    return False
+
+
+def refresh() -> None:
+    pass
+
+
+@pytest.fixture
+def job_process():
+    # Same start method as the jobs executor: nothing is inherited from this process but the environment
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        yield pool
+
+
+def test_refresh_in_another_process_shows_in_metrics(job_process):
+    name = f"test-{uuid.uuid4().hex}"
+    assert job_process.submit(single_flight, name, never_fresh, refresh, 0).result() == REFRESHED
+
+    metrics = get_refresh_metrics()["refresh"][name]
+    assert metrics["process"] == {}
+    assert metrics["shared"][REFRESHED] == 1
+    assert metrics["shared"]["refresh_count"] == 1
+
+
+def test_waits_and_timeouts_in_another_process_show_in_metrics(job_process):
+    name = f"test-{uuid.uuid4().hex}"
+    with file_lock(name, 0) as acquired:
+        assert acquired
+        assert job_process.submit(single_flight, name, never_fresh, refresh, 0.3).result() == TIMED_OUT
+
+    shared = get_refresh_metrics()["refresh"][name]["shared"]
+    assert shared[TIMED_OUT] == 1
+    assert shared["waits"] == 1
+    assert shared["wait_seconds_max"] >= 0.3
@@ -0,0 +1,46 @@
+import json
+import os
+from datetime import date, timedelta
+
+import pytest
+
+from app.domain.snapshot_store_domain import MANIFEST_NAME, OBJECTS_FOLDER, SnapshotStore
+
+RECENT = (date.today() - timedelta(days=10)).isoformat()
+OLD = ["2023-01-05", "2023-01-20", "2023-02-10"]
+
+
+@pytest.fixture
+def store(tmp_path):
+    """Store holding three versions older than the retention window and a recent one."""
+    os.makedirs(tmp_path / OBJECTS_FOLDER)
+    versions = []
+    for day in OLD + [RECENT]:
+        filename = os.path.join(OBJECTS_FOLDER, f"{day}.json")
+        (tmp_path / filename).write_bytes(day.encode())
+        versions.append({"date": day, "last_seen": day, "hash": day, "file": filename, "size": 10, "checked_at": 0})
+    (tmp_path / MANIFEST_NAME).write_text(json.dumps({"versions": versions}), encoding="utf-8")
+    return SnapshotStore(f"test-{tmp_path.name}", str(tmp_path))
+
+
+def test_as_of_finds_the_version_current_that_day(store):
+    assert store.as_of(date(2022, 12, 31)) is None
+    assert store.as_of(date(2023, 1, 5)).date == "2023-01-05"
+    assert store.as_of(date(2023, 1, 19)).date == "2023-01-05"
+    assert store.as_of(date(2023, 6, 1)).date == "2023-02-10"
+    assert store.as_of(date.today()).date == RECENT
+
+
+def test_save_compacts_old_versions_to_one_per_month(store):
+    version = store.save(b"today", ".json")
+
+    assert [kept.date for kept in store.versions()] == ["2023-01-20", "2023-02-10", RECENT, version.date]
+    assert not os.path.exists(os.path.join(store.folder, OBJECTS_FOLDER, "2023-01-05.json"))
+    assert os.path.exists(store.get_path(store.as_of(date(2023, 1, 25))))
+
+
+def test_same_content_only_moves_last_seen(store):
+    first = store.save(b"today", ".json")
+    again = store.save(b"today", ".json")
+    assert again.file == first.file and len(store.versions()) == 4
+    assert store.is_recent(0)
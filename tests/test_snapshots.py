@@ -0,0 +1,94 @@
+import json
+from array import array
+from datetime import date, timedelta
+
+import pytest
+
+from app.domain.columnar_snapshot_domain import ColumnarSnapshotFile, encode_columnar_snapshot
+from app.domain.downsampling_domain import LTTB
+from app.domain.snapshot_domain import ColumnarCompanySnapshot, CompanySnapshot, encode_json, get_projection
+from app.misc.files import get_file_key
+from app.models.companies import Company, format_day
+
+FIRST_DAY = date(2024, 1, 1)
+
+
+def company(ticker, points, price="$301.09", return_1y=12.5):
+    days = [(FIRST_DAY + timedelta(days=day)).toordinal() for day in range(points)]
+    return Company(ticker=ticker, name=ticker.title(), market_cap="3 T$", currency="USD", price=301.09,
+                   high_price=None, drop_from_high="-35,71%", pe=30.5, daily_change=None, eps=None,
+                   sector="Technologie", moat="", price_history=array('d', [100 + day * 0.5 for day in range(points)]),
+                   price_dates=array('i', days), fair_value_gap=None, fair_value=344.0, attractiveness_score=40,
+                   return_1y=return_1y, source_text={"price": price} if price else None)
+
+
+COMPANIES = [company("MSFT", 40), company("AAPL", 0, price=None, return_1y=None), company("NVDA", 7)]
+
+
+@pytest.fixture
+def columnar(tmp_path):
+    path = tmp_path / "snapshot.col"
+    path.write_bytes(encode_columnar_snapshot(COMPANIES))
+    return ColumnarSnapshotFile(str(path))
+
+
+def test_columnar_file_round_trips_every_field(columnar):
+    assert columnar.tickers == ["MSFT", "AAPL", "NVDA"]
+    assert [record.to_dict() for record in columnar.read_all()] == [record.to_dict() for record in COMPANIES]
+    closes, dates = columnar.get_history("NVDA")
+    assert closes == COMPANIES[2].price_history and dates == COMPANIES[2].price_dates
+    assert columnar.get("AAPL").price_history == array('d') and columnar.get("TSLA") is None
+
+
+def test_columnar_snapshot_serves_the_json_snapshot_bytes(columnar):
+    json_snapshot = CompanySnapshot(None, COMPANIES)
+    snapshot = ColumnarCompanySnapshot(get_file_key(columnar.path), columnar)
+    assert snapshot.body == json_snapshot.body
+    assert json.loads(snapshot.body) == [record.to_dict() for record in COMPANIES]
+
+
+def test_projection_joins_the_requested_fragments():
+    snapshot = CompanySnapshot(None, COMPANIES)
+    names = get_projection("price,return_1y", None)
+    assert names == ("price", "return_1y", "ticker")
+
+    body, _ = snapshot.get_projected("AAPL", names)
+    # Without source text the typed value is served
+    assert body == encode_json({"price": 301.09, "return_1y": None, "ticker": "AAPL"})
+    whole, _ = snapshot.get_projected_body(names)
+    assert json.loads(whole) == [{"price": "$301.09", "return_1y": 12.5, "ticker": "MSFT"},
+                                 {"price": 301.09, "return_1y": None, "ticker": "AAPL"},
+                                 {"price": "$301.09", "return_1y": 12.5, "ticker": "NVDA"}]
+    assert snapshot.get_projected("TSLA", names) is None
+
+
+def test_excluded_fields_are_left_out():
+    names = get_projection(None, "price_history,price_dates")
+    served = json.loads(CompanySnapshot(None, COMPANIES).get_projected("MSFT", names)[0])
+    assert "price_history" not in served and "price_dates" not in served
+    assert served["drop_from_high"] == "-35,71%"
+    with pytest.raises(ValueError):
+        get_projection("price,no_such_field", None)
+
+
+def test_history_view_keeps_the_window_dates():
+    snapshot = CompanySnapshot(None, COMPANIES)
+    start, end = (FIRST_DAY + timedelta(days=10)).toordinal(), (FIRST_DAY + timedelta(days=14)).toordinal()
+    body, _ = snapshot.get_history_view("MSFT", ("price_dates", "price_history", "ticker"), (start, end), None)
+    served = json.loads(body)
+    assert served["price_dates"] == [format_day(day) for day in range(start, end + 1)]
+    assert served["price_history"] == [105.0, 105.5, 106.0, 106.5, 107.0]
+
+    # Open-ended windows bisect from either end of the series
+    body, _ = snapshot.get_history_view("MSFT", ("price_dates", "ticker"), (None, FIRST_DAY.toordinal()), None)
+    assert json.loads(body)["price_dates"] == [format_day(FIRST_DAY.toordinal())]
+
+
+def test_history_view_is_downsampled_after_the_window():
+    snapshot = CompanySnapshot(None, COMPANIES)
+    window = ((FIRST_DAY + timedelta(days=5)).toordinal(), None)
+    served = json.loads(snapshot.get_history_view("MSFT", None, window, (10, LTTB))[0])
+    assert len(served["price_history"]) == 10
+    assert served["price_dates"][0] == format_day(window[0])
+    assert served["price_dates"][-1] == format_day(COMPANIES[0].price_dates[-1])
+    assert served["return_1y"] == 12.5
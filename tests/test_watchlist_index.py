@@ -0,0 +1,85 @@
+import uuid
+
+import pytest
+
+from app.domain.columnar_snapshot_domain import ColumnarSnapshotFile, encode_columnar_snapshot
+from app.domain.shared_snapshot_domain import attach_shared_snapshot
+from app.domain.snapshot_domain import (SHARED_LAYOUT, ColumnarCompanySnapshot, CompanySnapshot, SharedCompanySnapshot,
+                                        build_shared_payload, encode_json)
+from app.domain.watchlist_index_domain import parse_watchlist_query
+from app.misc.files import get_file_key
+from app.models.companies import Company
+
+# Prices and PEs as the sheet writes them: the served records hold this text, not the floats
+ENTRIES = [
+    ("MSFT", "Technologie", "$301.09", "30,5"),
+    ("AAPL", "Technologie", "$185.64", "28,1"),
+    ("TTE", "Énergie", "€58.20", "7,9"),
+    ("LVMH", "Luxe", "€690.10", None),
+    ("NVDA", "Technologie", "$495.22", "65,3"),
+    ("OR", "Luxe", None, "34,2"),
+]
+
+
+def company(ticker, sector, price, pe):
+    return Company.from_dict({"ticker": ticker, "name": ticker, "market_cap": "", "currency": "USD", "price": price,
+                              "high_price": None, "drop_from_high": "", "pe": pe, "daily_change": None, "eps": None,
+                              "sector": sector, "moat": "", "price_history": [], "price_dates": [],
+                              "fair_value_gap": None, "fair_value": None, "attractiveness_score": 0})
+
+
+@pytest.fixture(params=["json", "columnar", "shared"])
+def snapshot(request, tmp_path):
+    companies = [company(*entry) for entry in ENTRIES]
+    path = tmp_path / "snapshot.col"
+    path.write_bytes(encode_columnar_snapshot(companies))
+    key = get_file_key(str(path))
+    if request.param == "json":
+        return CompanySnapshot(key, companies)
+    if request.param == "columnar":
+        return ColumnarCompanySnapshot(key, ColumnarSnapshotFile(str(path)))
+    shared = attach_shared_snapshot(f"test-{uuid.uuid4().hex}", key, lambda: build_shared_payload(companies), SHARED_LAYOUT)
+    return SharedCompanySnapshot(key, shared)
+
+
+def select(snapshot, **params):
+    query = parse_watchlist_query(params)
+    tickers, total = snapshot.sort_index.select(query)
+    return tickers, total, snapshot.sort_index.next_cursor(query, total)
+
+
+def test_numeric_sort_uses_the_parsed_values(snapshot):
+    tickers, total, _ = select(snapshot, sort="-price")
+    assert tickers == ["LVMH", "NVDA", "MSFT", "AAPL", "TTE", "OR"]
+    assert total == 6
+
+
+def test_bounds_filter_on_the_parsed_values(snapshot):
+    assert select(snapshot, sort="pe", min="25")[:2] == (["AAPL", "MSFT", "OR", "NVDA"], 4)
+    assert select(snapshot, sort="-pe", max="30")[:2] == (["AAPL", "TTE"], 2)
+
+
+def test_sector_pages_follow_the_cursor(snapshot):
+    first, total, cursor = select(snapshot, sort="price", sector="Technologie", limit="2")
+    assert (first, total) == (["AAPL", "MSFT"], 3)
+    rest, _, end = select(snapshot, sort="price", sector="Technologie", limit="2", cursor=cursor)
+    assert rest == ["NVDA"] and end is None
+
+
+def test_pages_serve_the_source_text(snapshot):
+    tickers, _, _ = select(snapshot, sort="price", limit="1")
+    assert snapshot.get_projected(tickers[0], ("price", "ticker"))[0] == encode_json({"price": "€58.20", "ticker": "TTE"})
+
+
+def test_companies_without_a_value_come_last_in_both_directions(snapshot):
+    pages, cursor = [], None
+    while True:
+        params = {"sort": "-pe", "limit": "4"}
+        if cursor:
+            params["cursor"] = cursor
+        tickers, total, cursor = select(snapshot, **params)
+        pages.append(tickers)
+        if cursor is None:
+            break
+    assert pages == [["NVDA", "OR", "MSFT", "AAPL"], ["TTE", "LVMH"]] and total == 6
+    assert select(snapshot, sort="pe")[0][-1] == "LVMH"